@@ -3,74 +3,174 @@ Patt Book - Retailer-Only Ledger System
 WhatsApp OTP Authentication + Automatic Customer Notifications
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response, jsonify
+from flask import Flask, Blueprint, render_template, request, make_response, jsonify, g, send_file, current_app
 from datetime import datetime, timedelta
-from database import init_db, get_db
-import sqlite3
+from database import init_db, get_db, missing_columns, sweep_idempotency_keys, IntegrityError, IDEMPOTENCY_KEY_TTL_HOURS, SCHEMA
+from rate_limiter import otp_phone_limiter, otp_ip_limiter, otp_load_shedder
+import archive
+import money
+import reconcile
+import reminders
+import repository
+import rollup
+import statements
+from whatsapp_service import get_http_session
+from profile_cache import retailer_cache
+from logging_config import configure_logging, set_request_id, reset_request_id
 import os
-import requests
 import json
 import hashlib
-import jwt
+import hmac
+import logging
+import tempfile
+import threading
+import uuid
+import zipfile
+import time
 from functools import wraps
 
-# Windsurf Compatibility Fixes
-os.environ['DISABLE_UI_CUSTOMIZATION'] = '1'
-os.environ['DISABLE_ICON_THEMES'] = '1'
-os.environ['FORCE_DEFAULT_THEME'] = '1'
-os.environ['DISABLE_FANCY_FEATURES'] = '1'
-os.environ['DISABLE_FILE_WATCHING'] = '1'
-os.environ['DISABLE_AUTO_RELOAD'] = '1'
-os.environ['DISABLE_CUSTOM_FONTS'] = '1'
-os.environ['FORCE_SIMPLE_RENDERING'] = '1'
+# Importing this module has no database or network side effects; requests
+# and jwt are imported on first use. The schema is created by init_db()
+# (python database.py, the gunicorn master, or python app.py).
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
+JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 
-# Initialize retailer-only database
-init_db()
+bp = Blueprint('main', __name__)
+
+logger = logging.getLogger(__name__)
+# One record per notification; sample it with LOG_SAMPLE_RATES under load
+send_logger = logging.getLogger(__name__ + '.sends')
 
 # WhatsApp Configuration
 WHATSAPP_PHONE_NUMBER_ID = os.environ.get('WHATSAPP_PHONE_NUMBER_ID', '')
 WHATSAPP_ACCESS_TOKEN = os.environ.get('WHATSAPP_ACCESS_TOKEN', '')
+# Point at fake_whatsapp_server.py (with TEST_MODE=false) for end-to-end tests
+WHATSAPP_API_BASE_URL = os.environ.get('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com').rstrip('/')
 TEST_MODE = os.environ.get('TEST_MODE', 'true').lower() == 'true'
 
+# Only behind a proxy that sets X-Forwarded-For (e.g. the Heroku router) may the
+# client IP be taken from its last entry; otherwise clients could pick their own
+TRUST_PROXY = os.environ.get('TRUST_PROXY', 'false').lower() == 'true'
+
+# Bearer token for the /metrics endpoints; they answer 404 while it is unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # ============================================================================ 
 # AUTHENTICATION HELPERS
 # ============================================================================
 
-def is_retailer_logged_in():
-    """Check if retailer is logged in"""
-    return 'retailer_id' in session
-
-def retailer_required(f):
-    """Decorator to require retailer authentication"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not is_retailer_logged_in():
-            return redirect(url_for('retailer_auth'))
-        return f(*args, **kwargs)
-    return decorated_function
-
 def generate_jwt_token(retailer_id):
     """Generate JWT token for retailer"""
+    import jwt
+    
     payload = {
         'retailer_id': retailer_id,
         'exp': datetime.utcnow() + timedelta(days=30),
         'iat': datetime.utcnow()
     }
-    return jwt.encode(payload, app.secret_key, algorithm='HS256')
+    return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
 def verify_jwt_token(token):
     """Verify JWT token"""
+    import jwt
+    
     try:
-        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
         return payload['retailer_id']
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+# ============================================================================ 
+# IDEMPOTENCY HELPERS
+# ============================================================================
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def get_idempotency_key():
+    """Read the optional Idempotency-Key request header"""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    return key or None
+
+def hash_request_body(data):
+    """Fingerprint a JSON request body so a reused key with a different body is rejected"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def idempotent_json_response(body, status_code=200, replayed=False):
+    """Build a JSON response from an already serialised body"""
+    response = make_response(body, status_code)
+    response.headers['Content-Type'] = 'application/json'
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def load_idempotent_response(db, retailer_id, endpoint, key, request_hash):
+    """Return the stored response for a retried Idempotency-Key, or None if the key is new"""
+    stored = repository.get_idempotency_record(db, retailer_id, endpoint, key, datetime.utcnow())
+    
+    if not stored:
+        return None
+    
+    stored_hash, status_code, response_body = stored
+    if stored_hash != request_hash:
+        return make_response(jsonify({
+            'success': False,
+            'message': 'Idempotency-Key was already used with a different request'
+        }), 422)
+    
+    return idempotent_json_response(response_body, status_code, replayed=True)
+
+def store_idempotent_response(db, retailer_id, endpoint, key, request_hash, body, status_code=200):
+    """Record a response for an Idempotency-Key inside the caller's open transaction"""
+    now = datetime.utcnow()
+    repository.save_idempotency_record(
+        db, retailer_id, endpoint, key, request_hash, status_code, body,
+        now, now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    )
+
+# ============================================================================ 
+# RATE LIMITING
+# ============================================================================
+
+def get_client_ip():
+    """Client IP address, taken from the proxy header when running behind one"""
+    if TRUST_PROXY:
+        forwarded_for = request.headers.get('X-Forwarded-For', '')
+        if forwarded_for:
+            return forwarded_for.split(',')[-1].strip()
+    return request.remote_addr or 'unknown'
+
+def too_many_requests(message, retry_after, status_code=429):
+    """JSON error response carrying a Retry-After header"""
+    response = make_response(jsonify({'success': False, 'message': message}), status_code)
+    response.headers['Retry-After'] = str(max(1, int(retry_after)))
+    return response
+
+def otp_rate_limited(f):
+    """Decorator to shed load and apply per-IP and per-phone OTP limits before any DB or network work"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not otp_load_shedder.acquire():
+            return too_many_requests('Server is busy. Please try again shortly.', 1, 503)
+        
+        try:
+            allowed, retry_after = otp_ip_limiter.consume(get_client_ip())
+            if not allowed:
+                return too_many_requests('Too many OTP requests. Please try again later.', retry_after)
+            
+            data = request.get_json(silent=True) or {}
+            phone = str(data.get('phone', '')).strip()
+            if phone:
+                allowed, retry_after = otp_phone_limiter.consume(phone)
+                if not allowed:
+                    return too_many_requests('Too many OTP requests for this number. Please try again later.', retry_after)
+            
+            return f(*args, **kwargs)
+        finally:
+            otp_load_shedder.release()
+    return decorated_function
+
 # ============================================================================ 
 # WHATSAPP OTP HELPERS
 # ============================================================================
@@ -87,11 +187,11 @@ def hash_otp(otp):
 def send_whatsapp_otp(phone_number, otp):
     """Send OTP via WhatsApp Cloud API"""
     if TEST_MODE:
-        print(f"TEST MODE - WhatsApp OTP would be sent to {phone_number}: {otp}")
+        send_logger.info("TEST MODE - WhatsApp OTP would be sent", extra={'phone': phone_number, 'otp': otp})
         return True
     
     try:
-        url = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+        url = f"{WHATSAPP_API_BASE_URL}/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
         headers = {
             'Authorization': f'Bearer {WHATSAPP_ACCESS_TOKEN}',
             'Content-Type': 'application/json'
@@ -115,23 +215,24 @@ def send_whatsapp_otp(phone_number, otp):
             }
         }
         
-        response = requests.post(url, json=data, headers=headers)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         return response.status_code == 200
         
-    except Exception as e:
-        print(f"Error sending WhatsApp OTP: {e}")
+    except Exception:
+        logger.exception("Error sending WhatsApp OTP")
         return False
 
 def send_credit_added_notification(debtor_phone, debtor_name, shop_name, amount, total_due):
     """Send credit added notification to debtor"""
     if TEST_MODE:
-        print(f"TEST MODE - WhatsApp notification would be sent to {debtor_phone}")
-        print(f"Template: CREDIT_ADDED")
-        print(f"Parameters: [{debtor_name}, {shop_name}, {amount}, {total_due}]")
+        send_logger.info("TEST MODE - WhatsApp notification would be sent", extra={
+            'phone': debtor_phone, 'template': 'CREDIT_ADDED',
+            'parameters': [debtor_name, shop_name, amount, total_due]
+        })
         return True
     
     try:
-        url = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+        url = f"{WHATSAPP_API_BASE_URL}/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
         headers = {
             'Authorization': f'Bearer {WHATSAPP_ACCESS_TOKEN}',
             'Content-Type': 'application/json'
@@ -158,23 +259,24 @@ def send_credit_added_notification(debtor_phone, debtor_name, shop_name, amount,
             }
         }
         
-        response = requests.post(url, json=data, headers=headers)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         return response.status_code == 200
         
-    except Exception as e:
-        print(f"Error sending credit notification: {e}")
+    except Exception:
+        logger.exception("Error sending credit notification")
         return False
 
 def send_payment_recorded_notification(debtor_phone, debtor_name, amount, shop_name, balance):
     """Send payment recorded notification to debtor"""
     if TEST_MODE:
-        print(f"TEST MODE - WhatsApp notification would be sent to {debtor_phone}")
-        print(f"Template: PAYMENT_RECORDED")
-        print(f"Parameters: [{debtor_name}, {amount}, {shop_name}, {balance}]")
+        send_logger.info("TEST MODE - WhatsApp notification would be sent", extra={
+            'phone': debtor_phone, 'template': 'PAYMENT_RECORDED',
+            'parameters': [debtor_name, amount, shop_name, balance]
+        })
         return True
     
     try:
-        url = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+        url = f"{WHATSAPP_API_BASE_URL}/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
         headers = {
             'Authorization': f'Bearer {WHATSAPP_ACCESS_TOKEN}',
             'Content-Type': 'application/json'
@@ -201,69 +303,144 @@ def send_payment_recorded_notification(debtor_phone, debtor_name, amount, shop_n
             }
         }
         
-        response = requests.post(url, json=data, headers=headers)
+        response = get_http_session().post(url, json=data, headers=headers, timeout=10)
         return response.status_code == 200
         
-    except Exception as e:
-        print(f"Error sending payment notification: {e}")
+    except Exception:
+        logger.exception("Error sending payment notification")
         return False
 
+# ============================================================================ 
+# LEDGER ENTRIES
+# ============================================================================
+
+def text_field(data, name):
+    """A stripped text field from a JSON body ('' when missing); raises ValueError for other types"""
+    value = data.get(name) or ''
+    if not isinstance(value, str):
+        raise ValueError(f'{name} must be text')
+    return value.strip()
+
+def apply_credit(db, retailer_id, data):
+    """Record a credit in the caller's transaction; returns (response body, notify(shop_name))
+
+    Raises ValueError with the message for the client when the entry is invalid.
+    """
+    name = text_field(data, 'name')
+    phone = text_field(data, 'phone')
+    credit_amount = money.to_paise(data.get('credit_amount', 0))
+    description = text_field(data, 'description')
+    
+    # Validation
+    if not name or not phone or credit_amount <= 0:
+        raise ValueError('Name, phone, and credit amount are required')
+    
+    if len(phone) != 10:
+        raise ValueError('Valid 10-digit phone number required')
+    
+    # Check if debtor exists for this retailer
+    existing_debtor = repository.find_debtor_by_phone(db, retailer_id, phone)
+    
+    if existing_debtor:
+        # Update existing debtor (in the database, so concurrent credits are not lost)
+        debtor_id = existing_debtor[0]
+        new_total = repository.add_to_debtor_total_due(db, debtor_id, credit_amount)
+    else:
+        # Create new debtor
+        debtor_id = repository.create_debtor(db, retailer_id, name, phone, credit_amount)
+        new_total = credit_amount
+    
+    # Add transaction record
+    repository.add_transaction(db, retailer_id, debtor_id, 'credit', credit_amount, description)
+    
+    def notify(shop_name):
+        send_credit_added_notification(
+            phone, name, shop_name, money.format_rupees(credit_amount), money.format_rupees(new_total)
+        )
+    
+    return {
+        'success': True,
+        'message': 'Debtor added successfully!',
+        'debtor_id': debtor_id,
+        'total_due': money.to_rupees(new_total)
+    }, notify
+
+def apply_payment(db, retailer_id, data):
+    """Record a payment in the caller's transaction; returns (response body, notify(shop_name))
+
+    Raises ValueError with the message for the client when the entry is invalid.
+    """
+    try:
+        debtor_id = int(data.get('debtor_id') or 0)
+    except (TypeError, ValueError):
+        debtor_id = 0
+    amount = money.to_paise(data.get('amount', 0))
+    
+    # Validation
+    if not debtor_id or amount <= 0:
+        raise ValueError('Debtor ID and payment amount are required')
+    
+    # Get debtor info, locked so the balance cannot change before it is updated
+    debtor = repository.get_debtor_for_update(db, retailer_id, debtor_id)
+    
+    if not debtor:
+        raise ValueError('Debtor not found')
+    
+    if amount > debtor.total_due:
+        raise ValueError('Payment amount exceeds outstanding balance')
+    
+    # Update debtor balance
+    new_balance = debtor.total_due - amount
+    repository.update_debtor_total_due(db, debtor.id, new_balance)
+    
+    # Add transaction record
+    repository.add_transaction(db, retailer_id, debtor.id, 'payment', amount, 'Payment received')
+    
+    def notify(shop_name):
+        send_payment_recorded_notification(
+            debtor.phone, debtor.name, money.format_rupees(amount), shop_name, money.format_rupees(new_balance)
+        )
+    
+    return {
+        'success': True,
+        'message': 'Payment recorded successfully!',
+        'debtor_id': debtor.id,
+        'remaining_balance': money.to_rupees(new_balance)
+    }, notify
+
 # ============================================================================ 
 # MAIN ROUTES
 # ============================================================================
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Homepage - Retailer-only portal"""
     return render_template('role_selection.html')
 
-@app.route('/retailer-auth')
+@bp.route('/retailer-auth')
 def retailer_auth():
     """Retailer authentication page"""
     return render_template('retailer_auth.html')
 
-@app.route('/dashboard')
-@retailer_required
+@bp.route('/dashboard')
 def dashboard():
-    """Retailer dashboard"""
-    retailer_id = session.get('retailer_id')
-    db = get_db()
-    
-    try:
-        # Get retailer info
-        retailer = db.execute(
-            'SELECT * FROM retailers WHERE id = ?',
-            (retailer_id,)
-        ).fetchone()
-        
-        # Get debtors count and total outstanding
-        debtors_count = db.execute(
-            'SELECT COUNT(*) as count FROM debtors WHERE retailer_id = ?',
-            (retailer_id,)
-        ).fetchone()['count']
-        
-        total_outstanding = db.execute(
-            'SELECT SUM(total_due) as total FROM debtors WHERE retailer_id = ?',
-            (retailer_id,)
-        ).fetchone()['total'] or 0
-        
-        return render_template('dashboard_new.html', 
-                           retailer=retailer,
-                           debtors_count=debtors_count,
-                           total_outstanding=total_outstanding)
-        
-    except Exception as e:
-        print(f"Error loading dashboard: {e}")
-        flash('Error loading dashboard', 'error')
-        return redirect(url_for('retailer_auth'))
-    finally:
-        db.close()
+    """Retailer dashboard shell; the page signs in with its stored JWT and loads everything from the API"""
+    return render_template('dashboard_new.html')
+
+@bp.route('/sw.js')
+def service_worker():
+    """Offline service worker, served from the root so its scope covers the dashboard and API"""
+    response = send_file(os.path.join(current_app.static_folder, 'sw.js'), mimetype='application/javascript')
+    # Browsers revalidate the worker on every navigation, so updates reach clients at once
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # ============================================================================ 
 # API ENDPOINTS
 # ============================================================================
 
-@app.route('/api/auth/signup', methods=['POST'])
+@bp.route('/api/auth/signup', methods=['POST'])
+@otp_rate_limited
 def api_signup():
     """Retailer signup API"""
     try:
@@ -286,12 +463,7 @@ def api_signup():
         db = get_db()
         
         # Check if retailer already exists
-        existing = db.execute(
-            'SELECT id FROM retailers WHERE phone = ?',
-            (phone,)
-        ).fetchone()
-        
-        if existing:
+        if repository.retailer_exists(db, phone):
             return jsonify({'success': False, 'message': 'Retailer with this phone number already exists'})
         
         # Generate and send OTP
@@ -299,11 +471,8 @@ def api_signup():
         otp_hash = hash_otp(otp)
         expires_at = datetime.utcnow() + timedelta(minutes=5)
         
-        # Store OTP request
-        db.execute(
-            'INSERT INTO otp_requests (phone, otp_hash, expires_at) VALUES (?, ?, ?)',
-            (phone, otp_hash, expires_at)
-        )
+        # Store OTP request (replacing any earlier one for this phone)
+        repository.save_otp_request(db, phone, otp_hash, expires_at)
         db.commit()
         
         # Send WhatsApp OTP
@@ -316,14 +485,14 @@ def api_signup():
         else:
             return jsonify({'success': False, 'message': 'Failed to send OTP. Please try again.'})
         
-    except Exception as e:
-        print(f"Error in signup: {e}")
+    except Exception:
+        logger.exception("Error in signup")
         return jsonify({'success': False, 'message': 'An error occurred during signup'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/auth/verify-signup-otp', methods=['POST'])
+@bp.route('/api/auth/verify-signup-otp', methods=['POST'])
 def api_verify_signup_otp():
     """Verify signup OTP and create retailer account"""
     try:
@@ -336,53 +505,39 @@ def api_verify_signup_otp():
         db = get_db()
         
         # Get latest OTP request
-        otp_request = db.execute(
-            'SELECT * FROM otp_requests ORDER BY created_at DESC LIMIT 1'
-        ).fetchone()
+        otp_request = repository.get_latest_otp_request(db)
         
         if not otp_request:
             return jsonify({'success': False, 'message': 'No OTP request found'})
         
         # Verify OTP
-        if otp_request['attempts'] >= 3:
+        if otp_request.attempts >= 3:
             return jsonify({'success': False, 'message': 'Maximum OTP attempts exceeded'})
         
-        if datetime.utcnow() > datetime.fromisoformat(otp_request['expires_at']):
+        if datetime.utcnow() > datetime.fromisoformat(otp_request.expires_at):
             return jsonify({'success': False, 'message': 'OTP has expired'})
         
-        if hash_otp(otp) != otp_request['otp_hash']:
+        if hash_otp(otp) != otp_request.otp_hash:
             # Increment attempts
-            db.execute(
-                'UPDATE otp_requests SET attempts = attempts + 1 WHERE id = ?',
-                (otp_request['id'],)
-            )
+            repository.increment_otp_attempts(db, otp_request.id)
             db.commit()
             return jsonify({'success': False, 'message': 'Invalid OTP'})
         
         # OTP is valid - create retailer account
         # Note: In production, you'd store the signup data in session or temp table
         # For now, we'll use the phone from OTP request
-        phone = otp_request['phone']
+        phone = otp_request.phone
         shop_name = "Test Shop"  # This should come from session/temp storage
         shop_address = "Test Address"  # This should come from session/temp storage
         
-        db.execute(
-            'INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?)',
-            (phone, shop_name, shop_address)
-        )
+        retailer_id = repository.create_retailer(db, phone, shop_name, shop_address)
         db.commit()
         
-        # Get retailer ID
-        retailer = db.execute(
-            'SELECT id FROM retailers WHERE phone = ?',
-            (phone,)
-        ).fetchone()
-        
         # Generate JWT token
-        token = generate_jwt_token(retailer['id'])
+        token = generate_jwt_token(retailer_id)
         
         # Clean up OTP requests
-        db.execute('DELETE FROM otp_requests WHERE phone = ?', (phone,))
+        repository.delete_otp_requests(db, phone)
         db.commit()
         
         return jsonify({
@@ -390,21 +545,22 @@ def api_verify_signup_otp():
             'message': 'Account created successfully!',
             'token': token,
             'retailer': {
-                'id': retailer['id'],
+                'id': retailer_id,
                 'phone': phone,
                 'shop_name': shop_name,
                 'shop_address': shop_address
             }
         })
         
-    except Exception as e:
-        print(f"Error verifying signup OTP: {e}")
+    except Exception:
+        logger.exception("Error verifying signup OTP")
         return jsonify({'success': False, 'message': 'An error occurred during verification'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/auth/login', methods=['POST'])
+@bp.route('/api/auth/login', methods=['POST'])
+@otp_rate_limited
 def api_login():
     """Retailer login API"""
     try:
@@ -417,12 +573,7 @@ def api_login():
         db = get_db()
         
         # Check if retailer exists
-        retailer = db.execute(
-            'SELECT id FROM retailers WHERE phone = ?',
-            (phone,)
-        ).fetchone()
-        
-        if not retailer:
+        if not repository.retailer_exists(db, phone):
             return jsonify({'success': False, 'message': 'Retailer not found'})
         
         # Generate and send OTP
@@ -430,11 +581,8 @@ def api_login():
         otp_hash = hash_otp(otp)
         expires_at = datetime.utcnow() + timedelta(minutes=5)
         
-        # Store OTP request
-        db.execute(
-            'INSERT INTO otp_requests (phone, otp_hash, expires_at) VALUES (?, ?, ?)',
-            (phone, otp_hash, expires_at)
-        )
+        # Store OTP request (replacing any earlier one for this phone)
+        repository.save_otp_request(db, phone, otp_hash, expires_at)
         db.commit()
         
         # Send WhatsApp OTP
@@ -447,14 +595,14 @@ def api_login():
         else:
             return jsonify({'success': False, 'message': 'Failed to send OTP. Please try again.'})
         
-    except Exception as e:
-        print(f"Error in login: {e}")
+    except Exception:
+        logger.exception("Error in login")
         return jsonify({'success': False, 'message': 'An error occurred during login'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/auth/verify-login-otp', methods=['POST'])
+@bp.route('/api/auth/verify-login-otp', methods=['POST'])
 def api_verify_login_otp():
     """Verify login OTP"""
     try:
@@ -467,43 +615,35 @@ def api_verify_login_otp():
         db = get_db()
         
         # Get latest OTP request
-        otp_request = db.execute(
-            'SELECT * FROM otp_requests ORDER BY created_at DESC LIMIT 1'
-        ).fetchone()
+        otp_request = repository.get_latest_otp_request(db)
         
         if not otp_request:
             return jsonify({'success': False, 'message': 'No OTP request found'})
         
         # Verify OTP
-        if otp_request['attempts'] >= 3:
+        if otp_request.attempts >= 3:
             return jsonify({'success': False, 'message': 'Maximum OTP attempts exceeded'})
         
-        if datetime.utcnow() > datetime.fromisoformat(otp_request['expires_at']):
+        if datetime.utcnow() > datetime.fromisoformat(otp_request.expires_at):
             return jsonify({'success': False, 'message': 'OTP has expired'})
         
-        if hash_otp(otp) != otp_request['otp_hash']:
+        if hash_otp(otp) != otp_request.otp_hash:
             # Increment attempts
-            db.execute(
-                'UPDATE otp_requests SET attempts = attempts + 1 WHERE id = ?',
-                (otp_request['id'],)
-            )
+            repository.increment_otp_attempts(db, otp_request.id)
             db.commit()
             return jsonify({'success': False, 'message': 'Invalid OTP'})
         
         # OTP is valid - get retailer info
-        retailer = db.execute(
-            'SELECT * FROM retailers WHERE phone = ?',
-            (otp_request['phone'],)
-        ).fetchone()
+        retailer = repository.get_retailer_by_phone(db, otp_request.phone)
         
         if not retailer:
             return jsonify({'success': False, 'message': 'Retailer not found'})
         
         # Generate JWT token
-        token = generate_jwt_token(retailer['id'])
+        token = generate_jwt_token(retailer.id)
         
         # Clean up OTP requests
-        db.execute('DELETE FROM otp_requests WHERE phone = ?', (otp_request['phone'],))
+        repository.delete_otp_requests(db, otp_request.phone)
         db.commit()
         
         return jsonify({
@@ -511,22 +651,22 @@ def api_verify_login_otp():
             'message': 'Login successful!',
             'token': token,
             'retailer': {
-                'id': retailer['id'],
-                'phone': retailer['phone'],
-                'shop_name': retailer['shop_name'],
-                'shop_address': retailer['shop_address'],
-                'shop_photo_url': retailer['shop_photo_url']
+                'id': retailer.id,
+                'phone': retailer.phone,
+                'shop_name': retailer.shop_name,
+                'shop_address': retailer.shop_address,
+                'shop_photo_url': retailer.shop_photo_url
             }
         })
         
-    except Exception as e:
-        print(f"Error verifying login OTP: {e}")
+    except Exception:
+        logger.exception("Error verifying login OTP")
         return jsonify({'success': False, 'message': 'An error occurred during verification'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/debtors', methods=['POST'])
+@bp.route('/api/debtors', methods=['POST'])
 def api_add_debtor():
     """Add debtor API"""
     try:
@@ -541,76 +681,57 @@ def api_add_debtor():
             return jsonify({'success': False, 'message': 'Invalid or expired token'})
         
         data = request.get_json()
-        name = data.get('name', '').strip()
-        phone = data.get('phone', '').strip()
-        credit_amount = float(data.get('credit_amount', 0))
-        description = data.get('description', '').strip()
-        
-        # Validation
-        if not name or not phone or credit_amount <= 0:
-            return jsonify({'success': False, 'message': 'Name, phone, and credit amount are required'})
-        
-        if len(phone) != 10:
-            return jsonify({'success': False, 'message': 'Valid 10-digit phone number required'})
-        
         db = get_db()
-        cursor = db.cursor()
-        
-        # Check if debtor exists for this retailer
-        existing_debtor = cursor.execute(
-            'SELECT id, total_due FROM debtors WHERE retailer_id = ? AND phone = ?',
-            (retailer_id, phone)
-        ).fetchone()
-        
-        if existing_debtor:
-            # Update existing debtor
-            new_total = existing_debtor['total_due'] + credit_amount
-            cursor.execute(
-                'UPDATE debtors SET total_due = ? WHERE id = ?',
-                (new_total, existing_debtor['id'])
-            )
-            debtor_id = existing_debtor['id']
-        else:
-            # Create new debtor
-            cursor.execute(
-                'INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (?, ?, ?, ?)',
-                (retailer_id, name, phone, credit_amount)
-            )
-            debtor_id = cursor.lastrowid
-            new_total = credit_amount
         
-        # Add transaction record
-        cursor.execute(
-            'INSERT INTO transactions (debtor_id, type, amount, description) VALUES (?, ?, ?, ?)',
-            (debtor_id, 'credit', credit_amount, description)
-        )
+        # Answer retries of an already applied request from the stored response
+        idempotency_key = get_idempotency_key()
+        if idempotency_key:
+            if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({'success': False, 'message': 'Idempotency-Key is too long'}), 400
+            request_hash = hash_request_body(data)
+            replay = load_idempotent_response(db, retailer_id, 'debtors', idempotency_key, request_hash)
+            if replay:
+                return replay
+        
+        try:
+            body, notify = apply_credit(db, retailer_id, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        body = json.dumps(body)
+        
+        # Store the response in the same transaction as the ledger rows
+        if idempotency_key:
+            store_idempotent_response(db, retailer_id, 'debtors', idempotency_key, request_hash, body)
         
         db.commit()
         
         # Get retailer info for WhatsApp notification
-        retailer = db.execute(
-            'SELECT shop_name FROM retailers WHERE id = ?',
-            (retailer_id,)
-        ).fetchone()
+        shop_name = retailer_cache.get_shop_name(db, retailer_id)
         
         # Send WhatsApp notification (async)
-        send_credit_added_notification(phone, name, retailer['shop_name'], credit_amount, new_total)
+        notify(shop_name)
         
-        return jsonify({
-            'success': True,
-            'message': 'Debtor added successfully!',
-            'debtor_id': debtor_id,
-            'total_due': new_total
-        })
+        sweep_idempotency_keys()
+        
+        return idempotent_json_response(body)
         
-    except Exception as e:
-        print(f"Error adding debtor: {e}")
+    except IntegrityError:
+        db.rollback()
+        # A concurrent request with the same Idempotency-Key committed first
+        if idempotency_key:
+            replay = load_idempotent_response(db, retailer_id, 'debtors', idempotency_key, request_hash)
+            if replay:
+                return replay
+        logger.exception("Error adding debtor")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    except Exception:
+        logger.exception("Error adding debtor")
         return jsonify({'success': False, 'message': 'An error occurred'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/debtors', methods=['GET'])
+@bp.route('/api/debtors', methods=['GET'])
 def api_get_debtors():
     """Get debtors list API"""
     try:
@@ -640,24 +761,23 @@ def api_get_debtors():
         db = get_db()
         
         # Get debtors with sorting
-        query = f'SELECT * FROM debtors WHERE retailer_id = ? ORDER BY {sort_field} {sort_order}'
-        debtors = db.execute(query, (retailer_id,)).fetchall()
+        debtors = repository.list_debtors(db, retailer_id, sort_field, sort_order)
         
         return jsonify({
             'success': True,
-            'debtors': [dict(debtor) for debtor in debtors]
+            'debtors': debtors
         })
         
-    except Exception as e:
-        print(f"Error getting debtors: {e}")
+    except Exception:
+        logger.exception("Error getting debtors")
         return jsonify({'success': False, 'message': 'An error occurred'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/payments', methods=['POST'])
-def api_add_payment():
-    """Add payment API"""
+@bp.route('/api/debtors/<int:debtor_id>/transactions', methods=['GET'])
+def api_get_debtor_transactions(debtor_id):
+    """Debtor ledger API, newest first, one keyset page at a time"""
     try:
         # Verify JWT token
         auth_header = request.headers.get('Authorization')
@@ -669,66 +789,233 @@ def api_add_payment():
         if not retailer_id:
             return jsonify({'success': False, 'message': 'Invalid or expired token'})
         
-        data = request.get_json()
-        debtor_id = data.get('debtor_id')
-        amount = float(data.get('amount', 0))
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        cursor = request.args.get('cursor')
+        transaction_type = request.args.get('type')
         
-        # Validation
-        if not debtor_id or amount <= 0:
-            return jsonify({'success': False, 'message': 'Debtor ID and payment amount are required'})
+        if transaction_type and transaction_type not in ('credit', 'payment'):
+            return jsonify({'success': False, 'message': 'type must be credit or payment'})
+        
+        # Dates are inclusive 'YYYY-MM-DD' days; send the same filters with each cursor
+        try:
+            since = request.args.get('from')
+            until = request.args.get('to')
+            if since:
+                since = datetime.strptime(since, '%Y-%m-%d').strftime('%Y-%m-%d')
+            if until:
+                until = (datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'})
         
         db = get_db()
         
-        # Get debtor info
-        debtor = db.execute(
-            'SELECT * FROM debtors WHERE id = ? AND retailer_id = ?',
-            (debtor_id, retailer_id)
-        ).fetchone()
+        debtor = repository.get_debtor(db, retailer_id, debtor_id)
         
         if not debtor:
             return jsonify({'success': False, 'message': 'Debtor not found'})
         
-        if amount > debtor['total_due']:
-            return jsonify({'success': False, 'message': 'Payment amount exceeds outstanding balance'})
+        try:
+            transactions, next_cursor = archive.get_ledger_page(
+                db, debtor, limit, cursor, transaction_type, since, until
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
-        # Update debtor balance
-        new_balance = debtor['total_due'] - amount
-        db.execute(
-            'UPDATE debtors SET total_due = ? WHERE id = ?',
-            (new_balance, debtor_id)
-        )
+        return jsonify({
+            'success': True,
+            'debtor': {'id': debtor.id, 'name': debtor.name, 'total_due': money.to_rupees(debtor.total_due)},
+            'transactions': transactions,
+            'next_cursor': next_cursor
+        })
         
-        # Add transaction record
-        db.execute(
-            'INSERT INTO transactions (debtor_id, type, amount, description) VALUES (?, ?, ?, ?)',
-            (debtor_id, 'payment', amount, 'Payment received')
-        )
+    except Exception:
+        logger.exception("Error getting debtor transactions")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/payments', methods=['POST'])
+def api_add_payment():
+    """Add payment API"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json()
+        db = get_db()
+        
+        # Answer retries of an already applied request from the stored response
+        idempotency_key = get_idempotency_key()
+        if idempotency_key:
+            if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({'success': False, 'message': 'Idempotency-Key is too long'}), 400
+            request_hash = hash_request_body(data)
+            replay = load_idempotent_response(db, retailer_id, 'payments', idempotency_key, request_hash)
+            if replay:
+                return replay
+        
+        try:
+            body, notify = apply_payment(db, retailer_id, data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        body = json.dumps(body)
+        
+        # Store the response in the same transaction as the ledger rows
+        if idempotency_key:
+            store_idempotent_response(db, retailer_id, 'payments', idempotency_key, request_hash, body)
         
         db.commit()
         
         # Get retailer info for WhatsApp notification
-        retailer = db.execute(
-            'SELECT shop_name FROM retailers WHERE id = ?',
-            (retailer_id,)
-        ).fetchone()
+        shop_name = retailer_cache.get_shop_name(db, retailer_id)
         
         # Send WhatsApp notification (async)
-        send_payment_recorded_notification(debtor['phone'], debtor['name'], amount, retailer['shop_name'], new_balance)
+        notify(shop_name)
+        
+        sweep_idempotency_keys()
+        
+        return idempotent_json_response(body)
+        
+    except IntegrityError:
+        db.rollback()
+        # A concurrent request with the same Idempotency-Key committed first
+        if idempotency_key:
+            replay = load_idempotent_response(db, retailer_id, 'payments', idempotency_key, request_hash)
+            if replay:
+                return replay
+        logger.exception("Error adding payment")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    except Exception:
+        logger.exception("Error adding payment")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+# ============================================================================ 
+# OFFLINE SYNC
+# ============================================================================
+
+# Largest batch of queued entries one sync request may carry
+SYNC_MAX_OPERATIONS = int(os.environ.get('SYNC_MAX_OPERATIONS', '100'))
+
+# Queued entry type -> (idempotency endpoint shared with the single-entry API, handler)
+SYNC_OPERATIONS = {
+    'credit': ('debtors', apply_credit),
+    'payment': ('payments', apply_payment),
+}
+
+@bp.route('/api/sync', methods=['POST'])
+def api_sync():
+    """Apply an offline client's queued credits and payments in order, in one transaction
+
+    Each operation is {"key", "type": "credit"|"payment", "data"} where data is
+    the body the single-entry API takes and key its Idempotency-Key, so an entry
+    that already reached the server (by either route) is answered from the
+    stored response instead of being applied twice. Invalid entries are
+    reported and skipped; the rest commit together. Returns a result per
+    operation and the current state of every debtor they touched.
+    """
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json() or {}
+        operations = data.get('operations')
+        
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'success': False, 'message': 'operations must be a non-empty list'}), 400
+        
+        if len(operations) > SYNC_MAX_OPERATIONS:
+            return jsonify({'success': False, 'message': f'At most {SYNC_MAX_OPERATIONS} operations per sync'}), 400
+        
+        for operation in operations:
+            if (not isinstance(operation, dict) or operation.get('type') not in SYNC_OPERATIONS
+                    or not isinstance(operation.get('key'), str) or not operation['key']
+                    or len(operation['key']) > IDEMPOTENCY_KEY_MAX_LENGTH
+                    or not isinstance(operation.get('data'), dict)):
+                return jsonify({
+                    'success': False,
+                    'message': 'Each operation needs a key, a type (credit or payment) and data'
+                }), 400
+        
+        db = get_db()
+        now = datetime.utcnow()
+        results = []
+        notifications = []
+        debtor_ids = []
+        
+        # One write transaction for the whole batch, in the client's order
+        repository.begin_write(db)
+        for operation in operations:
+            key = operation['key']
+            endpoint, apply_entry = SYNC_OPERATIONS[operation['type']]
+            request_hash = hash_request_body(operation['data'])
+            
+            stored = repository.get_idempotency_record(db, retailer_id, endpoint, key, now)
+            if stored:
+                stored_hash, _, response_body = stored
+                if stored_hash != request_hash:
+                    result = {'success': False, 'message': 'Idempotency-Key was already used with a different request'}
+                else:
+                    result = dict(json.loads(response_body), replayed=True)
+            else:
+                try:
+                    result, notify = apply_entry(db, retailer_id, operation['data'])
+                except ValueError as e:
+                    result = {'success': False, 'message': str(e)}
+                else:
+                    store_idempotent_response(db, retailer_id, endpoint, key, request_hash, json.dumps(result))
+                    notifications.append(notify)
+            
+            if result.get('debtor_id') and result['debtor_id'] not in debtor_ids:
+                debtor_ids.append(result['debtor_id'])
+            results.append({'key': key, **result})
+        
+        db.commit()
+        
+        if notifications:
+            # Get retailer info for WhatsApp notifications
+            shop_name = retailer_cache.get_shop_name(db, retailer_id)
+            for notify in notifications:
+                notify(shop_name)
+        
+        sweep_idempotency_keys()
         
         return jsonify({
             'success': True,
-            'message': 'Payment recorded successfully!',
-            'remaining_balance': new_balance
+            'results': results,
+            'debtors': repository.list_debtors_by_id(db, retailer_id, debtor_ids)
         })
         
-    except Exception as e:
-        print(f"Error adding payment: {e}")
+    except IntegrityError:
+        db.rollback()
+        # A concurrent request stored one of the keys first; a retry replays it
+        logger.exception("Error syncing queued entries")
+        return jsonify({'success': False, 'message': 'Sync conflicted with another request, please retry'}), 409
+    except Exception:
+        logger.exception("Error syncing queued entries")
         return jsonify({'success': False, 'message': 'An error occurred'})
     finally:
         if 'db' in locals():
             db.close()
 
-@app.route('/api/settings', methods=['GET'])
+@bp.route('/api/settings', methods=['GET'])
 def api_get_settings():
     """Get retailer settings API"""
     try:
@@ -745,36 +1032,689 @@ def api_get_settings():
         db = get_db()
         
         # Get retailer info
-        retailer = db.execute(
-            'SELECT * FROM retailers WHERE id = ?',
-            (retailer_id,)
-        ).fetchone()
+        retailer = retailer_cache.get(db, retailer_id)
         
         if not retailer:
             return jsonify({'success': False, 'message': 'Retailer not found'})
         
         return jsonify({
             'success': True,
-            'retailer': {
-                'id': retailer['id'],
-                'phone': retailer['phone'],
-                'shop_name': retailer['shop_name'],
-                'shop_address': retailer['shop_address'],
-                'shop_photo_url': retailer['shop_photo_url'],
-                'created_at': retailer['created_at']
-            }
+            'retailer': retailer.as_dict()
+        })
+        
+    except Exception:
+        logger.exception("Error getting settings")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/settings', methods=['PUT'])
+def api_update_settings():
+    """Update retailer shop details API"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json() or {}
+        shop_name = data.get('shop_name', '').strip()
+        shop_address = data.get('shop_address', '').strip()
+        shop_photo_url = data.get('shop_photo_url', '').strip() or None
+        
+        if not shop_name:
+            return jsonify({'success': False, 'message': 'Shop name is required'})
+        
+        if not shop_address:
+            return jsonify({'success': False, 'message': 'Shop address is required'})
+        
+        db = get_db()
+        
+        if not repository.update_retailer_profile(db, retailer_id, shop_name, shop_address, shop_photo_url):
+            return jsonify({'success': False, 'message': 'Retailer not found'})
+        
+        # Other workers drop their cached copy once they see the new version
+        version = retailer_cache.profile_changed(db, retailer_id)
+        db.commit()
+        
+        retailer = repository.get_retailer(db, retailer_id)
+        retailer_cache.write_through(retailer, version)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Settings updated successfully!',
+            'retailer': retailer.as_dict()
         })
         
-    except Exception as e:
-        print(f"Error getting settings: {e}")
+    except Exception:
+        logger.exception("Error updating settings")
         return jsonify({'success': False, 'message': 'An error occurred'})
     finally:
         if 'db' in locals():
             db.close()
 
 # ============================================================================ 
-# RUN APPLICATION
+# REMINDER CAMPAIGNS
 # ============================================================================
 
-if __name__ == '__main__':
+@bp.route('/api/reminders/campaigns', methods=['POST'])
+def api_create_reminder_campaign():
+    """Queue a bulk payment reminder campaign for the background worker"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json() or {}
+        min_balance = money.to_paise(data.get('min_balance', 0))
+        min_days_inactive = int(data.get('min_days_inactive', 0))
+        
+        if min_balance < 0 or min_days_inactive < 0:
+            return jsonify({'success': False, 'message': 'Balance and age criteria must not be negative'})
+        
+        db = get_db()
+        
+        shop_name = retailer_cache.get_shop_name(db, retailer_id)
+        
+        if not shop_name:
+            return jsonify({'success': False, 'message': 'Retailer not found'})
+        
+        campaign_id, total_recipients = reminders.create_campaign(
+            db, retailer_id, shop_name, min_balance, min_days_inactive
+        )
+        db.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Reminder campaign queued for {total_recipients} customers',
+            'campaign_id': campaign_id,
+            'total_recipients': total_recipients
+        })
+        
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid campaign criteria'})
+    except Exception:
+        logger.exception("Error creating reminder campaign")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/reminders/campaigns/<int:campaign_id>', methods=['GET'])
+def api_get_reminder_campaign(campaign_id):
+    """Reminder campaign progress API"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        db = get_db()
+        
+        progress = reminders.get_campaign_progress(db, retailer_id, campaign_id)
+        if not progress:
+            return jsonify({'success': False, 'message': 'Campaign not found'})
+        
+        return jsonify({'success': True, 'campaign': progress})
+        
+    except Exception:
+        logger.exception("Error getting reminder campaign")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/reminders/campaigns/<int:campaign_id>/recipients', methods=['GET'])
+def api_get_reminder_recipients(campaign_id):
+    """Per-recipient reminder status API"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        status = request.args.get('status')
+        after_id = request.args.get('after', 0, type=int)
+        limit = min(request.args.get('limit', 100, type=int), 500)
+        
+        if status and status not in ('pending', 'sending', 'sent', 'failed'):
+            return jsonify({'success': False, 'message': 'Invalid status filter'})
+        
+        db = get_db()
+        
+        if not repository.campaign_belongs_to_retailer(db, retailer_id, campaign_id):
+            return jsonify({'success': False, 'message': 'Campaign not found'})
+        
+        recipients = reminders.get_campaign_recipients(db, campaign_id, status, after_id, limit)
+        
+        return jsonify({
+            'success': True,
+            'recipients': recipients,
+            'next_after': recipients[-1]['id'] if len(recipients) == limit else None
+        })
+        
+    except Exception:
+        logger.exception("Error getting reminder recipients")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/reminders/campaigns/<int:campaign_id>/<action>', methods=['POST'])
+def api_update_reminder_campaign(campaign_id, action):
+    """Pause, resume or cancel a reminder campaign"""
+    transitions = {
+        'pause': ('paused', ('running',)),
+        'resume': ('running', ('paused',)),
+        'cancel': ('cancelled', ('running', 'paused'))
+    }
+    
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        if action not in transitions:
+            return jsonify({'success': False, 'message': 'Unknown campaign action'}), 404
+        
+        status, from_statuses = transitions[action]
+        db = get_db()
+        
+        if not reminders.set_campaign_status(db, retailer_id, campaign_id, status, from_statuses):
+            return jsonify({'success': False, 'message': f'Campaign cannot be {status} from its current state'})
+        
+        db.commit()
+        
+        return jsonify({'success': True, 'message': f'Campaign {status}', 'status': status})
+        
+    except Exception:
+        logger.exception("Error updating reminder campaign")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+# ============================================================================ 
+# REPORTS
+# ============================================================================
+
+@bp.route('/api/reports/collections', methods=['GET'])
+def api_collections_report():
+    """Credit given and payments collected per day or month over a date range"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        group = request.args.get('group', 'day')
+        if group not in rollup.REPORT_GROUPS:
+            return jsonify({'success': False, 'message': 'group must be day or month'})
+        
+        try:
+            since, until = rollup.parse_report_range(request.args.get('from'), request.args.get('to'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Invalid date range: {e}'})
+        
+        db = get_db()
+        
+        report = rollup.get_collections_report(db, retailer_id, since, until, group)
+        
+        return jsonify({'success': True, 'report': report})
+        
+    except Exception:
+        logger.exception("Error getting collections report")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+# ============================================================================ 
+# ACCOUNT STATEMENTS
+# ============================================================================
+
+def secure_name(name):
+    """Debtor name reduced to characters that are safe in a file name"""
+    return ''.join(c if c.isalnum() else '_' for c in name).strip('_')[:40] or 'customer'
+
+@bp.route('/api/statements/jobs', methods=['POST'])
+def api_create_statement_job():
+    """Queue monthly account statements for every debtor"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json() or {}
+        statement_format = data.get('format', 'text')
+        
+        if statement_format not in statements.STATEMENT_FORMATS:
+            return jsonify({'success': False, 'message': 'format must be text or html'})
+        
+        try:
+            period_start, period_end = statements.parse_period(data.get('period'))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'period must be YYYY-MM'})
+        
+        db = get_db()
+        
+        retailer = retailer_cache.get(db, retailer_id)
+        
+        if not retailer:
+            return jsonify({'success': False, 'message': 'Retailer not found'})
+        
+        job_id, total_debtors = statements.create_job(db, retailer, period_start, period_end, statement_format)
+        db.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': f'Statements queued for {total_debtors} customers',
+            'job_id': job_id,
+            'total_debtors': total_debtors
+        })
+        
+    except Exception:
+        logger.exception("Error creating statement job")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/statements/jobs/<int:job_id>', methods=['GET'])
+def api_get_statement_job(job_id):
+    """Statement job progress API"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        db = get_db()
+        
+        progress = statements.get_job_progress(db, retailer_id, job_id)
+        if not progress:
+            return jsonify({'success': False, 'message': 'Statement job not found'})
+        
+        return jsonify({'success': True, 'job': progress})
+        
+    except Exception:
+        logger.exception("Error getting statement job")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/statements/jobs/<int:job_id>/statements', methods=['GET'])
+def api_get_job_statements(job_id):
+    """List a statement job's generated statements"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        after_debtor_id = request.args.get('after', 0, type=int)
+        limit = min(request.args.get('limit', 100, type=int), 500)
+        
+        db = get_db()
+        
+        if not statements.get_job(db, retailer_id, job_id):
+            return jsonify({'success': False, 'message': 'Statement job not found'})
+        
+        rows = statements.get_job_statements(db, job_id, after_debtor_id, limit)
+        
+        return jsonify({
+            'success': True,
+            'statements': rows,
+            'next_after': rows[-1]['debtor_id'] if len(rows) == limit else None
+        })
+        
+    except Exception:
+        logger.exception("Error listing statements")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/statements/jobs/<int:job_id>/statements/<int:debtor_id>', methods=['GET'])
+def api_download_statement(job_id, debtor_id):
+    """Download one debtor's statement"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        db = get_db()
+        
+        job = statements.get_job(db, retailer_id, job_id)
+        statement = statements.get_statement(db, job_id, debtor_id) if job else None
+        
+        if not statement:
+            return jsonify({'success': False, 'message': 'Statement not found'})
+        
+        response = make_response(statement['content'])
+        response.headers['Content-Type'] = statements.STATEMENT_MEDIA_TYPES[job['format']]
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename=statement-{job['period_start'][:7]}-{debtor_id}."
+            f"{statements.STATEMENT_EXTENSIONS[job['format']]}"
+        )
+        return response
+        
+    except Exception:
+        logger.exception("Error downloading statement")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/statements/jobs/<int:job_id>/download', methods=['GET'])
+def api_download_statement_job(job_id):
+    """Download every statement of a completed job as a zip file"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        db = get_db()
+        
+        job = statements.get_job(db, retailer_id, job_id)
+        
+        if not job:
+            return jsonify({'success': False, 'message': 'Statement job not found'})
+        
+        if job['status'] != 'completed':
+            return jsonify({'success': False, 'message': 'Statements are still being generated'})
+        
+        # Spill to disk past a few MB rather than holding a large archive in memory
+        archive_file = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        extension = statements.STATEMENT_EXTENSIONS[job['format']]
+        with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as archive_zip:
+            for debtor_id, name, content in statements.iter_statements(db, job_id):
+                archive_zip.writestr(f"{debtor_id}-{secure_name(name)}.{extension}", content)
+        archive_file.seek(0)
+        
+        return send_file(
+            archive_file,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f"statements-{job['period_start'][:7]}.zip"
+        )
+        
+    except Exception:
+        logger.exception("Error downloading statement job")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+# ============================================================================ 
+# RECONCILIATION
+# ============================================================================
+
+@bp.route('/api/reconciliation', methods=['POST'])
+def api_run_reconciliation():
+    """Queue a check of every debtor's balance against the ledger, optionally repairing drift"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        data = request.get_json(silent=True) or {}
+        repair = data.get('repair', False)
+        
+        if not isinstance(repair, bool):
+            return jsonify({'success': False, 'message': 'repair must be true or false'})
+        
+        db = get_db()
+        
+        # Checked by the reconcile worker; GET /api/reconciliation shows the result
+        run = reconcile.queue_run(db, retailer_id, repair)
+        db.commit()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Reconciliation queued',
+            'run': run
+        }), 202
+        
+    except Exception:
+        logger.exception("Error running reconciliation")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+@bp.route('/api/reconciliation', methods=['GET'])
+def api_get_reconciliation():
+    """Drift found for this retailer by the latest reconciliation run (nightly or on demand)"""
+    try:
+        # Verify JWT token
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({'success': False, 'message': 'Authentication required'})
+        
+        token = auth_header.split(' ')[1]
+        retailer_id = verify_jwt_token(token)
+        if not retailer_id:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'})
+        
+        db = get_db()
+        
+        run, drift = reconcile.get_latest_drift(db, retailer_id)
+        
+        return jsonify({'success': True, 'run': run, 'drift': drift})
+        
+    except Exception:
+        logger.exception("Error getting reconciliation")
+        return jsonify({'success': False, 'message': 'An error occurred'})
+    finally:
+        if 'db' in locals():
+            db.close()
+
+# ============================================================================ 
+# HEALTH AND READINESS
+# ============================================================================
+
+REQUIRED_TABLES = tuple(SCHEMA)
+
+_warm_up_lock = threading.Lock()
+_warm_up_state = {'status': 'cold', 'started_at': None, 'duration_ms': None, 'error': None}
+
+def warm_up():
+    """Import lazily loaded dependencies and check the database schema; safe to call repeatedly"""
+    with _warm_up_lock:
+        if _warm_up_state['status'] == 'ready':
+            return True
+        
+        started = time.perf_counter()
+        _warm_up_state.update(status='warming', started_at=datetime.utcnow().isoformat(), error=None)
+        try:
+            import jwt  # noqa: F401
+            get_http_session()
+            
+            db = get_db()
+            try:
+                tables = repository.list_tables(db)
+                columns = missing_columns(db)
+            finally:
+                db.close()
+            
+            missing = [table for table in REQUIRED_TABLES if table not in tables]
+            if missing:
+                raise RuntimeError(f"Database schema missing tables: {', '.join(missing)}")
+            # Written by an older version and not yet upgraded (init_db() upgrades it)
+            if columns:
+                raise RuntimeError(f"Database schema out of date, missing columns: {', '.join(columns)}")
+            
+            _warm_up_state.update(status='ready', duration_ms=round((time.perf_counter() - started) * 1000, 1))
+            return True
+        except Exception as e:
+            logger.exception("Error warming up")
+            _warm_up_state.update(status='cold', error=str(e))
+            return False
+
+def start_warm_up():
+    """Warm up in a background thread (called from the gunicorn post_fork hook)"""
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+@bp.route('/healthz')
+def healthz():
+    """Liveness probe: the process is up and serving"""
+    return jsonify({'status': 'ok'})
+
+@bp.route('/readyz')
+def readyz():
+    """Readiness probe: dependencies imported and database schema present"""
+    ready = warm_up()
+    return jsonify({'ready': ready, **_warm_up_state}), 200 if ready else 503
+
+def metrics_allowed():
+    """Whether the request carries METRICS_TOKEN (never, when no token is configured)"""
+    auth_header = request.headers.get('Authorization', '')
+    return bool(METRICS_TOKEN) and hmac.compare_digest(auth_header.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+
+@bp.route('/metrics/queries')
+def query_metrics():
+    """Per-query call counts and timings for this worker process"""
+    if not metrics_allowed():
+        return jsonify({'success': False, 'message': 'Not found'}), 404
+    return jsonify({'pid': os.getpid(), 'queries': repository.query_stats()})
+
+@bp.route('/metrics/cache')
+def cache_metrics():
+    """Retailer profile cache hit/miss counters for this worker process"""
+    if not metrics_allowed():
+        return jsonify({'success': False, 'message': 'Not found'}), 404
+    return jsonify({'pid': os.getpid(), 'retailer_profiles': retailer_cache.stats()})
+
+# ============================================================================ 
+# REQUEST IDS
+# ============================================================================
+
+REQUEST_ID_MAX_LENGTH = 64
+REQUEST_ID_CHARACTERS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_.')
+
+@bp.before_app_request
+def bind_request_id():
+    """Tag this request's log records with the caller's X-Request-ID or a new id"""
+    request_id = request.headers.get('X-Request-ID', '')
+    if not request_id or len(request_id) > REQUEST_ID_MAX_LENGTH or not set(request_id) <= REQUEST_ID_CHARACTERS:
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.request_id_token = set_request_id(request_id)
+
+@bp.after_app_request
+def add_request_id_header(response):
+    """Echo the request id so clients can quote it"""
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@bp.teardown_app_request
+def unbind_request_id(exc):
+    """Forget the request id before the thread serves another request"""
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        reset_request_id(token)
+
+# ============================================================================ 
+# APPLICATION FACTORY
+# ============================================================================
+
+def create_app(config=None):
+    """Create the Flask app without touching the database or network"""
+    # Log records are written to stdout by a background thread, never the request thread
+    configure_logging()
+    app = Flask(__name__)
+    app.secret_key = JWT_SECRET
+    if config:
+        app.config.update(config)
+    app.register_blueprint(bp)
+    return app
+
+app = create_app()
+
+# ============================================================================ 
+# RUN APPLICATION
+# ============================================================================
+
+if __name__ == '__main__':
+    # Windsurf Compatibility Fixes
+    os.environ['DISABLE_UI_CUSTOMIZATION'] = '1'
+    os.environ['DISABLE_ICON_THEMES'] = '1'
+    os.environ['FORCE_DEFAULT_THEME'] = '1'
+    os.environ['DISABLE_FANCY_FEATURES'] = '1'
+    os.environ['DISABLE_FILE_WATCHING'] = '1'
+    os.environ['DISABLE_AUTO_RELOAD'] = '1'
+    os.environ['DISABLE_CUSTOM_FONTS'] = '1'
+    os.environ['FORCE_SIMPLE_RENDERING'] = '1'
+    
+    init_db()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,197 @@
+"""
+Patt Book - Ledger Archival
+Moves old settled history to transactions_archive and reads through to it for old ranges
+
+Usage:
+    python archive.py    # nightly, from cron or Heroku Scheduler (see README "Ledger Archival")
+"""
+
+import argparse
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+from database import get_db
+import repository
+from money import to_rupees
+
+# Archival configuration
+ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '200'))
+
+# Ledger pages walk (created_at, id) newest first; these bounds stand in for
+# "no cursor" and "no date filter" so every page runs the same statement
+LEDGER_PAGE_START = ('9999-12-31 23:59:59', 0)
+LEDGER_PAGE_EARLIEST = '0001-01-01 00:00:00'
+LEDGER_PAGE_MAX_SCAN = 500
+
+def signed_amount(row):
+    """Effect of a ledger row on the debtor's balance"""
+    return -row['amount'] if row['type'] == 'payment' else row['amount']
+
+def plan_debtor_archive(rows, cutoff):
+    """Decide what to archive from a debtor's live rows, given in (created_at, id) order
+
+    Returns (rows_to_archive, carried_balance) or None. History before the
+    cutoff is only archived once the debtor has been settled since then.
+    """
+    balance = 0
+    carried_balance = 0
+    last_old_index = -1
+    settled_since_cutoff = False
+
+    for index, row in enumerate(rows):
+        balance += signed_amount(row)
+        if row['created_at'] < cutoff:
+            last_old_index = index
+            carried_balance = balance
+        elif balance == 0:
+            settled_since_cutoff = True
+
+    old_rows = rows[:last_old_index + 1]
+    if not any(row['type'] != 'balance_forward' for row in old_rows):
+        return None
+
+    if not settled_since_cutoff and balance != 0:
+        return None
+
+    return old_rows, carried_balance
+
+def archive_debtor(db, debtor_id, cutoff):
+    """Archive one debtor's old history inside the caller's transaction; returns rows archived"""
+    rows = repository.list_debtor_ledger(db, debtor_id)
+
+    plan = plan_debtor_archive(rows, cutoff)
+    if not plan:
+        return 0
+
+    old_rows, carried_balance = plan
+    archived_through = old_rows[-1]['created_at']
+    moved = [row for row in old_rows if row['type'] != 'balance_forward']
+
+    repository.archive_transactions(db, moved)
+    # Earlier balance_forward rows are folded into the new one rather than archived
+    repository.delete_transactions(db, [row['id'] for row in old_rows])
+
+    if carried_balance != 0:
+        repository.insert_balance_forward(db, debtor_id, carried_balance, archived_through)
+
+    repository.set_debtor_archived_through(db, debtor_id, archived_through)
+    return len(moved)
+
+def run_archive(horizon_days=ARCHIVE_HORIZON_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive settled history older than the horizon, one short write transaction per batch"""
+    cutoff = (datetime.utcnow() - timedelta(days=horizon_days)).strftime('%Y-%m-%d %H:%M:%S')
+    stats = {'debtors_checked': 0, 'debtors_archived': 0, 'transactions_archived': 0}
+    last_debtor_id = 0
+
+    db = get_db()
+    try:
+        while True:
+            debtor_ids = repository.list_archivable_debtor_ids(db, last_debtor_id, cutoff, batch_size)
+
+            if not debtor_ids:
+                break
+
+            repository.begin_write(db)
+            try:
+                for debtor_id in debtor_ids:
+                    archived = archive_debtor(db, debtor_id, cutoff)
+                    if archived:
+                        stats['debtors_archived'] += 1
+                        stats['transactions_archived'] += archived
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+
+            stats['debtors_checked'] += len(debtor_ids)
+            last_debtor_id = debtor_ids[-1]
+    finally:
+        db.close()
+
+    return stats
+
+def encode_ledger_cursor(created_at, transaction_id, balance):
+    """Opaque cursor for the row after which the next page starts"""
+    raw = json.dumps([created_at, transaction_id, balance], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_ledger_cursor(cursor):
+    """(created_at, id, balance) from encode_ledger_cursor(); raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, transaction_id, balance = json.loads(raw)
+        # Balances are integer paise; a rupee float is a cursor from before the switch
+        if not isinstance(balance, int):
+            raise ValueError('Invalid cursor')
+        return str(created_at), int(transaction_id), balance
+    except (TypeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def get_ledger_page(db, debtor, limit, cursor=None, transaction_type=None, since=None, until=None):
+    """One page of a debtor's ledger, newest first, with the balance after each row
+
+    debtor needs id, total_due and archived_through. since/until are
+    'YYYY-MM-DD HH:MM:SS' bounds (since inclusive, until exclusive). The
+    balance is always the whole ledger's balance: rows hidden by the type
+    filter still move it. The first page starts from the debtor's total_due
+    and each cursor carries the balance to resume from, so no page sums
+    the history behind it.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page. A
+    sparse type filter may return a short (even empty) page with a cursor
+    rather than scan more than LEDGER_PAGE_MAX_SCAN rows.
+    """
+    archived_through = debtor.archived_through
+    read_through = bool(archived_through) and (not since or since <= archived_through)
+    since = since or LEDGER_PAGE_EARLIEST
+
+    if cursor:
+        created_at, transaction_id, balance = decode_ledger_cursor(cursor)
+        until = until or LEDGER_PAGE_START[0]
+    else:
+        created_at, transaction_id = LEDGER_PAGE_START
+        balance = debtor.total_due
+        if until:
+            # Undo everything after the range so the first row shows its real balance
+            balance -= repository.debtor_ledger_total_since(db, debtor.id, until, read_through)
+        else:
+            until = LEDGER_PAGE_START[0]
+
+    rows = []
+    scan_size = limit + 1 if not transaction_type else max(limit + 1, 100)
+    scanned = 0
+
+    while True:
+        batch = repository.list_ledger_page(
+            db, debtor.id, (created_at, transaction_id), since, until, scan_size, read_through
+        )
+
+        for row in batch:
+            if not transaction_type or row['type'] == transaction_type:
+                if len(rows) == limit:
+                    return rows, encode_ledger_cursor(created_at, transaction_id, balance)
+                entry = dict(row)
+                entry['amount'] = to_rupees(entry['amount'])
+                entry['archived'] = bool(entry['archived'])
+                entry['balance'] = to_rupees(balance)
+                rows.append(entry)
+            balance -= signed_amount(row)
+            created_at, transaction_id = row['created_at'], row['id']
+
+        scanned += len(batch)
+        if len(batch) < scan_size:
+            return rows, None
+        if scanned >= LEDGER_PAGE_MAX_SCAN:
+            return rows, encode_ledger_cursor(created_at, transaction_id, balance)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive settled ledger history')
+    parser.add_argument('--horizon-days', type=int, default=ARCHIVE_HORIZON_DAYS)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    stats = run_archive(args.horizon_days, args.batch_size)
+    print(f"Archived {stats['transactions_archived']} transactions for "
+          f"{stats['debtors_archived']} of {stats['debtors_checked']} debtors")
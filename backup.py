@@ -0,0 +1,234 @@
+"""
+Patt Book - Backups
+Online snapshots of the live database, copied in small page steps, compressed, rotated and verified
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from database import DATABASE_BACKEND, DATABASE_PATH, DB_BUSY_TIMEOUT_SECONDS
+from logging_config import configure_logging
+
+# Backup configuration
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', '14'))
+BACKUP_INTERVAL_SECONDS = float(os.environ.get('BACKUP_INTERVAL_SECONDS', str(6 * 3600)))
+# Pages copied per step, and the pause after each step that lets writers in;
+# -1 copies everything in one step
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_SLEEP_SECONDS = float(os.environ.get('BACKUP_STEP_SLEEP_SECONDS', '0.005'))
+# Copying and compressing are CPU work that should yield to the web workers
+BACKUP_NICE = int(os.environ.get('BACKUP_NICE', '10'))
+
+SNAPSHOT_PREFIX = 'patt-book-'
+SNAPSHOT_SUFFIX = '.db.gz'
+PARTIAL_SUFFIX = '.partial'
+
+logger = logging.getLogger(__name__)
+
+def snapshot_name(now=None):
+    """File name for a snapshot taken now; names sort in time order"""
+    return f"{SNAPSHOT_PREFIX}{(now or datetime.utcnow()).strftime('%Y%m%dT%H%M%SZ')}{SNAPSHOT_SUFFIX}"
+
+def copy_database(source_path, target_path, pages=BACKUP_PAGES_PER_STEP, step_sleep=BACKUP_STEP_SLEEP_SECONDS):
+    """Copy a live database into a new standalone file with the online backup API; returns steps taken"""
+    source = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    target = sqlite3.connect(target_path)
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        if step_sleep and remaining:
+            time.sleep(step_sleep)
+
+    try:
+        # A read transaction pins one WAL snapshot for the whole copy. Writers
+        # carry on, and the copy is not restarted every time one of them commits.
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, progress=progress)
+        source.rollback()
+        # The copy inherits WAL mode; a snapshot should be a single self-contained file
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+        source.close()
+    return steps
+
+def check_integrity(path):
+    """Raise RuntimeError unless PRAGMA integrity_check passes on the database file"""
+    db = sqlite3.connect(path)
+    try:
+        problems = [row[0] for row in db.execute('PRAGMA integrity_check')]
+    finally:
+        db.close()
+    if problems != ['ok']:
+        raise RuntimeError(f"Integrity check failed: {'; '.join(problems[:5])}")
+
+def compress_file(source_path, target_path):
+    """gzip a file to target_path atomically (written under a temporary name, then renamed)"""
+    partial_path = target_path + PARTIAL_SUFFIX
+    with open(source_path, 'rb') as source, open(partial_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as compressed:
+            shutil.copyfileobj(source, compressed, 1024 * 1024)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial_path, target_path)
+
+def decompress_snapshot(path, directory):
+    """Unpack a snapshot into a temporary file in directory; caller removes it"""
+    handle, raw_path = tempfile.mkstemp(prefix='.restore-', suffix='.db', dir=directory)
+    with os.fdopen(handle, 'wb') as raw, gzip.open(path, 'rb') as compressed:
+        shutil.copyfileobj(compressed, raw, 1024 * 1024)
+    return raw_path
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """Completed snapshots, oldest first, as (path, size_bytes)"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    )
+    return [(os.path.join(backup_dir, name), os.path.getsize(os.path.join(backup_dir, name))) for name in names]
+
+def rotate_snapshots(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Delete all but the newest keep snapshots; returns the paths removed"""
+    snapshots = list_snapshots(backup_dir)
+    removed = [path for path, _ in snapshots[:max(len(snapshots) - keep, 0)]]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def remove_partial_files(backup_dir):
+    """Clear files left behind by a backup that was interrupted"""
+    for name in os.listdir(backup_dir):
+        if name.endswith(PARTIAL_SUFFIX) or name.startswith('.restore-'):
+            os.remove(os.path.join(backup_dir, name))
+
+def create_snapshot(database_path=DATABASE_PATH, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                    pages=BACKUP_PAGES_PER_STEP, step_sleep=BACKUP_STEP_SLEEP_SECONDS):
+    """Take a verified, compressed snapshot of the live database and rotate old ones"""
+    os.makedirs(backup_dir, exist_ok=True)
+    remove_partial_files(backup_dir)
+
+    started = time.perf_counter()
+    path = os.path.join(backup_dir, snapshot_name())
+    raw_path = path[:-len('.gz')] + PARTIAL_SUFFIX
+    try:
+        steps = copy_database(database_path, raw_path, pages, step_sleep)
+        copied_at = time.perf_counter()
+        check_integrity(raw_path)
+        size_bytes = os.path.getsize(raw_path)
+        compress_file(raw_path, path)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    result = {
+        'path': path,
+        'size_bytes': size_bytes,
+        'compressed_bytes': os.path.getsize(path),
+        'steps': steps,
+        'copy_seconds': round(copied_at - started, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'rotated': rotate_snapshots(backup_dir, keep)
+    }
+    logger.info("Snapshot created", extra=result)
+    return result
+
+def verify_snapshot(path):
+    """Decompress a snapshot and run the integrity check on it; returns its table names"""
+    raw_path = decompress_snapshot(path, os.path.dirname(os.path.abspath(path)))
+    try:
+        check_integrity(raw_path)
+        db = sqlite3.connect(raw_path)
+        try:
+            return [row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        finally:
+            db.close()
+    finally:
+        os.remove(raw_path)
+
+def restore_snapshot(path, database_path=DATABASE_PATH):
+    """Replace the database's contents with a verified snapshot
+
+    Written through the backup API into the live file, so its WAL and any
+    open connections stay consistent. Stop the web and worker processes
+    first; they would otherwise keep serving cached state from before.
+    """
+    directory = os.path.dirname(os.path.abspath(database_path))
+    raw_path = decompress_snapshot(path, directory)
+    try:
+        check_integrity(raw_path)
+        source = sqlite3.connect(raw_path)
+        target = sqlite3.connect(database_path, timeout=DB_BUSY_TIMEOUT_SECONDS)
+        try:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode=WAL')
+        finally:
+            target.close()
+            source.close()
+    finally:
+        os.remove(raw_path)
+    check_integrity(database_path)
+    logger.info("Snapshot restored", extra={'path': path, 'database_path': database_path})
+
+def run_service(interval_seconds=BACKUP_INTERVAL_SECONDS):
+    """Take a snapshot every interval_seconds, forever"""
+    while True:
+        started = time.monotonic()
+        try:
+            create_snapshot()
+        except Exception:
+            logger.exception("Error creating snapshot")
+        time.sleep(max(interval_seconds - (time.monotonic() - started), 0))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Online database snapshots')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('create', help='take one snapshot now')
+    commands.add_parser('run', help=f'take a snapshot every BACKUP_INTERVAL_SECONDS ({BACKUP_INTERVAL_SECONDS:g}s)')
+    commands.add_parser('list', help='show the snapshots in BACKUP_DIR')
+    verify_parser = commands.add_parser('verify', help='integrity-check a snapshot')
+    verify_parser.add_argument('path')
+    restore_parser = commands.add_parser('restore', help='overwrite the database with a snapshot')
+    restore_parser.add_argument('path')
+    restore_parser.add_argument('--yes', action='store_true', help='confirm overwriting the database')
+    args = parser.parse_args()
+
+    # Snapshots copy the SQLite file on this machine; PostgreSQL has its own backups
+    if DATABASE_BACKEND != 'sqlite':
+        print("backup.py only snapshots the SQLite database; with DATABASE_URL set, "
+              "use PostgreSQL's own backups (pg_dump or your provider's)", file=sys.stderr)
+        sys.exit(2)
+
+    configure_logging()
+    if args.command in ('create', 'run') and BACKUP_NICE and hasattr(os, 'nice'):
+        os.nice(BACKUP_NICE)
+    if args.command == 'create':
+        result = create_snapshot()
+        print(f"{result['path']}: {result['size_bytes']} bytes -> {result['compressed_bytes']} compressed "
+              f"in {result['total_seconds']}s ({result['steps']} steps)")
+    elif args.command == 'run':
+        run_service()
+    elif args.command == 'list':
+        for path, size_bytes in list_snapshots():
+            print(f"{path}  {size_bytes} bytes")
+    elif args.command == 'verify':
+        tables = verify_snapshot(args.path)
+        print(f"{args.path}: ok ({len(tables)} tables)")
+    elif args.command == 'restore':
+        if not args.yes:
+            print(f"This overwrites {DATABASE_PATH}. Stop the app and workers, then re-run with --yes.")
+            sys.exit(1)
+        restore_snapshot(args.path)
+        print(f"Restored {DATABASE_PATH} from {args.path}")
@@ -0,0 +1,180 @@
+"""
+Patt Book - Backup Impact Benchmark
+Measures credit/payment write latency while online snapshots are being taken
+
+Boots gunicorn against a seeded database and replays credit entries and
+payments from concurrent clients, first with no backup running, then while
+backup.py takes snapshots back to back: in small page steps (the default)
+and, for comparison, copying the whole file in a single step.
+
+Usage:
+    python bench_backup.py --transactions 300000 --duration 15 --clients 8
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import jwt
+import requests
+
+from bench_gunicorn import free_port, wait_for_server
+from bench_whatsapp import percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+JWT_SECRET = 'bench-secret'
+
+PHASES = [
+    ('no backup', None),
+    ('stepped', {}),
+    ('single step', {'BACKUP_PAGES_PER_STEP': '-1', 'BACKUP_STEP_SLEEP_SECONDS': '0'}),
+]
+
+def seed_database(database_path, debtors, transactions):
+    """A retailer with a long ledger, so a snapshot takes a while; returns the retailer id"""
+    rng = random.Random(7)
+    db = sqlite3.connect(database_path, timeout=10)
+    db.execute(
+        'INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?)',
+        ('9000000000', 'Bench Stores', 'Bench Road')
+    )
+    retailer_id = db.execute('SELECT id FROM retailers').fetchone()[0]
+    db.executemany(
+        'INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (?, ?, ?, ?)',
+        [(retailer_id, f'Customer {i}', f'{8000000000 + i}', 100000000) for i in range(debtors)]
+    )
+    db.executemany(
+        'INSERT INTO transactions (debtor_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?)',
+        [(rng.randint(1, debtors), 'credit', rng.randint(10, 500) * 100, 'Bench entry',
+          f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00:00') for _ in range(transactions)]
+    )
+    db.commit()
+    db.close()
+    return retailer_id
+
+def run_writes(base_url, token, debtors, clients, duration):
+    """Credit entries and payments until duration elapses; returns (latencies, errors)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def client():
+        session = requests.Session()
+        rng = random.Random()
+        while time.time() < stop_at:
+            started = time.perf_counter()
+            try:
+                if rng.random() < 0.7:
+                    response = session.post(base_url + '/api/debtors', headers=headers, timeout=60, json={
+                        'name': 'Walk-in', 'phone': f'{8000000000 + rng.randrange(debtors)}',
+                        'credit_amount': rng.randint(10, 500)
+                    })
+                else:
+                    response = session.post(base_url + '/api/payments', headers=headers, timeout=60, json={
+                        'debtor_id': rng.randint(1, debtors), 'amount': rng.randint(1, 20)
+                    })
+                ok = response.status_code == 200 and response.json().get('success')
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+def run_backups(workdir, overrides, stop):
+    """Take snapshots back to back in a separate process until stop is set; returns copy times"""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, BACKUP_DIR=os.path.join(workdir, 'backups'), BACKUP_KEEP='1')
+    env.update(overrides)
+    durations = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, 'backup.py'), 'create'],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        durations.append(time.perf_counter() - started)
+    return durations
+
+def main():
+    parser = argparse.ArgumentParser(description='Write latency while online backups run')
+    parser.add_argument('--transactions', type=int, default=300000, help='ledger rows seeded before the runs')
+    parser.add_argument('--debtors', type=int, default=2000)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='patt_book_backup_')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ)
+    env.update({
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_ACCESS_LOG': '/dev/null',
+        'GUNICORN_TIMEOUT': '120',
+        'JWT_SECRET': JWT_SECRET,
+        'TEST_MODE': 'true',
+        'PYTHONPATH': REPO_DIR,
+    })
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), 'app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        if not wait_for_server(base_url):
+            print(f"gunicorn failed to start: {process.stderr.read1().decode(errors='replace')[-300:]}")
+            return 1
+
+        database_path = os.path.join(workdir, 'retail_app.db')
+        retailer_id = seed_database(database_path, args.debtors, args.transactions)
+        token = jwt.encode({'retailer_id': retailer_id, 'exp': time.time() + 3600}, JWT_SECRET, algorithm='HS256')
+        print(f"{os.path.getsize(database_path) / 1024 / 1024:.1f} MB database, {args.clients} clients, "
+              f"{args.duration}s per run")
+
+        for name, overrides in PHASES:
+            stop = threading.Event()
+            backup_times = []
+            backup_thread = None
+            if overrides is not None:
+                backup_thread = threading.Thread(
+                    target=lambda: backup_times.extend(run_backups(workdir, overrides, stop))
+                )
+                backup_thread.start()
+
+            latencies, errors = run_writes(base_url, token, args.debtors, args.clients, args.duration)
+            stop.set()
+            if backup_thread:
+                backup_thread.join()
+
+            backups = (f"{len(backup_times)} snapshots, {sum(backup_times) / len(backup_times):.2f}s each"
+                       if backup_times else '')
+            print(f"{name:12s}  {len(latencies) / args.duration:7.1f} writes/s   "
+                  f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   "
+                  f"p99 {percentile(latencies, 99) * 1000:7.1f} ms   errors {errors}   {backups}")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
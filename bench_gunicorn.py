@@ -0,0 +1,189 @@
+"""
+Patt Book - Gunicorn Worker Benchmark
+Compares throughput and latency of worker classes on the app's request mix
+
+Each configuration boots gunicorn with gunicorn.conf.py against a fresh database
+and the fake WhatsApp API, then replays a mix of debtor list reads, credit
+entries and payments from concurrent HTTP clients.
+
+Usage:
+    python bench_gunicorn.py --latency-ms 150 --duration 15 --clients 32
+    python bench_gunicorn.py --database-url postgresql://localhost/patt_book_bench
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import jwt
+import requests
+
+from bench_whatsapp import percentile
+from fake_whatsapp_server import FakeWhatsAppServer
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+JWT_SECRET = 'bench-secret'
+
+CONFIGURATIONS = [
+    ('sync', {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_THREADS': '1'}),
+    ('gthread x8', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8'}),
+    ('gthread x32', {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '32'}),
+    ('gevent', {'GUNICORN_WORKER_CLASS': 'gevent'}),
+]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(base_url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+def seed_database(database_path, debtors, database_url=None):
+    """Create a retailer with some debtors; returns the retailer id"""
+    if database_url:
+        import psycopg
+        from postgres_backend import translate
+        db = psycopg.connect(database_url)
+    else:
+        translate = str
+        db = sqlite3.connect(database_path, timeout=10)
+    retailer_id = db.execute(
+        translate('INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?) RETURNING id'),
+        ('9000000000', 'Bench Stores', 'Bench Road')
+    ).fetchone()[0]
+    db.cursor().executemany(
+        translate('INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (?, ?, ?, ?)'),
+        [(retailer_id, f'Customer {i}', f'{8000000000 + i}', 1000000) for i in range(debtors)]
+    )
+    db.commit()
+    db.close()
+    return retailer_id
+
+def run_load(base_url, token, debtors, clients, duration):
+    """Replay the request mix until duration elapses; returns (latencies, errors)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def client():
+        session = requests.Session()
+        rng = random.Random()
+        while time.time() < stop_at:
+            roll = rng.random()
+            started = time.perf_counter()
+            try:
+                if roll < 0.6:
+                    response = session.get(base_url + '/api/debtors', headers=headers, timeout=60)
+                elif roll < 0.9:
+                    response = session.post(base_url + '/api/debtors', headers=headers, timeout=60, json={
+                        'name': 'Walk-in', 'phone': f'{8000000000 + rng.randrange(debtors)}',
+                        'credit_amount': rng.randint(10, 500)
+                    })
+                else:
+                    response = session.post(base_url + '/api/payments', headers=headers, timeout=60, json={
+                        'debtor_id': rng.randint(1, debtors), 'amount': rng.randint(1, 20)
+                    })
+                ok = response.status_code == 200 and response.json().get('success')
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+def benchmark(name, overrides, args, whatsapp_url):
+    workdir = tempfile.mkdtemp(prefix='patt_book_gunicorn_')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ)
+    env.update({
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_ACCESS_LOG': '/dev/null',
+        'GUNICORN_TIMEOUT': '120',
+        'JWT_SECRET': JWT_SECRET,
+        'TEST_MODE': 'false',
+        'WHATSAPP_API_BASE_URL': whatsapp_url,
+        'WHATSAPP_PHONE_NUMBER_ID': 'bench-number',
+        'WHATSAPP_ACCESS_TOKEN': 'bench-token',
+        'PYTHONPATH': REPO_DIR,
+    })
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+        # Each run starts from empty tables; SQLite runs get a fresh file in workdir
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, 'database.py'), '--reset'],
+                       cwd=workdir, env=env, check=True, capture_output=True)
+    env.update(overrides)
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), 'app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        if not wait_for_server(base_url):
+            print(f"{name:12s}  failed to start: {process.stderr.read1().decode(errors='replace')[-300:]}")
+            return
+
+        retailer_id = seed_database(os.path.join(workdir, 'retail_app.db'), args.debtors, args.database_url)
+        token = jwt.encode({'retailer_id': retailer_id, 'exp': time.time() + 3600}, JWT_SECRET, algorithm='HS256')
+
+        latencies, errors = run_load(base_url, token, args.debtors, args.clients, args.duration)
+        print(f"{name:12s}  {len(latencies) / args.duration:8.1f} req/s   "
+              f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   "
+              f"p99 {percentile(latencies, 99) * 1000:7.1f} ms   errors {errors}")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Gunicorn worker class benchmark')
+    parser.add_argument('--latency-ms', type=float, default=150.0, help='fake WhatsApp API latency')
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--debtors', type=int, default=500)
+    parser.add_argument('--database-url', help='PostgreSQL URL to run against instead of a SQLite file '
+                                               '(its tables are reset before each run)')
+    args = parser.parse_args()
+
+    with FakeWhatsAppServer(latency_ms=args.latency_ms) as whatsapp:
+        print(f"{args.workers} workers, {args.clients} clients, {args.duration}s per run, "
+              f"WhatsApp latency {args.latency_ms}ms, {'PostgreSQL' if args.database_url else 'SQLite'}")
+        for name, overrides in CONFIGURATIONS:
+            if overrides['GUNICORN_WORKER_CLASS'] == 'gevent':
+                if importlib.util.find_spec('gevent') is None:
+                    print(f"{name:12s}  skipped (gevent not installed)")
+                    continue
+            benchmark(name, overrides, args, whatsapp.base_url)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
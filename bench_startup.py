@@ -0,0 +1,98 @@
+"""
+Patt Book - Startup Benchmark
+Measures app import time and time to first request for a fresh worker process
+
+Exits non-zero when a budget is exceeded, so it can gate CI.
+
+Usage:
+    python bench_startup.py --runs 5 --max-import-ms 150 --max-first-request-ms 400
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter: import the app, then serve the first requests
+FIRST_REQUEST_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+ready = client.get('/readyz')
+readied = time.perf_counter()
+client.post('/api/auth/login', json={'phone': '9000000000'})
+finished = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'ready_ms': (readied - started) * 1000,
+    'first_request_ms': (finished - started) * 1000,
+    'ready_status': ready.status_code
+}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+def heaviest_imports(stderr, limit):
+    """Top-level modules imported by app, by cumulative microseconds"""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) <= 3:
+            entries.append((int(match.group(2)), match.group(4)))
+    return sorted(entries, reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description='App startup benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    parser.add_argument('--max-first-request-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='patt_book_startup_')
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    subprocess.run([sys.executable, '-c', 'import database; database.init_db()'],
+                   cwd=workdir, env=env, check=True, capture_output=True)
+
+    # -X importtime breakdown of a single cold import
+    profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                             cwd=workdir, env=env, check=True, capture_output=True, text=True)
+    print("Heaviest imports under app (cumulative):")
+    for micros, module in heaviest_imports(profile.stderr, 8):
+        print(f"  {micros / 1000:8.1f} ms  {module}")
+
+    samples = []
+    for _ in range(args.runs):
+        result = subprocess.run([sys.executable, '-c', FIRST_REQUEST_SCRIPT],
+                                cwd=workdir, env=env, check=True, capture_output=True, text=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    import_ms = statistics.median(sample['import_ms'] for sample in samples)
+    ready_ms = statistics.median(sample['ready_ms'] for sample in samples)
+    first_request_ms = statistics.median(sample['first_request_ms'] for sample in samples)
+    print(f"\nMedian of {args.runs} fresh processes:")
+    print(f"  import app           {import_ms:8.1f} ms")
+    print(f"  ready (/readyz)      {ready_ms:8.1f} ms")
+    print(f"  first API request    {first_request_ms:8.1f} ms")
+
+    failures = []
+    if any(sample['ready_status'] != 200 for sample in samples):
+        failures.append('/readyz did not report ready')
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        failures.append(f'import took {import_ms:.1f} ms (budget {args.max_import_ms} ms)')
+    if args.max_first_request_ms is not None and first_request_ms > args.max_first_request_ms:
+        failures.append(f'first request took {first_request_ms:.1f} ms (budget {args.max_first_request_ms} ms)')
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
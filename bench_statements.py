@@ -0,0 +1,97 @@
+"""
+Patt Book - Statement Generation Benchmark
+Measures statements per second for one large retailer at different process pool sizes
+
+Usage:
+    python bench_statements.py --debtors 10000 --transactions 12 --processes 1 2 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+def seed_retailer(db, debtors, transactions_per_debtor, period_start):
+    """One retailer with debtors whose ledgers span the month before and the statement month"""
+    rng = random.Random(42)
+    db.execute(
+        'INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?)',
+        ('9000000000', 'Bench Stores', 'Bench Road')
+    )
+    retailer_id = db.execute('SELECT id FROM retailers').fetchone()['id']
+    db.executemany(
+        'INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (?, ?, ?, 0)',
+        [(retailer_id, f'Customer {i}', f'{8000000000 + i}') for i in range(debtors)]
+    )
+
+    rows = []
+    totals = {}
+    for debtor_id in range(1, debtors + 1):
+        balance = 0
+        for i in range(transactions_per_debtor):
+            # Half the rows fall in the previous month, half in the statement month
+            day = 1 + i * 27 // transactions_per_debtor
+            month = period_start[:7] if i % 2 else previous_month(period_start)
+            if balance > 0 and rng.random() < 0.4:
+                kind, amount = 'payment', min(balance, rng.randint(1000, 30000))
+                balance -= amount
+            else:
+                kind, amount = 'credit', rng.randint(1000, 50000)
+                balance += amount
+            rows.append((debtor_id, kind, amount, 'Bench entry', f'{month}-{day:02d} 10:00:00'))
+        totals[debtor_id] = balance
+
+    db.executemany(
+        'INSERT INTO transactions (debtor_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?)',
+        rows
+    )
+    db.executemany('UPDATE debtors SET total_due = ? WHERE id = ?', [(v, k) for k, v in totals.items()])
+    db.commit()
+    return retailer_id, len(rows)
+
+def previous_month(period_start):
+    """'YYYY-MM' of the month before period_start"""
+    year, month = int(period_start[:4]), int(period_start[5:7])
+    return f'{year - (month == 1)}-{(month - 2) % 12 + 1:02d}'
+
+def main():
+    parser = argparse.ArgumentParser(description='Statement generation throughput benchmark')
+    parser.add_argument('--debtors', type=int, default=10000)
+    parser.add_argument('--transactions', type=int, default=12, help='ledger rows per debtor')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--format', choices=('text', 'html'), default='text')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='patt_book_statements_'))
+    import statements
+    from database import init_db, get_db
+    from repository import get_retailer
+
+    init_db()
+    period_start, period_end = statements.parse_period()
+
+    db = get_db()
+    started = time.perf_counter()
+    retailer_id, total_rows = seed_retailer(db, args.debtors, args.transactions, period_start)
+    print(f"Seeded {args.debtors} debtors, {total_rows} transactions in {time.perf_counter() - started:.1f}s")
+
+    retailer = get_retailer(db, retailer_id)
+    for processes in args.processes:
+        job_id, _ = statements.create_job(db, retailer, period_start, period_end, args.format)
+        db.commit()
+
+        started = time.perf_counter()
+        statements.run_worker(once=True, processes=processes)
+        elapsed = time.perf_counter() - started
+
+        progress = statements.get_job_progress(db, retailer_id, job_id)
+        print(f"{processes:3d} processes  {progress['statements']:6d} statements in {elapsed:6.2f}s  "
+              f"{progress['statements'] / elapsed:8.1f} statements/s  ({progress['status']})")
+
+    db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
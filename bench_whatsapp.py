@@ -0,0 +1,133 @@
+"""
+Patt Book - WhatsApp Throughput Benchmark
+Measures credit API latency and notification delivery rate against the fake Graph API
+
+Usage:
+    python bench_whatsapp.py --latency-ms 300 --error-rate 0.02 --requests 200 --concurrency 8
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from fake_whatsapp_server import FakeWhatsAppServer
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def run_api_phase(patt_app, token, total_requests, concurrency):
+    """POST credits from several threads; returns per-request latencies and elapsed seconds"""
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker():
+        client = patt_app.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            client.post('/api/debtors', headers=headers, json={
+                'name': f'Customer {i}',
+                'phone': f'{7000000000 + i}',
+                'credit_amount': 100 + i % 50,
+                'description': 'bench'
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='WhatsApp notification throughput benchmark')
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--max-messages-per-second', type=int, default=80)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    server = FakeWhatsAppServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        max_messages_per_second=args.max_messages_per_second
+    ).start()
+
+    # The app reads its configuration at import time
+    os.chdir(tempfile.mkdtemp(prefix='patt_book_bench_'))
+    os.environ.update({
+        'WHATSAPP_API_BASE_URL': server.base_url,
+        'WHATSAPP_PHONE_NUMBER_ID': 'bench-number',
+        'WHATSAPP_ACCESS_TOKEN': 'bench-token',
+        'TEST_MODE': 'false'
+    })
+    import app as patt_app
+    import reminders
+    from database import init_db
+
+    init_db()
+
+    db = patt_app.get_db()
+    db.execute(
+        'INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?)',
+        ('9000000000', 'Bench Stores', 'Bench Road')
+    )
+    db.commit()
+    retailer_id = db.execute('SELECT id FROM retailers').fetchone()['id']
+    token = patt_app.generate_jwt_token(retailer_id)
+
+    print(f"Fake WhatsApp latency {args.latency_ms}ms +{args.jitter_ms}ms jitter, "
+          f"error rate {args.error_rate}, throttle rate {args.throttle_rate}")
+
+    # Phase 1: interactive credit entries, each sending its notification inline
+    latencies, elapsed = run_api_phase(patt_app, token, args.requests, args.concurrency)
+    stats = server.state.stats
+    print(f"\nPOST /api/debtors x{args.requests} ({args.concurrency} threads)")
+    print(f"  throughput     {args.requests / elapsed:8.1f} req/s")
+    print(f"  latency p50    {percentile(latencies, 50) * 1000:8.1f} ms")
+    print(f"  latency p99    {percentile(latencies, 99) * 1000:8.1f} ms")
+    print(f"  delivered      {stats['accepted']:8d} / {args.requests} "
+          f"({stats['accepted'] / elapsed:.1f} msg/s, {stats['errors']} errors, {stats['throttled']} throttled)")
+
+    # Phase 2: one reminder campaign to every debtor, sent by the background dispatcher
+    server.state.reset()
+    campaign_id, total_recipients = reminders.create_campaign(db, retailer_id, 'Bench Stores', 0, 0)
+    db.commit()
+    started = time.perf_counter()
+    reminders.run_worker(once=True)
+    elapsed = time.perf_counter() - started
+    stats = server.state.stats
+    progress = reminders.get_campaign_progress(db, retailer_id, campaign_id)
+    print(f"\nReminder campaign x{total_recipients} ({reminders.REMINDER_WORKER_THREADS} dispatcher threads)")
+    print(f"  elapsed        {elapsed:8.2f} s")
+    print(f"  delivery rate  {stats['accepted'] / elapsed:8.1f} msg/s")
+    print(f"  recipients     {progress['counts']['sent']} sent, {progress['counts']['failed']} failed")
+
+    db.close()
+    server.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Patt Book - Test Fixtures
+Every test runs against an empty schema on the configured backend
+
+    python -m pytest                                   # SQLite, a fresh file per test
+    DATABASE_URL=postgresql://.../patt_book_test python -m pytest
+                                                       # PostgreSQL (its tables are emptied per test)
+"""
+
+import pytest
+
+import database
+
+# The schema as the first release created it (REAL rupees, no archive or later tables)
+BASELINE_SCHEMA = '''
+    CREATE TABLE retailers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT UNIQUE NOT NULL,
+        shop_name TEXT NOT NULL,
+        shop_address TEXT NOT NULL,
+        shop_photo_url TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE debtors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        retailer_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        total_due REAL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    );
+    CREATE TABLE transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        debtor_id INTEGER NOT NULL,
+        type TEXT CHECK(type IN ('credit', 'payment')) NOT NULL,
+        amount REAL NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    );
+    CREATE TABLE otp_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        otp_hash TEXT NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(phone)
+    );
+    CREATE INDEX idx_debtors_retailer_id ON debtors(retailer_id);
+    CREATE INDEX idx_transactions_debtor_id ON transactions(debtor_id);
+    CREATE INDEX idx_otp_requests_phone ON otp_requests(phone);
+
+    INSERT INTO retailers (phone, shop_name, shop_address) VALUES ('9000000001', 'Test Stores', 'Market Road');
+    INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (1, 'Asha', '9800000001', 150.5);
+    INSERT INTO transactions (debtor_id, type, amount, created_at) VALUES (1, 'credit', 200.25, '2025-01-01 10:00:00');
+    INSERT INTO transactions (debtor_id, type, amount, created_at) VALUES (1, 'payment', 49.75, '2025-01-02 10:00:00');
+'''
+
+@pytest.fixture(autouse=True)
+def fresh_database(tmp_path, monkeypatch):
+    """An empty schema; SQLite tests run in their own directory so spawned workers find the file"""
+    monkeypatch.chdir(tmp_path)
+    database.reset_pool()
+    if database.DATABASE_BACKEND == 'postgresql':
+        import postgres_backend
+        postgres_backend.init_db()
+        with postgres_backend.connect() as conn:
+            conn.execute(f"TRUNCATE {', '.join(postgres_backend.TABLES)} RESTART IDENTITY CASCADE")
+    else:
+        database.init_db()
+
+    from profile_cache import retailer_cache
+    retailer_cache.clear()
+    yield
+    database.reset_pool()
+
+@pytest.fixture
+def db():
+    connection = database.get_db()
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def client():
+    import app
+    return app.app.test_client()
+
+@pytest.fixture
+def retailer_id(db):
+    import repository
+    retailer_id = repository.create_retailer(db, '9000000001', 'Test Stores', 'Market Road')
+    db.commit()
+    return retailer_id
+
+@pytest.fixture
+def auth_headers(retailer_id):
+    import app
+    return {'Authorization': f'Bearer {app.generate_jwt_token(retailer_id)}'}
+
+@pytest.fixture
+def baseline_database():
+    """Replace the fresh schema with a first-release SQLite database holding one debtor"""
+    if database.DATABASE_BACKEND != 'sqlite':
+        pytest.skip('first-release databases were SQLite')
+    database.reset_pool()
+    db = database.connect()
+    for table in database.TABLES:
+        db.execute(f'DROP TABLE IF EXISTS {table}')
+    db.executescript(BASELINE_SCHEMA)
+    db.close()
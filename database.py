@@ -5,86 +5,477 @@ WhatsApp OTP Authentication & Ledger System
 
 import sqlite3
 import os
+import re
 from datetime import datetime
 import hashlib
+import logging
+import threading
+import time
+import repository
+from money import MONEY_COLUMNS, PAISE_PER_RUPEE
 
 DATABASE_PATH = 'retail_app.db'
 
-def get_db():
-    """Get database connection"""
-    db = sqlite3.connect(DATABASE_PATH)
+# A postgresql:// URL keeps the ledger in PostgreSQL (postgres_backend.py) so several
+# app servers can share it; otherwise it lives in the SQLite file at DATABASE_PATH
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+DATABASE_BACKEND = 'postgresql' if DATABASE_URL.startswith(('postgres://', 'postgresql://')) else 'sqlite'
+
+if DATABASE_BACKEND == 'postgresql':
+    import postgres_backend
+    IntegrityError = postgres_backend.IntegrityError
+else:
+    IntegrityError = sqlite3.IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Connections are reused so each keeps its compiled statement cache warm
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '16'))
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', '512'))
+DB_BUSY_TIMEOUT_SECONDS = float(os.environ.get('DB_BUSY_TIMEOUT_SECONDS', '10'))
+_pool = []
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+# Idempotency keys are kept for a day and swept at most every 5 minutes
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_SWEEP_INTERVAL = int(os.environ.get('IDEMPOTENCY_SWEEP_INTERVAL', '300'))
+_last_idempotency_sweep = 0.0
+
+class PooledConnection:
+    """A pooled sqlite3 connection; close() rolls back and returns it to the pool"""
+    
+    __slots__ = ('_db',)
+    
+    dialect = 'sqlite'
+    
+    def __init__(self, db):
+        self._db = db
+    
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+    
+    def close(self):
+        db, self._db = self._db, None
+        if db is None:
+            return
+        if db.in_transaction:
+            db.rollback()
+        with _pool_lock:
+            if len(_pool) < DB_POOL_SIZE and _pool_pid == os.getpid():
+                _pool.append(db)
+                return
+        db.close()
+
+def connect():
+    """Open a new configured connection"""
+    db = sqlite3.connect(
+        DATABASE_PATH,
+        timeout=DB_BUSY_TIMEOUT_SECONDS,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False
+    )
     db.row_factory = sqlite3.Row
+    # Durable at checkpoints and far fewer fsyncs than FULL in WAL mode
+    db.execute('PRAGMA synchronous=NORMAL')
     return db
 
+def get_db():
+    """Get database connection (from the pool when one is free)"""
+    global _pool_pid
+    if DATABASE_BACKEND == 'postgresql':
+        return postgres_backend.get_db()
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # Forked: connections belong to the parent, never touch them
+            _pool.clear()
+            _pool_pid = os.getpid()
+        db = _pool.pop() if _pool else None
+    return PooledConnection(db or connect())
+
+def reset_pool():
+    """Forget pooled connections, e.g. after fork, without closing them"""
+    global _pool_pid
+    if DATABASE_BACKEND == 'postgresql':
+        postgres_backend.reset_pool()
+    with _pool_lock:
+        _pool.clear()
+        _pool_pid = os.getpid()
+
+# Every table, dependants first, for reset_db()
+TABLES = (
+    'reconciliation_drift', 'reconciliation_runs', 'statements', 'statement_jobs', 'cache_versions',
+    'daily_rollup', 'reminder_recipients', 'reminder_campaigns', 'idempotency_keys', 'otp_requests',
+    'transactions_archive', 'transactions', 'debtors', 'retailers'
+)
+
+# Current definition of every table, in creation order; upgrade_schema() brings
+# tables created by older versions up to these
+SCHEMA = {
+    # Retailers
+    'retailers': '''
+    CREATE TABLE IF NOT EXISTS retailers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT UNIQUE NOT NULL,
+        shop_name TEXT NOT NULL,
+        shop_address TEXT NOT NULL,
+        shop_photo_url TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Debtors (total_due, like every amount column, is integer paise: see money.py)
+    'debtors': '''
+    CREATE TABLE IF NOT EXISTS debtors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        retailer_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        total_due INTEGER DEFAULT 0,
+        archived_through TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    )
+    ''',
+    # Transactions
+    # balance_forward rows carry the balance of history moved to transactions_archive
+    'transactions': '''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        debtor_id INTEGER NOT NULL,
+        type TEXT CHECK(type IN ('credit', 'payment', 'balance_forward')) NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    )
+    ''',
+    # Transactions archive (settled history, keeps original ids)
+    'transactions_archive': '''
+    CREATE TABLE IF NOT EXISTS transactions_archive (
+        id INTEGER PRIMARY KEY,
+        debtor_id INTEGER NOT NULL,
+        type TEXT CHECK(type IN ('credit', 'payment')) NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    )
+    ''',
+    # Daily rollup (per-retailer credit/payment totals per UTC day,
+    # kept current by the ledger write paths and rebuilt by rollup.py)
+    'daily_rollup': '''
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        retailer_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        credit_total INTEGER NOT NULL DEFAULT 0,
+        payment_total INTEGER NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (retailer_id, day),
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    ) WITHOUT ROWID
+    ''',
+    # Cache versions (per-process caches compare these to spot changes made by other workers)
+    'cache_versions': '''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    # OTP requests
+    'otp_requests': '''
+    CREATE TABLE IF NOT EXISTS otp_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phone TEXT NOT NULL,
+        otp_hash TEXT NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(phone)
+    )
+    ''',
+    # Idempotency keys (stored responses for retried POSTs)
+    'idempotency_keys': '''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        retailer_id INTEGER NOT NULL,
+        endpoint TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        status_code INTEGER NOT NULL,
+        response_body TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (retailer_id, endpoint, idempotency_key)
+    )
+    ''',
+    # Reminder campaigns
+    'reminder_campaigns': '''
+    CREATE TABLE IF NOT EXISTS reminder_campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        retailer_id INTEGER NOT NULL,
+        shop_name TEXT NOT NULL,
+        status TEXT CHECK(status IN ('running', 'paused', 'completed', 'cancelled')) NOT NULL DEFAULT 'running',
+        min_balance INTEGER NOT NULL DEFAULT 0,
+        min_days_inactive INTEGER NOT NULL DEFAULT 0,
+        total_recipients INTEGER NOT NULL DEFAULT 0,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        failed_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    )
+    ''',
+    # Reminder recipients (one row per debtor per campaign; claimed_at is when a worker took it for sending)
+    'reminder_recipients': '''
+    CREATE TABLE IF NOT EXISTS reminder_recipients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id INTEGER NOT NULL,
+        debtor_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        status TEXT CHECK(status IN ('pending', 'sending', 'sent', 'failed')) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        claimed_at TIMESTAMP,
+        sent_at TIMESTAMP,
+        UNIQUE(campaign_id, debtor_id),
+        FOREIGN KEY (campaign_id) REFERENCES reminder_campaigns (id),
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    )
+    ''',
+    # Statement jobs (one monthly statement run per retailer request)
+    'statement_jobs': '''
+    CREATE TABLE IF NOT EXISTS statement_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        retailer_id INTEGER NOT NULL,
+        shop_name TEXT NOT NULL,
+        shop_address TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        period_end TEXT NOT NULL,
+        format TEXT CHECK(format IN ('text', 'html')) NOT NULL DEFAULT 'text',
+        status TEXT CHECK(status IN ('queued', 'running', 'completed', 'failed')) NOT NULL DEFAULT 'queued',
+        total_debtors INTEGER NOT NULL DEFAULT 0,
+        processed_count INTEGER NOT NULL DEFAULT 0,
+        statement_count INTEGER NOT NULL DEFAULT 0,
+        last_debtor_id INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        completed_at TIMESTAMP,
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    )
+    ''',
+    # Statements (rendered output, kept for download)
+    'statements': '''
+    CREATE TABLE IF NOT EXISTS statements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        debtor_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        opening_balance INTEGER NOT NULL,
+        closing_balance INTEGER NOT NULL,
+        txn_count INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(job_id, debtor_id),
+        FOREIGN KEY (job_id) REFERENCES statement_jobs (id),
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    )
+    ''',
+    # Reconciliation runs (total_due checked against the ledger, resumable from last_debtor_id;
+    # runs requested from the API wait as 'queued' for the reconcile worker)
+    'reconciliation_runs': '''
+    CREATE TABLE IF NOT EXISTS reconciliation_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        retailer_id INTEGER,
+        repair INTEGER NOT NULL DEFAULT 0,
+        status TEXT CHECK(status IN ('queued', 'running', 'completed', 'failed')) NOT NULL DEFAULT 'running',
+        max_debtor_id INTEGER NOT NULL DEFAULT 0,
+        last_debtor_id INTEGER NOT NULL DEFAULT 0,
+        debtors_checked INTEGER NOT NULL DEFAULT 0,
+        drift_count INTEGER NOT NULL DEFAULT 0,
+        repaired_count INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        started_at TIMESTAMP,
+        completed_at TIMESTAMP,
+        FOREIGN KEY (retailer_id) REFERENCES retailers (id)
+    )
+    ''',
+    # Reconciliation drift (debtors whose total_due disagreed with the ledger)
+    'reconciliation_drift': '''
+    CREATE TABLE IF NOT EXISTS reconciliation_drift (
+        run_id INTEGER NOT NULL,
+        debtor_id INTEGER NOT NULL,
+        retailer_id INTEGER NOT NULL,
+        recorded_total INTEGER,
+        ledger_total INTEGER NOT NULL,
+        repaired INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (run_id, debtor_id),
+        FOREIGN KEY (run_id) REFERENCES reconciliation_runs (id),
+        FOREIGN KEY (debtor_id) REFERENCES debtors (id)
+    ) WITHOUT ROWID
+    ''',
+}
+
+# Indexes for performance
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_debtors_retailer_id ON debtors(retailer_id)',
+    'CREATE INDEX IF NOT EXISTS idx_debtors_retailer_total_due ON debtors(retailer_id, total_due)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_debtor_id ON transactions(debtor_id)',
+    # Covering index for ledger pages and balances: keyset order plus the columns the balance needs
+    'CREATE INDEX IF NOT EXISTS idx_transactions_debtor_created_at ON transactions(debtor_id, created_at, id, type, amount)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_archive_debtor_created_at ON transactions_archive(debtor_id, created_at, id, type, amount)',
+    'CREATE INDEX IF NOT EXISTS idx_otp_requests_phone ON otp_requests(phone)',
+    'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_reminder_campaigns_status ON reminder_campaigns(status)',
+    'CREATE INDEX IF NOT EXISTS idx_reminder_recipients_campaign_status ON reminder_recipients(campaign_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_statement_jobs_status ON statement_jobs(status)',
+    'CREATE INDEX IF NOT EXISTS idx_reconciliation_runs_retailer_status ON reconciliation_runs(retailer_id, status)',
+)
+
 def init_db():
-    """Initialize database with Retailer-Only schema"""
+    """Create any missing tables and indexes; never touches existing data, so it is safe on every start"""
+    if DATABASE_BACKEND == 'postgresql':
+        for change in postgres_backend.init_db():
+            logger.info("Schema upgrade: %s", change)
+        logger.info("Database initialized with Retailer-Only schema (PostgreSQL)")
+        return
+    
     db = get_db()
     
-    # Drop all existing tables for clean start
-    db.execute('DROP TABLE IF EXISTS otp_requests')
-    db.execute('DROP TABLE IF EXISTS transactions')
-    db.execute('DROP TABLE IF EXISTS debtors')
-    db.execute('DROP TABLE IF EXISTS retailers')
+    # WAL lets readers run alongside the single writer (persists in the file)
+    db.execute('PRAGMA journal_mode=WAL')
     
-    # Create retailers table
-    db.execute('''
-        CREATE TABLE retailers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone TEXT UNIQUE NOT NULL,
-            shop_name TEXT NOT NULL,
-            shop_address TEXT NOT NULL,
-            shop_photo_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    for create_sql in SCHEMA.values():
+        db.execute(create_sql)
     
-    # Create debtors table
-    db.execute('''
-        CREATE TABLE debtors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            retailer_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            total_due REAL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (retailer_id) REFERENCES retailers (id)
-        )
-    ''')
+    # Tables created by an older version get their new columns and constraints
+    repository.begin_write(db)
+    changes = upgrade_schema(db)
+    db.commit()
+    for change in changes:
+        logger.info("Schema upgrade: %s", change)
     
-    # Create transactions table
-    db.execute('''
-        CREATE TABLE transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            debtor_id INTEGER NOT NULL,
-            type TEXT CHECK(type IN ('credit', 'payment')) NOT NULL,
-            amount REAL NOT NULL,
-            description TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (debtor_id) REFERENCES debtors (id)
-        )
-    ''')
+    for create_sql in INDEXES:
+        db.execute(create_sql)
     
-    # Create OTP requests table
-    db.execute('''
-        CREATE TABLE otp_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            phone TEXT NOT NULL,
-            otp_hash TEXT NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            attempts INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(phone)
+    db.commit()
+    db.close()
+    logger.info("Database initialized with Retailer-Only schema")
+
+def real_money_columns(db, table):
+    """Money columns a SQLite table still declares REAL (rupees, from before money.py)"""
+    return [
+        row[1] for row in db.execute(f'PRAGMA table_info({table})')
+        if row[1] in MONEY_COLUMNS.get(table, ()) and row[2].upper() == 'REAL'
+    ]
+
+def rebuild_table(db, table):
+    """Recreate a SQLite table from SCHEMA and copy its rows across, in the caller's transaction
+
+    SQLite cannot change a column's type or a CHECK constraint in place, so
+    the current definition is created under a new name, filled, and renamed
+    over the old table (foreign keys are off). Columns the old table lacks
+    take their defaults, REAL money columns are converted to integer paise,
+    and the old table's indexes are recreated.
+    """
+    old_columns = [row[1] for row in db.execute(f'PRAGMA table_info({table})')]
+    rupee_columns = real_money_columns(db, table)
+    index_sqls = [row[0] for row in db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    )]
+
+    new_table = f'{table}_rebuild'
+    db.execute(SCHEMA[table].replace(f'IF NOT EXISTS {table} (', f'{new_table} (', 1))
+    new_columns = {row[1] for row in db.execute(f'PRAGMA table_info({new_table})')}
+
+    names = [name for name in old_columns if name in new_columns]
+    values = [
+        f'CAST(ROUND({name} * {PAISE_PER_RUPEE}) AS INTEGER)' if name in rupee_columns else name
+        for name in names
+    ]
+    db.execute(f"INSERT INTO {new_table} ({', '.join(names)}) SELECT {', '.join(values)} FROM {table}")
+    db.execute(f'DROP TABLE {table}')
+    db.execute(f'ALTER TABLE {new_table} RENAME TO {table}')
+    for index_sql in index_sqls:
+        db.execute(index_sql)
+
+# CHECK(...) clauses, allowing one level of nested parentheses as in CHECK(type IN (...))
+CHECK_PATTERN = re.compile(r'CHECK\s*\((?:[^()]|\([^()]*\))*\)', re.IGNORECASE)
+
+def check_constraints(create_sql):
+    """The CHECK clauses of a CREATE TABLE statement, whitespace removed, for comparison"""
+    return sorted(re.sub(r'\s+', '', clause) for clause in CHECK_PATTERN.findall(create_sql))
+
+def expected_columns():
+    """PRAGMA table_info rows of every SCHEMA table, from a scratch in-memory database"""
+    scratch = sqlite3.connect(':memory:')
+    try:
+        for create_sql in SCHEMA.values():
+            scratch.execute(create_sql)
+        return {table: scratch.execute(f'PRAGMA table_info({table})').fetchall() for table in SCHEMA}
+    finally:
+        scratch.close()
+
+def missing_columns(db):
+    """'table.column' for each SCHEMA column an existing table lacks; [] once the schema is current"""
+    present = repository.list_columns(db)
+    tables = {table for table, _ in present}
+    return [
+        f'{table}.{info[1]}'
+        for table, columns in expected_columns().items() if table in tables
+        for info in columns if (table, info[1]) not in present
+    ]
+
+def upgrade_schema(db):
+    """Bring SQLite tables created by older versions up to SCHEMA, in the caller's transaction
+
+    Missing nullable (or constant-default) columns are added in place; a
+    table whose CHECK constraints differ, that still has REAL money columns,
+    or that needs a column ALTER TABLE cannot add is rebuilt. Returns a
+    description of each change, so an up-to-date database gives [].
+    """
+    changes = []
+    for table, columns in expected_columns().items():
+        row = db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if row is None:
+            continue
+        present = {info[1] for info in db.execute(f'PRAGMA table_info({table})')}
+        missing = [info for info in columns if info[1] not in present]
+        # ALTER TABLE ADD COLUMN needs a constant default for NOT NULL columns
+        addable = all(
+            not (notnull and default is None) and not str(default).upper().startswith('CURRENT_')
+            for _, _, _, notnull, default, _ in missing
         )
-    ''')
-    
-    # Create indexes for performance
-    db.execute('CREATE INDEX idx_debtors_retailer_id ON debtors(retailer_id)')
-    db.execute('CREATE INDEX idx_transactions_debtor_id ON transactions(debtor_id)')
-    db.execute('CREATE INDEX idx_otp_requests_phone ON otp_requests(phone)')
+        if check_constraints(row[0]) != check_constraints(SCHEMA[table]) or real_money_columns(db, table) or not addable:
+            rebuild_table(db, table)
+            changes.append(f'rebuilt {table}')
+            continue
+        for _, name, column_type, notnull, default, _ in missing:
+            definition = f'{name} {column_type}'
+            if default is not None:
+                definition += f' DEFAULT {default}'
+            if notnull:
+                definition += ' NOT NULL'
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {definition}')
+            changes.append(f'added {table}.{name}')
+    return changes
+
+def reset_db():
+    """Drop every table and recreate the schema (python database.py --reset); destroys all data"""
+    if DATABASE_BACKEND == 'postgresql':
+        postgres_backend.reset_db()
+        logger.info("Database reset (PostgreSQL)")
+        return
     
+    db = get_db()
+    for table in TABLES:
+        db.execute(f'DROP TABLE IF EXISTS {table}')
     db.commit()
     db.close()
-    print("Database initialized with Retailer-Only schema")
+    init_db()
 
 def hash_otp(otp):
     """Hash OTP for secure storage"""
@@ -94,13 +485,44 @@ def cleanup_expired_otps():
     """Clean up expired OTPs"""
     db = get_db()
     try:
-        db.execute('DELETE FROM otp_requests WHERE expires_at < ?', (datetime.now(),))
+        repository.delete_expired_otp_requests(db, datetime.now())
         db.commit()
-    except Exception as e:
-        print(f"Error cleaning up expired OTPs: {e}")
+    except Exception:
+        logger.exception("Error cleaning up expired OTPs")
         db.rollback()
     finally:
         db.close()
 
+def cleanup_expired_idempotency_keys():
+    """Clean up expired idempotency keys"""
+    db = get_db()
+    try:
+        repository.delete_expired_idempotency_keys(db, datetime.utcnow())
+        db.commit()
+    except Exception:
+        logger.exception("Error cleaning up expired idempotency keys")
+        db.rollback()
+    finally:
+        db.close()
+
+def sweep_idempotency_keys():
+    """Run the idempotency key cleanup at most once per IDEMPOTENCY_SWEEP_INTERVAL seconds"""
+    global _last_idempotency_sweep
+    now = time.monotonic()
+    if now - _last_idempotency_sweep < IDEMPOTENCY_SWEEP_INTERVAL:
+        return
+    _last_idempotency_sweep = now
+    cleanup_expired_idempotency_keys()
+
 if __name__ == '__main__':
-    init_db()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Create the database schema')
+    parser.add_argument('--reset', action='store_true', help='drop every table first (destroys all data)')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.reset:
+        reset_db()
+    else:
+        init_db()
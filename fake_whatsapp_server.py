@@ -0,0 +1,245 @@
+"""
+Patt Book - Fake WhatsApp Cloud API
+Local stand-in for the Graph API messages endpoint, for end-to-end and throughput testing
+
+Point the app at it with:
+    WHATSAPP_API_BASE_URL=http://127.0.0.1:8999 TEST_MODE=false
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGES_PATH = re.compile(r'^/(v\d+\.\d+)/([^/]+)/messages$')
+
+DEFAULT_CONFIG = {
+    'latency_ms': 0.0,          # fixed delay before every response
+    'jitter_ms': 0.0,           # extra uniform random delay
+    'error_rate': 0.0,          # fraction of requests answered with 500
+    'throttle_rate': 0.0,       # fraction of requests answered with 429
+    'max_messages_per_second': 0,  # per phone number id; 0 disables the cap
+    'record_limit': 100000      # accepted messages kept for inspection
+}
+
+class FakeWhatsAppState:
+    """Configuration, recorded messages and counters shared by all handler threads"""
+
+    def __init__(self, **config):
+        self.lock = threading.Lock()
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config)
+        self.reset()
+
+    def reset(self):
+        """Forget recorded messages and counters"""
+        with self.lock:
+            self.messages = []
+            self.stats = {'requests': 0, 'accepted': 0, 'errors': 0, 'throttled': 0, 'rejected': 0}
+            self.windows = {}
+
+    def over_throughput(self, phone_number_id):
+        """Count a message against its number's one-second window; True if over the cap"""
+        limit = self.config['max_messages_per_second']
+        if not limit:
+            return False
+        second = int(time.monotonic())
+        with self.lock:
+            window_second, count = self.windows.get(phone_number_id, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            self.windows[phone_number_id] = (window_second, count + 1)
+            return count + 1 > limit
+
+    def record(self, outcome, message=None):
+        """Update counters and keep accepted messages"""
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats[outcome] += 1
+            if message is not None and len(self.messages) < self.config['record_limit']:
+                self.messages.append(message)
+
+def graph_error(code, message, error_type='OAuthException'):
+    """Error body in the Graph API format"""
+    return {'error': {'message': message, 'type': error_type, 'code': code, 'fbtrace_id': uuid.uuid4().hex[:16]}}
+
+class FakeWhatsAppHandler(BaseHTTPRequestHandler):
+    """Serves POST /{version}/{phone_number_id}/messages plus /_fake control endpoints"""
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        # Request logging would dominate the cost of a throughput run
+        pass
+
+    def send_json(self, status_code, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        if self.path == '/_fake/messages':
+            with self.state.lock:
+                messages = list(self.state.messages)
+            self.send_json(200, {'messages': messages})
+        elif self.path == '/_fake/stats':
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            self.send_json(200, {'stats': stats, 'config': self.state.config})
+        else:
+            self.send_json(404, graph_error(100, 'Unknown path'))
+
+    def do_DELETE(self):
+        if self.path == '/_fake/messages':
+            self.state.reset()
+            self.send_json(200, {'success': True})
+        else:
+            self.send_json(404, graph_error(100, 'Unknown path'))
+
+    def do_POST(self):
+        if self.path == '/_fake/config':
+            updates = self.read_json() or {}
+            unknown = set(updates) - set(DEFAULT_CONFIG)
+            if unknown:
+                self.send_json(400, {'success': False, 'message': f'Unknown settings: {sorted(unknown)}'})
+                return
+            with self.state.lock:
+                self.state.config.update(updates)
+            self.send_json(200, {'success': True, 'config': self.state.config})
+            return
+
+        match = MESSAGES_PATH.match(self.path)
+        if not match:
+            self.send_json(404, graph_error(100, 'Unknown path'))
+            return
+
+        version, phone_number_id = match.groups()
+        payload = self.read_json()
+        config = self.state.config
+
+        delay = config['latency_ms'] + random.uniform(0, config['jitter_ms'])
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self.state.record('rejected')
+            self.send_json(401, graph_error(190, 'Invalid OAuth access token'))
+            return
+
+        if (not isinstance(payload, dict) or payload.get('messaging_product') != 'whatsapp'
+                or not payload.get('to') or not payload.get('type')):
+            self.state.record('rejected')
+            self.send_json(400, graph_error(100, 'Invalid parameter', 'OAuthException'))
+            return
+
+        if random.random() < config['throttle_rate'] or self.state.over_throughput(phone_number_id):
+            self.state.record('throttled')
+            self.send_json(429, graph_error(130429, 'Rate limit hit'), {'Retry-After': '1'})
+            return
+
+        if random.random() < config['error_rate']:
+            self.state.record('errors')
+            self.send_json(500, graph_error(131000, 'Something went wrong'))
+            return
+
+        message_id = f'wamid.{uuid.uuid4().hex}'
+        self.state.record('accepted', {
+            'id': message_id,
+            'version': version,
+            'phone_number_id': phone_number_id,
+            'to': payload['to'],
+            'type': payload['type'],
+            'template': (payload.get('template') or {}).get('name'),
+            'received_at': time.time()
+        })
+        self.send_json(200, {
+            'messaging_product': 'whatsapp',
+            'contacts': [{'input': payload['to'], 'wa_id': payload['to']}],
+            'messages': [{'id': message_id}]
+        })
+
+class FakeWhatsAppServer:
+    """Runs the fake Graph API in a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        self.httpd = ThreadingHTTPServer((host, port), FakeWhatsAppHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = FakeWhatsAppState(**config)
+        self._thread = None
+
+    @property
+    def state(self):
+        return self.httpd.state
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Start serving; returns self so it can be chained"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake WhatsApp Cloud API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--max-messages-per-second', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeWhatsAppServer(
+        args.host, args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        max_messages_per_second=args.max_messages_per_second
+    )
+    print(f"Fake WhatsApp Cloud API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+"""
+Patt Book - Dataset Generator
+Fills the database with a reproducible, production-sized synthetic ledger for performance work
+
+Retailers get a skewed share of debtors (a few large shops, a long tail of
+small ones) and debtors a skewed share of transactions. Each debtor's
+history runs forward in time with realistic credit/payment amounts and
+never goes negative, so total_due, the ledger and the daily rollup all
+agree. Rows are written with executemany in large transactions; the same
+--seed always produces the same data.
+
+Usage:
+    python generate_dataset.py small-shop --reset
+    python generate_dataset.py wholesaler --reset --check-queries
+    python generate_dataset.py 10m-transactions --database /tmp/patt_book_10m.db --reset
+"""
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+import database
+
+# Rows per executemany call, and per committed transaction
+GENERATE_BATCH_SIZE = int(os.environ.get('GENERATE_BATCH_SIZE', '50000'))
+GENERATE_COMMIT_ROWS = int(os.environ.get('GENERATE_COMMIT_ROWS', '1000000'))
+
+PRESETS = {
+    # One neighbourhood shop: a few hundred regulars, a year of entries
+    'small-shop': {'retailers': 1, 'debtors': 300, 'transactions': 6000, 'months': 12, 'otps': 20},
+    # One wholesaler with 100k trade customers, two years of entries
+    'wholesaler': {'retailers': 1, 'debtors': 100000, 'transactions': 2000000, 'months': 24, 'otps': 200},
+    # The whole platform: many shops, 10M ledger rows over three years
+    '10m-transactions': {'retailers': 2000, 'debtors': 400000, 'transactions': 10000000, 'months': 36, 'otps': 5000},
+}
+
+# Share of debtors: retailer at rank r gets weight 1 / r ** RETAILER_SKEW
+RETAILER_SKEW = 1.1
+# Pareto shape for how busy each debtor is (lower is more skewed)
+DEBTOR_ACTIVITY_SHAPE = 1.5
+# Chance that an entry for a debtor who owes money is a payment
+PAYMENT_RATIO = 0.35
+# Chance that a payment settles the whole balance
+SETTLE_RATIO = 0.4
+# Share of OTP rows that have already expired
+EXPIRED_OTP_RATIO = 0.8
+
+FIRST_NAMES = ('Anil', 'Asha', 'Deepa', 'Farhan', 'Geeta', 'Imran', 'Joseph', 'Kavya', 'Lakshmi', 'Manoj',
+               'Meera', 'Noor', 'Prakash', 'Rahul', 'Rekha', 'Salim', 'Sunita', 'Thomas', 'Usha', 'Vijay')
+LAST_NAMES = ('Babu', 'Das', 'Fernandes', 'Iyer', 'Khan', 'Kumar', 'Menon', 'Nair', 'Pillai', 'Rao',
+              'Reddy', 'Shah', 'Sharma', 'Singh', 'Varghese')
+SHOP_NAMES = ('Stores', 'Traders', 'Provisions', 'Supermarket', 'Agencies', 'General Stores', 'Mart')
+TOWNS = ('Kochi', 'Kozhikode', 'Thrissur', 'Kannur', 'Kollam', 'Palakkad', 'Malappuram', 'Kottayam')
+CREDIT_DESCRIPTIONS = ('', '', 'Groceries', 'Rice and dal', 'Monthly provisions', 'Milk', 'Oil and sugar',
+                       'Vegetables', 'Cleaning supplies')
+
+def allocate(total, weights, rng, minimum=0):
+    """Split total into integer shares proportional to weights, each at least minimum"""
+    spare = total - minimum * len(weights)
+    weight_sum = sum(weights)
+    shares = []
+    for weight in weights:
+        expected = spare * weight / weight_sum
+        whole = int(expected)
+        # Randomised rounding keeps the sum close to total without a second pass
+        shares.append(minimum + whole + (rng.random() < expected - whole))
+    return shares
+
+def day_strings(start, days):
+    """'YYYY-MM-DD' for each day from start, so timestamps are built without strftime"""
+    return [(start + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+
+def debtor_history(rng, debtor_id, count, first_day, day_names):
+    """count transaction rows for a debtor in time order, and the closing balance (paise)
+
+    The debtor's first entry falls on or after first_day (skewed early);
+    entries are in shop hours, 08:00 to 21:59.
+    """
+    random = rng.random
+    start = (first_day + int(random() ** 2 * (len(day_names) - first_day))) * 50400
+    span = len(day_names) * 50400 - start
+    rows = []
+    balance = 0
+    for offset in sorted(start + int(random() * span) for _ in range(count)):
+        day, second = divmod(offset, 50400)
+        created_at = f'{day_names[day]} {8 + second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}'
+
+        if balance > 0 and random() < PAYMENT_RATIO:
+            if random() < SETTLE_RATIO:
+                amount = balance
+            else:
+                # Part payments in whole rupees
+                amount = min(balance, max(1, round(balance * (0.2 + 0.6 * random()) / 100)) * 100)
+            balance -= amount
+            rows.append((debtor_id, 'payment', amount, 'Payment received', created_at))
+        else:
+            # Log-normal around Rs 245, a fifth of them with 50 paise
+            amount = max(10, round(math.exp(rng.gauss(5.5, 0.8)))) * 100 + (50 if random() < 0.2 else 0)
+            balance += amount
+            rows.append((debtor_id, 'credit', amount, rng.choice(CREDIT_DESCRIPTIONS), created_at))
+    return rows, balance
+
+class BulkWriter:
+    """Buffers rows per statement and flushes them with executemany, committing every GENERATE_COMMIT_ROWS"""
+
+    def __init__(self, db, batch_size=GENERATE_BATCH_SIZE, commit_rows=GENERATE_COMMIT_ROWS):
+        self.db = db
+        self.batch_size = batch_size
+        self.commit_rows = commit_rows
+        # Insertion order matters: debtors are flushed before their transactions
+        self.buffers = {}
+        self.pending = 0
+        self.written = {}
+
+    def add(self, sql, rows):
+        buffer = self.buffers.setdefault(sql, [])
+        buffer.extend(rows)
+        self.pending += len(rows)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self, commit=False):
+        for sql, rows in self.buffers.items():
+            if rows:
+                self.db.executemany(sql, rows)
+                self.written[sql] = self.written.get(sql, 0) + len(rows)
+                rows.clear()
+        if commit or self.pending >= self.commit_rows:
+            self.db.commit()
+            self.pending = 0
+
+INSERT_RETAILER = 'INSERT INTO retailers (id, phone, shop_name, shop_address, created_at) VALUES (?, ?, ?, ?, ?)'
+INSERT_DEBTOR = 'INSERT INTO debtors (id, retailer_id, name, phone, total_due, created_at) VALUES (?, ?, ?, ?, ?, ?)'
+INSERT_TRANSACTION = 'INSERT INTO transactions (debtor_id, type, amount, description, created_at) VALUES (?, ?, ?, ?, ?)'
+INSERT_OTP_REQUEST = '''
+    INSERT INTO otp_requests (phone, otp_hash, expires_at, attempts, created_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(phone) DO NOTHING
+'''
+
+def generate(db, retailers, debtors, transactions, months, otps, seed=1, now=None):
+    """Append a synthetic dataset after whatever the database already holds; returns row counts"""
+    now = now or datetime.utcnow().replace(microsecond=0)
+    days = months * 30
+    # History runs up to the end of yesterday, so no row is in the future
+    first_date = (now - timedelta(days=days)).date()
+    day_names = day_strings(first_date, days)
+    rng = random.Random(seed)
+
+    first_retailer_id = (db.execute('SELECT MAX(id) FROM retailers').fetchone()[0] or 0) + 1
+    next_debtor_id = (db.execute('SELECT MAX(id) FROM debtors').fetchone()[0] or 0) + 1
+
+    debtor_counts = allocate(
+        debtors, [1 / rank ** RETAILER_SKEW for rank in range(1, retailers + 1)], rng,
+        minimum=1 if debtors >= retailers else 0
+    )
+    activity = [rng.paretovariate(DEBTOR_ACTIVITY_SHAPE) for _ in range(debtors)]
+    transaction_counts = allocate(transactions, activity, rng)
+
+    writer = BulkWriter(db)
+    position = 0
+    for index, debtor_count in enumerate(debtor_counts):
+        retailer_id = first_retailer_id + index
+        # Each retailer has its own stream, so its data does not depend on batch sizes
+        retailer_rng = random.Random(f'{seed}:{retailer_id}')
+        opened_day = int(retailer_rng.random() * days * 0.3)
+        writer.add(INSERT_RETAILER, [(
+            retailer_id, f'{9000000000 + retailer_id}',
+            f'{retailer_rng.choice(LAST_NAMES)} {retailer_rng.choice(SHOP_NAMES)}',
+            f'{retailer_rng.randint(1, 300)} Market Road, {retailer_rng.choice(TOWNS)}',
+            f'{day_names[opened_day]} 09:00:00'
+        )])
+
+        for count in transaction_counts[position:position + debtor_count]:
+            rows, balance = debtor_history(retailer_rng, next_debtor_id, max(count, 1), opened_day, day_names)
+            writer.add(INSERT_DEBTOR, [(
+                next_debtor_id, retailer_id,
+                f'{retailer_rng.choice(FIRST_NAMES)} {retailer_rng.choice(LAST_NAMES)}',
+                f'{7000000000 + next_debtor_id}', balance, rows[0][4]
+            )])
+            writer.add(INSERT_TRANSACTION, rows)
+            next_debtor_id += 1
+        position += debtor_count
+
+    # Mostly login attempts by existing retailers, the rest signups from new numbers;
+    # there is one row per phone
+    login_ids = rng.sample(range(first_retailer_id, first_retailer_id + retailers), min(otps * 3 // 5, retailers))
+    phones = [f'{9000000000 + retailer_id}' for retailer_id in login_ids]
+    phones += [f'{6000000000 + number}' for number in rng.sample(range(10 ** 9), otps - len(phones))]
+    for phone in phones:
+        if rng.random() < EXPIRED_OTP_RATIO:
+            expires_at = now - timedelta(seconds=rng.randint(1, 2 * 86400))
+        else:
+            expires_at = now + timedelta(seconds=rng.randint(1, 300))
+        otp_hash = hashlib.sha256(f'{rng.randint(100000, 999999)}'.encode()).hexdigest()
+        created_at = expires_at - timedelta(minutes=5)
+        writer.add(INSERT_OTP_REQUEST, [(
+            phone, otp_hash, expires_at.isoformat(' '), rng.randint(0, 3), created_at.isoformat(' ')
+        )])
+
+    writer.flush(commit=True)
+    return {
+        'retailers': writer.written.get(INSERT_RETAILER, 0),
+        'debtors': writer.written.get(INSERT_DEBTOR, 0),
+        'transactions': writer.written.get(INSERT_TRANSACTION, 0),
+        'otp_requests': db.execute('SELECT COUNT(*) FROM otp_requests').fetchone()[0],
+        'first_retailer_id': first_retailer_id,
+        'last_retailer_id': first_retailer_id + retailers - 1
+    }
+
+def time_queries(db, repeat=5):
+    """Median and worst milliseconds of the hot read paths against the largest retailer"""
+    import archive
+    import reconcile
+    import repository
+    import rollup
+
+    retailer_id, first_debtor_id, last_debtor_id = db.execute('''
+        SELECT retailer_id, MIN(id), MAX(id) FROM debtors
+        GROUP BY retailer_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    debtor_id = db.execute('''
+        SELECT debtor_id FROM transactions WHERE debtor_id BETWEEN ? AND ?
+        GROUP BY debtor_id ORDER BY COUNT(*) DESC LIMIT 1
+    ''', (first_debtor_id, last_debtor_id)).fetchone()[0]
+    debtor = repository.get_debtor(db, retailer_id, debtor_id)
+    since, until = rollup.parse_report_range(None, None)
+    year_ago = (datetime.utcnow().date() - timedelta(days=364)).isoformat()
+
+    checks = [
+        ('debtor summary', lambda: repository.get_debtor_summary(db, retailer_id)),
+        ('debtor list by total_due', lambda: repository.list_debtors(db, retailer_id, 'total_due', 'desc')),
+        ('ledger first page', lambda: archive.get_ledger_page(db, debtor, 50)),
+        ('ledger page, credits only', lambda: archive.get_ledger_page(db, debtor, 50, transaction_type='credit')),
+        ('collections, 30 days', lambda: rollup.get_collections_report(db, retailer_id, since, until)),
+        ('collections, 12 months', lambda: rollup.get_collections_report(db, retailer_id, year_ago, until, 'month')),
+        ('reconcile retailer', lambda: reconcile.check_range(db, first_debtor_id, last_debtor_id, retailer_id)),
+    ]
+    results = []
+    for name, check in checks:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            check()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results.append((name, timings[len(timings) // 2], timings[-1]))
+    return retailer_id, last_debtor_id - first_debtor_id + 1, debtor_id, results
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a reproducible synthetic dataset')
+    parser.add_argument('preset', choices=sorted(PRESETS))
+    parser.add_argument('--database', default=database.DATABASE_PATH, help='SQLite file to fill')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate every table first')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--retailers', type=int, help='override the preset')
+    parser.add_argument('--debtors', type=int, help='override the preset')
+    parser.add_argument('--transactions', type=int, help='override the preset')
+    parser.add_argument('--months', type=int, help='override the preset')
+    parser.add_argument('--otps', type=int, help='override the preset')
+    parser.add_argument('--check-queries', action='store_true', help='time the hot read queries afterwards')
+    args = parser.parse_args()
+
+    if database.DATABASE_BACKEND != 'sqlite':
+        print('generate_dataset.py writes SQLite files; unset DATABASE_URL')
+        return 1
+
+    sizes = dict(PRESETS[args.preset])
+    for name in sizes:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+
+    database.DATABASE_PATH = args.database
+    if args.reset:
+        database.reset_db()
+    else:
+        database.init_db()
+
+    import repository
+
+    db = database.connect()
+    # A rebuildable fixture: skip the fsyncs, the whole load is redone if it fails
+    db.execute('PRAGMA synchronous=OFF')
+    db.execute('PRAGMA cache_size=-262144')
+    try:
+        started = time.perf_counter()
+        counts = generate(db, seed=args.seed, **sizes)
+        generated_at = time.perf_counter()
+
+        db.execute('BEGIN IMMEDIATE')
+        repository.rebuild_daily_rollup(db, counts['first_retailer_id'], counts['last_retailer_id'])
+        db.commit()
+        # Fresh planner statistics, as a long-lived database would have
+        db.execute('ANALYZE')
+        elapsed = time.perf_counter() - started
+
+        print(f"{args.database}: {counts['retailers']} retailers, {counts['debtors']} debtors, "
+              f"{counts['transactions']} transactions, {counts['otp_requests']} OTP requests "
+              f"in {elapsed:.1f}s ({counts['transactions'] / (generated_at - started):,.0f} transactions/s)")
+
+        if args.check_queries:
+            retailer_id, debtor_count, debtor_id, results = time_queries(db)
+            print(f"Retailer {retailer_id} ({debtor_count} debtors), busiest debtor {debtor_id}:")
+            for name, median_ms, worst_ms in results:
+                print(f"  {name:28s}  median {median_ms:9.2f} ms   worst {worst_ms:9.2f} ms")
+    finally:
+        db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Patt Book - Gunicorn Configuration
+Environment-driven worker settings for production (loaded automatically by gunicorn)
+
+Handlers mostly wait on SQLite locks and WhatsApp API calls, so the default is
+a few processes each running several threads (gthread). Set
+GUNICORN_WORKER_CLASS=gevent (requires the gevent package) for many more
+concurrent slow requests per process.
+"""
+
+import importlib.util
+import multiprocessing
+import os
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+# Server socket (Heroku provides PORT)
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+backlog = env_int('GUNICORN_BACKLOG', 2048)
+
+# Worker processes
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# SQLite allows one writer at a time, so more processes than cores only adds lock contention
+workers = env_int('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4))
+threads = env_int('GUNICORN_THREADS', 8)
+worker_connections = env_int('GUNICORN_WORKER_CONNECTIONS', 200)
+
+if worker_class == 'gevent':
+    if importlib.util.find_spec('gevent') is None:
+        print("gevent is not installed, falling back to gthread workers")
+        worker_class = 'gthread'
+
+# Timeouts
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+# Recycle workers periodically; jitter keeps them from restarting together
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = os.environ.get('GUNICORN_PRELOAD_APP', 'true').lower() == 'true'
+
+# Logging
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Missing tables are created and older ones upgraded once in the master before workers start (existing
+# data is never touched; python database.py --reset is the only destructive step);
+# importing app.py itself never touches the database
+initialize_database = os.environ.get('PATT_BOOK_INIT_DB', 'true').lower() == 'true'
+
+def on_starting(server):
+    if initialize_database:
+        from database import init_db
+        init_db()
+
+def post_fork(server, worker):
+    # Objects created in the master (preload_app) must not be shared with the
+    # child: drop inherited HTTP connection pools and SQLite handles so each
+    # worker opens its own on first use
+    import database
+    import logging_config
+    import whatsapp_service
+    import rate_limiter
+    import app
+
+    # The master's log writer thread does not survive fork
+    logging_config.configure_logging()
+    database.reset_pool()
+    whatsapp_service.reset_http_session()
+    for limiter in (rate_limiter.otp_phone_limiter, rate_limiter.otp_ip_limiter):
+        if hasattr(limiter, 'reset_connections'):
+            limiter.reset_connections()
+
+    # Import lazy dependencies and check the schema before traffic arrives.
+    # gevent workers patch threading after this hook, so they warm up on the
+    # first /readyz probe instead.
+    if worker_class != 'gevent':
+        app.start_warm_up()
+
+    server.log.info("Worker %s ready (%s, %s threads)", worker.pid, worker_class, threads)
@@ -0,0 +1,173 @@
+"""
+Patt Book - Logging
+Structured JSON logs written by a background thread, with request ids and sampling
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Logging configuration
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+# Per-logger levels, e.g. "whatsapp_service=DEBUG,rate_limiter=WARNING"
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# Fraction of records kept per logger, e.g. "app.sends=0.1,whatsapp_service.sends=0.05";
+# warnings and errors are never dropped
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+_configure_lock = threading.Lock()
+_listener = None
+_configured_pid = None
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+def get_request_id():
+    """Id of the request being handled on this thread, or None"""
+    return _request_id.get()
+
+def set_request_id(request_id):
+    """Bind a request id to the current context; returns a token for reset_request_id()"""
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    """Restore the request id that was bound before set_request_id()"""
+    _request_id.reset(token)
+
+def parse_setting_list(value, convert):
+    """Parse "name=value,name=value" into a dict, skipping malformed entries"""
+    settings = {}
+    for item in value.split(','):
+        name, _, setting = item.partition('=')
+        if name.strip() and setting.strip():
+            try:
+                settings[name.strip()] = convert(setting.strip())
+            except ValueError:
+                continue
+    return settings
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id, on the thread that logged them"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep a random fraction of a logger's INFO/DEBUG records"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields become top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development (LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id') or record.request_id is None:
+            record.request_id = '-'
+        return super().format(record)
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for the listener thread, doing only the cheap work on the caller"""
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, since args and exc_info may not
+        # be safe to touch later from another thread; the formatter runs there.
+        # This is the root logger's only handler, so the record is not copied.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def configure_logging(force=False):
+    """Route all logging through a queue to a background writer thread
+
+    Safe to call repeatedly; it only reconfigures when forced or when called
+    in a new process (e.g. a gunicorn worker after fork, where the parent's
+    writer thread does not exist).
+    """
+    global _listener, _configured_pid
+    with _configure_lock:
+        if _configured_pid == os.getpid() and not force:
+            return
+        if _listener is not None and _configured_pid == os.getpid():
+            _listener.stop()
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = BackgroundQueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        for name, level in parse_setting_list(LOG_LEVELS, str.upper).items():
+            logging.getLogger(name).setLevel(level)
+
+        for name, rate in parse_setting_list(LOG_SAMPLE_RATES, float).items():
+            logger = logging.getLogger(name)
+            for existing in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+                logger.removeFilter(existing)
+            if rate < 1:
+                logger.addFilter(SamplingFilter(rate))
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        _configured_pid = os.getpid()
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener, _configured_pid
+    with _configure_lock:
+        if _listener is not None and _configured_pid == os.getpid():
+            _listener.stop()
+        _listener = None
+        _configured_pid = None
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,127 @@
+"""
+Patt Book - Money
+Amounts are stored and summed as integer paise; rupees only appear at the API and in messages
+
+Usage:
+    python money.py    # convert an existing database's REAL rupee columns to paise (once, after upgrading)
+"""
+
+import logging
+import os
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from logging_config import configure_logging
+
+PAISE_PER_RUPEE = 100
+
+# Largest single amount accepted from a client (one crore), well inside a 64-bit paise column
+MAX_AMOUNT_RUPEES = Decimal(os.environ.get('MAX_AMOUNT_RUPEES', '10000000'))
+
+# Every column that holds an amount of money
+MONEY_COLUMNS = {
+    'debtors': ('total_due',),
+    'transactions': ('amount',),
+    'transactions_archive': ('amount',),
+    'daily_rollup': ('credit_total', 'payment_total'),
+    'reminder_campaigns': ('min_balance',),
+    'reminder_recipients': ('amount',),
+    'statements': ('opening_balance', 'closing_balance'),
+    'reconciliation_drift': ('recorded_total', 'ledger_total'),
+}
+
+logger = logging.getLogger(__name__)
+
+def to_paise(value):
+    """Rupees from a request (number or numeric string) as integer paise; raises ValueError
+
+    Parsed as a decimal, so 0.1 + 0.2 style float error never reaches the
+    ledger, and rounded half up to the nearest paisa. Amounts beyond
+    MAX_AMOUNT_RUPEES either way are rejected before they can overflow a column.
+    """
+    if isinstance(value, bool):
+        raise ValueError('Amount must be a number')
+    try:
+        rupees = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError('Amount must be a number') from None
+    if not rupees.is_finite():
+        raise ValueError('Amount must be a number')
+    if abs(rupees) > MAX_AMOUNT_RUPEES:
+        raise ValueError(f'Amount must not exceed {MAX_AMOUNT_RUPEES:,} rupees')
+    return int((rupees * PAISE_PER_RUPEE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_rupees(paise):
+    """Integer paise as a JSON number of rupees (None stays None)"""
+    if paise is None:
+        return None
+    return paise / PAISE_PER_RUPEE
+
+def format_rupees(paise):
+    """Integer paise as '1,234.50' for messages and statements"""
+    rupees, remainder = divmod(abs(paise), PAISE_PER_RUPEE)
+    return f"{'-' if paise < 0 else ''}{rupees:,}.{remainder:02d}"
+
+# ============================================================================
+# MIGRATION
+# ============================================================================
+
+def migrate_sqlite(db):
+    """Rebuild every table whose money columns are still REAL with INTEGER paise columns
+
+    Tables are recreated from their current definition in database.py rather
+    than their stored CREATE statement, so columns and constraints added
+    since the database was created come along and the app can query the
+    result. Returns the tables rebuilt; running it again is a no-op.
+    """
+    import database
+
+    rebuilt = []
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        for table in MONEY_COLUMNS:
+            if database.real_money_columns(db, table):
+                database.rebuild_table(db, table)
+                rebuilt.append(table)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return rebuilt
+
+def migrate_postgresql(db):
+    """ALTER every money column still in floating point to BIGINT paise; returns the columns changed"""
+    changed = []
+    for table, columns in MONEY_COLUMNS.items():
+        for column in columns:
+            row = db.execute(
+                'SELECT data_type FROM information_schema.columns '
+                'WHERE table_schema = current_schema() AND table_name = ? AND column_name = ?',
+                (table, column)
+            ).fetchone()
+            if row and row[0] in ('double precision', 'real', 'numeric'):
+                db.execute(
+                    f'ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT '
+                    f'USING ROUND({column} * {PAISE_PER_RUPEE})::BIGINT'
+                )
+                changed.append(f'{table}.{column}')
+    db.commit()
+    return changed
+
+def migrate():
+    """Convert the configured database's money columns to integer paise"""
+    import database
+
+    db = database.get_db()
+    try:
+        if database.DATABASE_BACKEND == 'postgresql':
+            changed = migrate_postgresql(db)
+        else:
+            changed = migrate_sqlite(db)
+    finally:
+        db.close()
+    logger.info("Money columns migrated to paise", extra={'changed': changed})
+    return changed
+
+if __name__ == '__main__':
+    configure_logging()
+    changed = migrate()
+    print(f"Converted to paise: {', '.join(changed)}" if changed else 'Money columns are already integer paise')
@@ -0,0 +1,404 @@
+"""
+Patt Book - PostgreSQL Backend
+Pooled PostgreSQL connections that behave like the SQLite ones, so several app servers can share one ledger
+"""
+
+import itertools
+import os
+import threading
+from functools import lru_cache
+
+# Only imported when DATABASE_URL is a PostgreSQL URL
+try:
+    import psycopg
+    from psycopg.adapt import Loader
+    from psycopg.pq import TransactionStatus
+    from psycopg.rows import tuple_row
+    from psycopg_pool import ConnectionPool
+except ImportError as e:
+    raise ImportError("DATABASE_URL is a PostgreSQL URL: pip install 'psycopg[binary]' psycopg-pool") from e
+
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+
+# Pool configuration (per process; gunicorn workers each have their own)
+POSTGRES_POOL_MIN_SIZE = int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '2'))
+POSTGRES_POOL_MAX_SIZE = int(os.environ.get('POSTGRES_POOL_MAX_SIZE', '16'))
+POSTGRES_POOL_TIMEOUT_SECONDS = float(os.environ.get('POSTGRES_POOL_TIMEOUT_SECONDS', '10'))
+POSTGRES_STATEMENT_TIMEOUT_MS = int(os.environ.get('POSTGRES_STATEMENT_TIMEOUT_MS', '30000'))
+# Rows fetched per round trip by server-side cursors
+POSTGRES_FETCH_SIZE = int(os.environ.get('POSTGRES_FETCH_SIZE', '500'))
+
+IntegrityError = psycopg.IntegrityError
+
+# UTC like SQLite's CURRENT_TIMESTAMP, and no statement may hold a pooled connection forever
+CONNECTION_OPTIONS = f'-c timezone=UTC -c statement_timeout={POSTGRES_STATEMENT_TIMEOUT_MS}'
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_cursor_names = itertools.count()
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """sqlite3-style SQL ('?' placeholders) in psycopg's format (%s, literal % doubled)"""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+# ============================================================================
+# ROWS AND TYPES
+# ============================================================================
+
+@lru_cache(maxsize=256)
+def row_class(columns):
+    """Tuple subclass indexable by position or column name, like sqlite3.Row"""
+    positions = {name: index for index, name in enumerate(columns)}
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, positions[key] if isinstance(key, str) else key)
+
+    def keys(self):
+        return list(columns)
+
+    return type('Row', (tuple,), {'__slots__': (), '__getitem__': __getitem__, 'keys': keys})
+
+def mapping_row(cursor):
+    """psycopg row factory for Row objects"""
+    if cursor.description is None:
+        return tuple
+    return row_class(tuple(column.name for column in cursor.description))
+
+class TimestampTextLoader(Loader):
+    """Timestamps come back as 'YYYY-MM-DD HH:MM:SS[.ffffff]' strings, as they do from SQLite"""
+
+    def load(self, data):
+        return bytes(data).decode()
+
+class NumericLoader(Loader):
+    """SUM() over integers is numeric here; return int or float as SQLite would"""
+
+    def load(self, data):
+        text = bytes(data).decode()
+        try:
+            return int(text)
+        except ValueError:
+            return float(text)
+
+def configure_connection(conn):
+    """Per-connection setup run by the pool"""
+    for type_name in ('timestamp', 'timestamptz', 'date'):
+        conn.adapters.register_loader(type_name, TimestampTextLoader)
+    conn.adapters.register_loader('numeric', NumericLoader)
+
+# ============================================================================
+# CONNECTIONS
+# ============================================================================
+
+class PostgresConnection:
+    """A pooled psycopg connection with the sqlite3 calls the app uses; close() returns it to the pool"""
+
+    __slots__ = ('_pool', '_conn')
+
+    dialect = 'postgresql'
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        """Run sqlite3-style SQL; rows can be read by index or by column name"""
+        cursor = self._conn.cursor(row_factory=mapping_row)
+        cursor.execute(translate(sql), params)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self._conn.cursor()
+        cursor.executemany(translate(sql), seq_of_params)
+        return cursor
+
+    def cursor(self):
+        """Client-side cursor returning plain tuples; SQL given to it must use %s placeholders"""
+        return self._conn.cursor(row_factory=tuple_row)
+
+    def server_cursor(self):
+        """Server-side cursor fetching POSTGRES_FETCH_SIZE rows per round trip; %s placeholders"""
+        cursor = self._conn.cursor(name=f'patt_book_{next(_cursor_names)}', row_factory=tuple_row)
+        cursor.itersize = POSTGRES_FETCH_SIZE
+        return cursor
+
+    @property
+    def in_transaction(self):
+        return self._conn.info.transaction_status != TransactionStatus.IDLE
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if conn.info.transaction_status != TransactionStatus.IDLE:
+            conn.rollback()
+        self._pool.putconn(conn)
+
+def get_pool():
+    """This process's connection pool, created on first use"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Forked: the parent's pool threads and sockets are not ours to use
+            _pool = ConnectionPool(
+                DATABASE_URL,
+                min_size=POSTGRES_POOL_MIN_SIZE,
+                max_size=POSTGRES_POOL_MAX_SIZE,
+                timeout=POSTGRES_POOL_TIMEOUT_SECONDS,
+                kwargs={'options': CONNECTION_OPTIONS},
+                configure=configure_connection,
+                open=True
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+def get_db():
+    """Connection from this process's pool"""
+    pool = get_pool()
+    return PostgresConnection(pool, pool.getconn())
+
+def reset_pool():
+    """Forget the pool, e.g. after fork, without closing the parent's connections"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool = None
+        _pool_pid = None
+
+def connect():
+    """A standalone connection outside the pool (schema setup, scripts)"""
+    conn = psycopg.connect(DATABASE_URL, options=CONNECTION_OPTIONS)
+    configure_connection(conn)
+    return conn
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+# pg_advisory_xact_lock key held while the schema is created
+SCHEMA_LOCK_ID = 74612041
+
+TABLES = (
+    'reconciliation_drift', 'reconciliation_runs', 'statements', 'statement_jobs', 'cache_versions',
+    'daily_rollup', 'reminder_recipients', 'reminder_campaigns', 'idempotency_keys', 'otp_requests',
+    'transactions_archive', 'transactions', 'debtors', 'retailers'
+)
+
+# The SQLite schema from database.init_db() with PostgreSQL types (whole-second
+# timestamps, as CURRENT_TIMESTAMP gives in SQLite; amounts in BIGINT paise)
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS retailers (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        phone TEXT UNIQUE NOT NULL,
+        shop_name TEXT NOT NULL,
+        shop_address TEXT NOT NULL,
+        shop_photo_url TEXT,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS debtors (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        retailer_id BIGINT NOT NULL REFERENCES retailers (id),
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        total_due BIGINT DEFAULT 0,
+        archived_through TIMESTAMP(0),
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS transactions (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        debtor_id BIGINT NOT NULL REFERENCES debtors (id),
+        type TEXT CHECK(type IN ('credit', 'payment', 'balance_forward')) NOT NULL,
+        amount BIGINT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS transactions_archive (
+        id BIGINT PRIMARY KEY,
+        debtor_id BIGINT NOT NULL REFERENCES debtors (id),
+        type TEXT CHECK(type IN ('credit', 'payment')) NOT NULL,
+        amount BIGINT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP(0) NOT NULL,
+        archived_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS daily_rollup (
+        retailer_id BIGINT NOT NULL REFERENCES retailers (id),
+        day TEXT NOT NULL,
+        credit_total BIGINT NOT NULL DEFAULT 0,
+        payment_total BIGINT NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (retailer_id, day)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS otp_requests (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        phone TEXT NOT NULL UNIQUE,
+        otp_hash TEXT NOT NULL,
+        expires_at TIMESTAMP(0) NOT NULL,
+        attempts INTEGER DEFAULT 0,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS idempotency_keys (
+        retailer_id BIGINT NOT NULL,
+        endpoint TEXT NOT NULL,
+        idempotency_key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        status_code INTEGER NOT NULL,
+        response_body TEXT NOT NULL,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP(0) NOT NULL,
+        PRIMARY KEY (retailer_id, endpoint, idempotency_key)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS reminder_campaigns (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        retailer_id BIGINT NOT NULL REFERENCES retailers (id),
+        shop_name TEXT NOT NULL,
+        status TEXT CHECK(status IN ('running', 'paused', 'completed', 'cancelled')) NOT NULL DEFAULT 'running',
+        min_balance BIGINT NOT NULL DEFAULT 0,
+        min_days_inactive INTEGER NOT NULL DEFAULT 0,
+        total_recipients INTEGER NOT NULL DEFAULT 0,
+        sent_count INTEGER NOT NULL DEFAULT 0,
+        failed_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP(0)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS reminder_recipients (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        campaign_id BIGINT NOT NULL REFERENCES reminder_campaigns (id),
+        debtor_id BIGINT NOT NULL REFERENCES debtors (id),
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        amount BIGINT NOT NULL,
+        status TEXT CHECK(status IN ('pending', 'sending', 'sent', 'failed')) NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        claimed_at TIMESTAMP(0),
+        sent_at TIMESTAMP(0),
+        UNIQUE(campaign_id, debtor_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS statement_jobs (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        retailer_id BIGINT NOT NULL REFERENCES retailers (id),
+        shop_name TEXT NOT NULL,
+        shop_address TEXT NOT NULL,
+        period_start TEXT NOT NULL,
+        period_end TEXT NOT NULL,
+        format TEXT CHECK(format IN ('text', 'html')) NOT NULL DEFAULT 'text',
+        status TEXT CHECK(status IN ('queued', 'running', 'completed', 'failed')) NOT NULL DEFAULT 'queued',
+        total_debtors INTEGER NOT NULL DEFAULT 0,
+        processed_count INTEGER NOT NULL DEFAULT 0,
+        statement_count INTEGER NOT NULL DEFAULT 0,
+        last_debtor_id BIGINT NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP(0),
+        completed_at TIMESTAMP(0)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS statements (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        job_id BIGINT NOT NULL REFERENCES statement_jobs (id),
+        debtor_id BIGINT NOT NULL REFERENCES debtors (id),
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        opening_balance BIGINT NOT NULL,
+        closing_balance BIGINT NOT NULL,
+        txn_count INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(job_id, debtor_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS reconciliation_runs (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        retailer_id BIGINT REFERENCES retailers (id),
+        repair INTEGER NOT NULL DEFAULT 0,
+        status TEXT CHECK(status IN ('queued', 'running', 'completed', 'failed')) NOT NULL DEFAULT 'running',
+        max_debtor_id BIGINT NOT NULL DEFAULT 0,
+        last_debtor_id BIGINT NOT NULL DEFAULT 0,
+        debtors_checked INTEGER NOT NULL DEFAULT 0,
+        drift_count INTEGER NOT NULL DEFAULT 0,
+        repaired_count INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        started_at TIMESTAMP(0),
+        completed_at TIMESTAMP(0)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS reconciliation_drift (
+        run_id BIGINT NOT NULL REFERENCES reconciliation_runs (id),
+        debtor_id BIGINT NOT NULL REFERENCES debtors (id),
+        retailer_id BIGINT NOT NULL,
+        recorded_total BIGINT,
+        ledger_total BIGINT NOT NULL,
+        repaired INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (run_id, debtor_id)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_debtors_retailer_id ON debtors(retailer_id)',
+    'CREATE INDEX IF NOT EXISTS idx_debtors_retailer_total_due ON debtors(retailer_id, total_due)',
+    # Covering index for ledger pages and balances (index-only scans)
+    'CREATE INDEX IF NOT EXISTS idx_transactions_debtor_created_at ON transactions(debtor_id, created_at, id) INCLUDE (type, amount)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_archive_debtor_created_at '
+    'ON transactions_archive(debtor_id, created_at, id) INCLUDE (type, amount)',
+    'CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_reminder_campaigns_status ON reminder_campaigns(status)',
+    'CREATE INDEX IF NOT EXISTS idx_reminder_recipients_campaign_status ON reminder_recipients(campaign_id, status)',
+    'CREATE INDEX IF NOT EXISTS idx_statement_jobs_status ON statement_jobs(status)',
+    'CREATE INDEX IF NOT EXISTS idx_reconciliation_runs_retailer_status ON reconciliation_runs(retailer_id, status)',
+)
+
+# Changes to tables created by older versions, as (query that finds the change
+# already made, statement that makes it); ALTER TABLE locks the table even when
+# there is nothing to do, so each runs only when its check finds nothing
+UPGRADES = (
+    (
+        """SELECT 1 FROM information_schema.columns
+           WHERE table_schema = current_schema() AND table_name = 'debtors' AND column_name = 'archived_through'""",
+        'ALTER TABLE debtors ADD COLUMN archived_through TIMESTAMP(0)',
+    ),
+    (
+        """SELECT 1 FROM pg_constraint WHERE conrelid = 'transactions'::regclass
+           AND conname = 'transactions_type_check' AND pg_get_constraintdef(oid) LIKE '%balance_forward%'""",
+        """ALTER TABLE transactions DROP CONSTRAINT IF EXISTS transactions_type_check,
+           ADD CONSTRAINT transactions_type_check CHECK(type IN ('credit', 'payment', 'balance_forward'))""",
+    ),
+    (
+        """SELECT 1 FROM information_schema.columns
+           WHERE table_schema = current_schema() AND table_name = 'reminder_recipients' AND column_name = 'claimed_at'""",
+        'ALTER TABLE reminder_recipients ADD COLUMN claimed_at TIMESTAMP(0)',
+    ),
+    (
+        """SELECT 1 FROM pg_constraint WHERE conrelid = 'reconciliation_runs'::regclass
+           AND conname = 'reconciliation_runs_status_check' AND pg_get_constraintdef(oid) LIKE '%queued%'""",
+        """ALTER TABLE reconciliation_runs DROP CONSTRAINT IF EXISTS reconciliation_runs_status_check,
+           ADD CONSTRAINT reconciliation_runs_status_check
+           CHECK(status IN ('queued', 'running', 'completed', 'failed'))""",
+    ),
+)
+
+def init_db():
+    """Create any missing tables and indexes and upgrade older ones; returns the upgrades applied"""
+    applied = []
+    with connect() as conn:
+        # Nodes starting together would race on IF NOT EXISTS; one creates, the rest wait
+        conn.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK_ID,))
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for done_sql, upgrade_sql in UPGRADES:
+            if conn.execute(done_sql).fetchone() is None:
+                conn.execute(upgrade_sql)
+                applied.append(' '.join(upgrade_sql.split()))
+    return applied
+
+def reset_db():
+    """Drop every table and recreate the schema; destroys all data on every node"""
+    with connect() as conn:
+        for table in TABLES:
+            conn.execute(f'DROP TABLE IF EXISTS {table} CASCADE')
+    init_db()
@@ -0,0 +1,130 @@
+"""
+Patt Book - Retailer Profile Cache
+Per-process LRU/TTL cache of retailer rows with cross-worker invalidation
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+import repository
+
+# Cache configuration
+RETAILER_CACHE_SIZE = int(os.environ.get('RETAILER_CACHE_SIZE', '10000'))
+RETAILER_CACHE_TTL_SECONDS = float(os.environ.get('RETAILER_CACHE_TTL_SECONDS', '300'))
+# How stale another worker's profile change may look here, at most
+RETAILER_CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('RETAILER_CACHE_VERSION_CHECK_SECONDS', '5'))
+
+RETAILERS_CACHE_NAME = 'retailers'
+
+class RetailerProfileCache:
+    """Bounded LRU of Retailer records, each kept for at most ttl_seconds
+
+    Profile writes bump a version stamp in the database (cache_versions).
+    Every worker compares it with the version it last saw at most once per
+    version_check_seconds and drops its whole cache when it has moved.
+    """
+
+    def __init__(self, max_entries=RETAILER_CACHE_SIZE, ttl_seconds=RETAILER_CACHE_TTL_SECONDS,
+                 version_check_seconds=RETAILER_CACHE_VERSION_CHECK_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version_check_seconds = version_check_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        # Bumped on every local invalidation so a load that raced a write is not cached
+        self._generation = 0
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _check_version(self, db, now):
+        """Drop everything if another worker changed a profile since the last check"""
+        if now - self._version_checked_at < self.version_check_seconds:
+            return
+        version = repository.get_cache_version(db, RETAILERS_CACHE_NAME)
+        with self._lock:
+            self._version_checked_at = now
+            if version != self._version:
+                if self._version is not None and self._entries:
+                    self._counters['invalidations'] += len(self._entries)
+                self._entries.clear()
+                self._generation += 1
+                self._version = version
+
+    def get(self, db, retailer_id):
+        """Retailer record for the id, from the cache or the database; None if there is none"""
+        now = time.monotonic()
+        self._check_version(db, now)
+
+        with self._lock:
+            entry = self._entries.get(retailer_id)
+            if entry is not None:
+                retailer, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(retailer_id)
+                    self._counters['hits'] += 1
+                    return retailer
+                del self._entries[retailer_id]
+                self._counters['expired'] += 1
+            self._counters['misses'] += 1
+            generation = self._generation
+
+        retailer = repository.get_retailer(db, retailer_id)
+        if retailer is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(retailer, now)
+        return retailer
+
+    def get_shop_name(self, db, retailer_id):
+        """Retailer's shop name, or None"""
+        retailer = self.get(db, retailer_id)
+        return retailer.shop_name if retailer else None
+
+    def _store(self, retailer, now):
+        # Caller holds self._lock
+        self._entries[retailer.id] = (retailer, now + self.ttl_seconds)
+        self._entries.move_to_end(retailer.id)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def profile_changed(self, db, retailer_id):
+        """Bump the version stamp inside the caller's transaction; returns the new version"""
+        with self._lock:
+            self._entries.pop(retailer_id, None)
+            self._generation += 1
+        return repository.bump_cache_version(db, RETAILERS_CACHE_NAME)
+
+    def write_through(self, retailer, version):
+        """Cache a profile just committed with profile_changed()'s version"""
+        with self._lock:
+            self._entries.pop(retailer.id, None)
+            self._generation += 1
+            if self._version is not None and version == self._version + 1:
+                # Only our own bump happened since the last check, so nothing else is stale
+                self._version = version
+                self._store(retailer, time.monotonic())
+
+    def clear(self):
+        """Forget every cached profile and the last seen version"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._version = None
+            self._version_checked_at = 0.0
+
+    def stats(self):
+        """Hit/miss counters and current size for this process"""
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['misses']
+            return {
+                **self._counters,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': round(self._counters['hits'] / lookups, 4) if lookups else None,
+                'version': self._version
+            }
+
+retailer_cache = RetailerProfileCache()
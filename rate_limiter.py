@@ -0,0 +1,192 @@
+"""
+Patt Book - Rate Limiting
+Token-bucket limits and load shedding for the OTP endpoints
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import math
+import os
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Limiter configuration
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower()
+RATE_LIMIT_DATABASE_PATH = os.environ.get('RATE_LIMIT_DATABASE_PATH', 'rate_limits.db')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# How often each process deletes idle buckets from the SQLite store
+RATE_LIMIT_CLEANUP_SECONDS = float(os.environ.get('RATE_LIMIT_CLEANUP_SECONDS', '600'))
+
+# OTP sends: a phone may burst 3 and then gets 1 per minute,
+# an IP may burst 20 and then gets 1 every 30 seconds
+OTP_PHONE_BURST = int(os.environ.get('OTP_PHONE_BURST', '3'))
+OTP_PHONE_REFILL_SECONDS = float(os.environ.get('OTP_PHONE_REFILL_SECONDS', '60'))
+OTP_IP_BURST = int(os.environ.get('OTP_IP_BURST', '20'))
+OTP_IP_REFILL_SECONDS = float(os.environ.get('OTP_IP_REFILL_SECONDS', '30'))
+
+# Load shedding: OTP requests allowed in flight per worker process
+OTP_MAX_IN_FLIGHT = int(os.environ.get('OTP_MAX_IN_FLIGHT', '8'))
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key, with LRU eviction of idle keys"""
+
+    def __init__(self, name, capacity, refill_seconds, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.capacity = capacity
+        self.rate = 1.0 / refill_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        """Take tokens from the key's bucket; return (allowed, retry_after_seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [float(self.capacity), now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return True, 0
+
+            return False, math.ceil((tokens - bucket[0]) / self.rate)
+
+    def reset(self):
+        """Forget all buckets"""
+        with self._lock:
+            self._buckets.clear()
+
+class SQLiteTokenBucketLimiter:
+    """Token buckets kept in a small SQLite file so all workers on a host share them"""
+
+    def __init__(self, name, capacity, refill_seconds, database_path=RATE_LIMIT_DATABASE_PATH,
+                 cleanup_seconds=RATE_LIMIT_CLEANUP_SECONDS):
+        self.name = name
+        self.capacity = capacity
+        self.rate = 1.0 / refill_seconds
+        self.database_path = database_path
+        self.cleanup_seconds = cleanup_seconds
+        self._next_cleanup = time.monotonic() + cleanup_seconds
+        self._local = threading.local()
+
+    def _connect(self):
+        """Get this thread's connection to the limiter database"""
+        db = getattr(self._local, 'db', None)
+        if db is None or getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.database_path, timeout=1, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    bucket TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def consume(self, key, tokens=1):
+        """Take tokens from the key's bucket; return (allowed, retry_after_seconds)"""
+        bucket_key = f'{self.name}:{key}'
+        # Wall clock, because monotonic clocks are not shared between processes
+        now = time.time()
+        try:
+            db = self._connect()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute(
+                    'SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket = ?',
+                    (bucket_key,)
+                ).fetchone()
+
+                if row is None:
+                    available = float(self.capacity)
+                else:
+                    available = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+
+                allowed = available >= tokens
+                if allowed:
+                    available -= tokens
+
+                db.execute(
+                    'INSERT INTO rate_limit_buckets (bucket, tokens, updated_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT(bucket) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                    (bucket_key, available, now)
+                )
+                db.execute('COMMIT')
+            except Exception:
+                db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            # Fail open: a broken limiter store must not lock retailers out
+            logger.exception("Error checking rate limit", extra={'bucket': bucket_key})
+            return True, 0
+
+        self._maybe_cleanup()
+
+        if allowed:
+            return True, 0
+        return False, math.ceil((tokens - available) / self.rate)
+
+    def reset_connections(self):
+        """Forget connections inherited across fork without closing them"""
+        self._local = threading.local()
+
+    def cleanup(self, idle_seconds=None):
+        """Delete this limiter's buckets that have been idle long enough to be full again"""
+        if idle_seconds is None:
+            idle_seconds = self.capacity / self.rate
+        db = self._connect()
+        db.execute(
+            'DELETE FROM rate_limit_buckets WHERE bucket >= ? AND bucket < ? AND updated_at < ?',
+            (f'{self.name}:', f'{self.name};', time.time() - idle_seconds)
+        )
+
+    def _maybe_cleanup(self):
+        """Run cleanup from consume() at most once per cleanup_seconds in each process"""
+        now = time.monotonic()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + self.cleanup_seconds
+        try:
+            self.cleanup()
+        except sqlite3.Error:
+            logger.exception("Error cleaning up rate limit buckets", extra={'limiter': self.name})
+
+class LoadShedder:
+    """Caps concurrent requests per process and rejects the excess immediately"""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def acquire(self):
+        """Take a slot without waiting; False means the caller should shed the request"""
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        """Return a slot taken by acquire()"""
+        self._slots.release()
+
+def create_limiter(name, capacity, refill_seconds):
+    """Create a limiter for the configured RATE_LIMIT_BACKEND"""
+    if RATE_LIMIT_BACKEND == 'sqlite':
+        return SQLiteTokenBucketLimiter(name, capacity, refill_seconds)
+    return TokenBucketLimiter(name, capacity, refill_seconds)
+
+otp_phone_limiter = create_limiter('otp_phone', OTP_PHONE_BURST, OTP_PHONE_REFILL_SECONDS)
+otp_ip_limiter = create_limiter('otp_ip', OTP_IP_BURST, OTP_IP_REFILL_SECONDS)
+otp_load_shedder = LoadShedder(OTP_MAX_IN_FLIGHT)
@@ -0,0 +1,291 @@
+"""
+Patt Book - Ledger Reconciliation
+Recomputes every debtor's balance from the ledger and reports or repairs drift in total_due
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from database import get_db
+from logging_config import configure_logging
+from money import to_rupees
+import repository
+
+# Reconciliation configuration
+RECONCILE_PROCESSES = int(os.environ.get('RECONCILE_PROCESSES', str(os.cpu_count() or 1)))
+# Debtor ids per chunk: one read in a pool process, one short write transaction to record it
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', '2000'))
+# The worker (python reconcile.py --worker) polls for runs queued from the API;
+# a run still 'running' this long after it started lost its worker and is requeued
+RECONCILE_POLL_SECONDS = float(os.environ.get('RECONCILE_POLL_SECONDS', '5'))
+RECONCILE_RUN_TIMEOUT_SECONDS = int(os.environ.get('RECONCILE_RUN_TIMEOUT_SECONDS', '3600'))
+
+logger = logging.getLogger(__name__)
+
+_chunk_db = None
+
+# ============================================================================
+# CHECKING (runs in the reconciliation process pool)
+# ============================================================================
+
+def open_chunk_connection():
+    """Pool process initializer: one read-only connection per process"""
+    global _chunk_db
+    _chunk_db = get_db()
+    repository.set_read_only(_chunk_db)
+
+def check_range(db, first_debtor_id, last_debtor_id, retailer_id=None):
+    """Compare total_due with the ledger for a debtor id range; returns (debtors_checked, drift)
+
+    drift is a flat array of (debtor_id, retailer_id, recorded_total,
+    ledger_total) quadruples in paise: compact to send back from a pool
+    process whatever the chunk size.
+    """
+    checked = repository.count_debtors_in_range(db, first_debtor_id, last_debtor_id, retailer_id)
+    drift = array('q')
+    for row in repository.iter_ledger_drift(db, first_debtor_id, last_debtor_id, retailer_id):
+        drift.extend(row)
+    return checked, drift
+
+def drift_rows(drift):
+    """(debtor_id, retailer_id, recorded_total, ledger_total) tuples from check_range()'s array"""
+    return list(zip(*[iter(drift)] * 4))
+
+def check_chunk(first_debtor_id, last_debtor_id):
+    """check_range() on the pool process's own connection; the unit of work sent to the pool"""
+    try:
+        return check_range(_chunk_db, first_debtor_id, last_debtor_id)
+    finally:
+        # Hold no snapshot between chunks (PostgreSQL opens one for every read)
+        _chunk_db.rollback()
+
+# ============================================================================
+# RUNS
+# ============================================================================
+
+def start_run(db, repair, retailer_id=None, resume=True):
+    """Resume the unfinished run for this scope, or start a new one; returns the run row as a dict"""
+    if resume:
+        run = repository.get_running_run(db, retailer_id)
+        if run:
+            if repair and not run['repair']:
+                repository.set_run_repair(db, run['id'])
+                db.commit()
+                run['repair'] = 1
+            return run
+
+    # Runs left behind by an earlier crash are superseded by the new one
+    repository.supersede_running_runs(db, datetime.utcnow(), retailer_id)
+    run_id = repository.create_run(db, retailer_id, repair, repository.max_debtor_id(db), datetime.utcnow())
+    db.commit()
+    return repository.get_run(db, run_id)
+
+def repair_debtors(db, debtor_ids):
+    """Reset total_due to the ledger balance for debtors still drifted; caller holds the write lock
+
+    Balances are recomputed under the lock, so a ledger write that landed
+    after the check is never overwritten with a stale value.
+    """
+    return {debtor_id for debtor_id in debtor_ids if repository.repair_debtor(db, debtor_id)}
+
+def record_chunk(db, run, checked, drift, last_debtor_id):
+    """Store a chunk's drift, repair it if asked, and move the checkpoint, in one short transaction"""
+    drift = drift_rows(drift)
+    repository.begin_write(db)
+    try:
+        repaired = repair_debtors(db, [row[0] for row in drift]) if run['repair'] else set()
+        repository.record_drift(db, run['id'], drift, repaired)
+        repository.advance_run(db, run['id'], checked, len(drift), len(repaired), last_debtor_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def finish_run(db, run_id, error=None):
+    """Mark a run completed, or failed with the error"""
+    repository.finish_run(db, run_id, 'failed' if error else 'completed', error, datetime.utcnow())
+    db.commit()
+    return get_run(db, run_id)
+
+def get_run(db, run_id):
+    """Run counters as a dict, or None if not found"""
+    run = repository.get_run(db, run_id)
+    if not run:
+        return None
+    return {
+        'id': run['id'],
+        'status': run['status'],
+        'repair': bool(run['repair']),
+        'debtors_checked': run['debtors_checked'],
+        'drift_count': run['drift_count'],
+        'repaired_count': run['repaired_count'],
+        'error': run['error'],
+        'started_at': run['started_at'],
+        'completed_at': run['completed_at']
+    }
+
+def get_latest_drift(db, retailer_id, limit=100):
+    """The retailer's drift from the most recent run that covered them: (run, drift rows)"""
+    run_id = repository.get_latest_run_id(db, retailer_id)
+    if run_id is None:
+        return None, []
+
+    rows = repository.list_retailer_drift(db, run_id, retailer_id, limit)
+    return get_run(db, run_id), [{
+        'debtor_id': debtor_id,
+        'name': name,
+        'phone': phone,
+        'recorded_total': to_rupees(recorded_total),
+        'ledger_total': to_rupees(ledger_total),
+        'difference': to_rupees((recorded_total or 0) - ledger_total),
+        'repaired': bool(repaired)
+    } for debtor_id, name, phone, recorded_total, ledger_total, repaired in rows]
+
+# ============================================================================
+# RECONCILIATION
+# ============================================================================
+
+def check_retailer(db, run):
+    """Check a retailer run's debtors in this process, from its checkpoint; returns the finished run dict"""
+    retailer_id = run['retailer_id']
+    try:
+        after_debtor_id = run['last_debtor_id']
+        while True:
+            debtor_ids = repository.list_retailer_debtor_ids(
+                db, retailer_id, after_debtor_id, run['max_debtor_id'], RECONCILE_CHUNK_SIZE
+            )
+            if not debtor_ids:
+                break
+            checked, drift = check_range(db, debtor_ids[0], debtor_ids[-1], retailer_id)
+            record_chunk(db, run, checked, drift, debtor_ids[-1])
+            after_debtor_id = debtor_ids[-1]
+    except Exception as e:
+        db.rollback()
+        logger.exception("Error reconciling retailer", extra={'retailer_id': retailer_id, 'run_id': run['id']})
+        return finish_run(db, run['id'], str(e))
+    return finish_run(db, run['id'])
+
+def reconcile_retailer(db, retailer_id, repair=False):
+    """Reconcile one retailer's debtors in this process right away; returns the run dict"""
+    return check_retailer(db, start_run(db, repair, retailer_id, resume=False))
+
+def queue_run(db, retailer_id, repair=False):
+    """Queue a run for one retailer for the worker, or reuse one already waiting; returns the run dict
+
+    A queued run asked to repair is upgraded to repair, so the latest request
+    always gets at least what it asked for. The caller commits.
+    """
+    queued = repository.get_queued_run(db, retailer_id)
+    if queued:
+        run_id, queued_repair = queued
+        if repair and not queued_repair:
+            repository.set_run_repair(db, run_id)
+        return get_run(db, run_id)
+
+    return get_run(db, repository.queue_run(db, retailer_id, repair))
+
+def claim_queued_run(db, run_id):
+    """Move a queued run to running for this worker; returns its row as a dict, or None if another worker took it"""
+    claimed = repository.claim_queued_run(db, run_id, datetime.utcnow())
+    db.commit()
+    if not claimed:
+        return None
+    return repository.get_run(db, run_id)
+
+def requeue_stale_runs(db):
+    """Return retailer runs whose worker died to the queue; they resume from their checkpoint"""
+    started_before = datetime.utcnow() - timedelta(seconds=RECONCILE_RUN_TIMEOUT_SECONDS)
+    repository.requeue_stale_runs(db, started_before)
+    db.commit()
+
+def run_worker(once=False):
+    """Poll for runs queued from the API and check each retailer in turn"""
+    db = get_db()
+    repository.set_busy_timeout(db, 5000)
+    while True:
+        requeue_stale_runs(db)
+        run_ids = repository.list_queued_run_ids(db)
+        for run_id in run_ids:
+            run = claim_queued_run(db, run_id)
+            if run:
+                result = check_retailer(db, run)
+                logger.info("Queued reconciliation finished", extra={
+                    'run_id': result['id'], 'status': result['status'], 'drift_count': result['drift_count']
+                })
+
+        if once:
+            break
+        if not run_ids:
+            time.sleep(RECONCILE_POLL_SECONDS)
+
+    db.close()
+
+def run_reconciliation(repair=False, processes=RECONCILE_PROCESSES, chunk_size=RECONCILE_CHUNK_SIZE, resume=True):
+    """Reconcile every debtor, spreading chunks of the id range across a process pool
+
+    Chunks are recorded strictly in id order, so last_debtor_id is always a
+    safe place to resume from; at most two chunks per process are in flight.
+    """
+    db = get_db()
+    repository.set_busy_timeout(db, 5000)
+    run = start_run(db, repair, resume=resume)
+    logger.info("Reconciliation started", extra={
+        'run_id': run['id'], 'repair': bool(run['repair']), 'resume_after': run['last_debtor_id']
+    })
+
+    # spawn: this process has threads (logging) that must not be forked mid-flight
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=open_chunk_connection) as pool:
+            in_flight = deque()
+            next_first_id = run['last_debtor_id'] + 1
+            while True:
+                while next_first_id <= run['max_debtor_id'] and len(in_flight) < processes * 2:
+                    last_id = min(next_first_id + chunk_size - 1, run['max_debtor_id'])
+                    in_flight.append((pool.submit(check_chunk, next_first_id, last_id), last_id))
+                    next_first_id = last_id + 1
+                if not in_flight:
+                    break
+                future, last_id = in_flight.popleft()
+                checked, drift = future.result()
+                record_chunk(db, run, checked, drift, last_id)
+        result = finish_run(db, run['id'])
+    except Exception as e:
+        db.rollback()
+        logger.exception("Error reconciling ledger", extra={'run_id': run['id']})
+        result = finish_run(db, run['id'], str(e))
+    finally:
+        db.close()
+
+    logger.info("Reconciliation finished", extra={
+        'run_id': result['id'], 'status': result['status'], 'debtors_checked': result['debtors_checked'],
+        'drift_count': result['drift_count'], 'repaired_count': result['repaired_count']
+    })
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check debtors.total_due against the transaction ledger')
+    parser.add_argument('--repair', action='store_true', help='reset drifted balances to the ledger total')
+    parser.add_argument('--processes', type=int, default=RECONCILE_PROCESSES)
+    parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+    parser.add_argument('--fresh', action='store_true', help='start over instead of resuming an interrupted run')
+    parser.add_argument('--worker', action='store_true', help='run retailer checks queued from the API, forever')
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.worker:
+        run_worker()
+    else:
+        result = run_reconciliation(args.repair, args.processes, args.chunk_size, resume=not args.fresh)
+        print(f"Run {result['id']} {result['status']}: {result['debtors_checked']} debtors checked, "
+              f"{result['drift_count']} drifted, {result['repaired_count']} repaired")
+        # Non-zero exit so a scheduler can alert on unrepaired drift
+        sys.exit(0 if result['status'] == 'completed' and result['drift_count'] == result['repaired_count'] else 1)
@@ -0,0 +1,256 @@
+"""
+Patt Book - Payment Reminder Campaigns
+Bulk WhatsApp reminders to overdue debtors, dispatched by a background worker
+"""
+
+import logging
+import threading
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from database import get_db
+import repository
+from rate_limiter import TokenBucketLimiter
+import whatsapp_service
+from logging_config import configure_logging
+from money import format_rupees, to_rupees
+
+# Dispatcher configuration
+REMINDER_WORKER_THREADS = int(os.environ.get('REMINDER_WORKER_THREADS', '16'))
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', '200'))
+REMINDER_MAX_ATTEMPTS = int(os.environ.get('REMINDER_MAX_ATTEMPTS', '3'))
+REMINDER_POLL_SECONDS = float(os.environ.get('REMINDER_POLL_SECONDS', '5'))
+# Longest pause honoured from a 429 Retry-After header
+REMINDER_MAX_BACKOFF_SECONDS = float(os.environ.get('REMINDER_MAX_BACKOFF_SECONDS', '60'))
+# 429s in a row after which a send counts as a failed attempt
+REMINDER_MAX_THROTTLE_RETRIES = int(os.environ.get('REMINDER_MAX_THROTTLE_RETRIES', '10'))
+# Recipients claimed longer ago than this belong to a worker that died and are requeued
+REMINDER_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('REMINDER_CLAIM_TIMEOUT_SECONDS', '1800'))
+# Longest wait before dispatching a campaign again after an unexpected error
+REMINDER_MAX_ERROR_BACKOFF_SECONDS = float(os.environ.get('REMINDER_MAX_ERROR_BACKOFF_SECONDS', '300'))
+
+# WhatsApp Cloud API throughput per business phone number
+WHATSAPP_MESSAGES_PER_SECOND = int(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND', '80'))
+
+CAMPAIGN_STATUSES = ('running', 'paused', 'completed', 'cancelled')
+
+logger = logging.getLogger(__name__)
+
+# One bucket per sending number, shared by every dispatcher thread
+throughput_limiter = TokenBucketLimiter(
+    'whatsapp_throughput', WHATSAPP_MESSAGES_PER_SECOND, 1.0 / WHATSAPP_MESSAGES_PER_SECOND
+)
+
+# After a 429 every dispatcher thread waits until this monotonic time
+_backoff_lock = threading.Lock()
+_backoff_until = 0.0
+
+# ============================================================================
+# CAMPAIGN MANAGEMENT
+# ============================================================================
+
+def create_campaign(db, retailer_id, shop_name, min_balance, min_days_inactive):
+    """Create a campaign and enqueue every matching debtor in a single INSERT ... SELECT (min_balance in paise)"""
+    campaign_id = repository.create_campaign(db, retailer_id, shop_name, min_balance, min_days_inactive)
+
+    inactive_since = (datetime.utcnow() - timedelta(days=min_days_inactive)).strftime('%Y-%m-%d %H:%M:%S')
+    total_recipients = repository.enqueue_campaign_recipients(db, campaign_id, retailer_id, min_balance, inactive_since)
+
+    if total_recipients:
+        repository.set_campaign_total_recipients(db, campaign_id, total_recipients)
+    else:
+        repository.complete_empty_campaign(db, campaign_id, datetime.utcnow())
+
+    return campaign_id, total_recipients
+
+def set_campaign_status(db, retailer_id, campaign_id, status, from_statuses):
+    """Move a campaign to a new status; returns False if it was not in one of from_statuses"""
+    return repository.set_campaign_status(db, retailer_id, campaign_id, status, from_statuses)
+
+def get_campaign_progress(db, retailer_id, campaign_id):
+    """Campaign row plus per-status recipient counts, or None if not found"""
+    campaign = repository.get_campaign(db, retailer_id, campaign_id)
+
+    if not campaign:
+        return None
+
+    counts = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+    counts.update(repository.count_recipients_by_status(db, campaign_id))
+
+    total = campaign['total_recipients']
+    return {
+        'id': campaign['id'],
+        'status': campaign['status'],
+        'min_balance': to_rupees(campaign['min_balance']),
+        'min_days_inactive': campaign['min_days_inactive'],
+        'total_recipients': total,
+        'counts': counts,
+        'percent_complete': round(100.0 * (counts['sent'] + counts['failed']) / total, 1) if total else 100.0,
+        'created_at': campaign['created_at'],
+        'completed_at': campaign['completed_at']
+    }
+
+def get_campaign_recipients(db, campaign_id, status=None, after_id=0, limit=100):
+    """Page through a campaign's recipients in id order, optionally filtered by status"""
+    rows = repository.list_recipients(db, campaign_id, status, after_id, limit)
+    return [dict(row, amount=to_rupees(row['amount'])) for row in rows]
+
+# ============================================================================
+# DISPATCH WORKER
+# ============================================================================
+
+def claim_recipients(db, campaign_id, limit):
+    """Mark the next batch of pending recipients as sending and return them with their current balance
+
+    Debtors who have paid off since the campaign was created are not sent
+    anything: they are marked failed with the reason, without using an attempt.
+    """
+    repository.begin_write(db)
+    try:
+        while True:
+            rows = [
+                dict(zip(('id', 'name', 'phone', 'amount'), row))
+                for row in repository.list_pending_recipients(db, campaign_id, limit)
+            ]
+            due = [row for row in rows if row['amount'] > 0]
+            repository.skip_settled_recipients(db, [row['id'] for row in rows if row['amount'] <= 0])
+            if due or not rows:
+                break
+
+        repository.claim_recipients(db, [(row['id'], row['amount']) for row in due], datetime.utcnow())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return due
+
+def back_off(seconds):
+    """Pause every dispatcher thread for a 429's Retry-After (capped at REMINDER_MAX_BACKOFF_SECONDS)"""
+    global _backoff_until
+    with _backoff_lock:
+        _backoff_until = max(_backoff_until, time.monotonic() + min(seconds, REMINDER_MAX_BACKOFF_SECONDS))
+
+def wait_for_send_slot():
+    """Block until any back-off has passed and the per-number throughput budget allows a send"""
+    while True:
+        delay = _backoff_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+            continue
+        allowed, _ = throughput_limiter.consume(whatsapp_service.WHATSAPP_PHONE_NUMBER_ID)
+        if allowed:
+            return
+        time.sleep(1.0 / WHATSAPP_MESSAGES_PER_SECOND)
+
+def campaign_is_running(campaign_id):
+    """Whether a campaign is still running (not paused or cancelled since its batch was claimed)"""
+    db = get_db()
+    try:
+        campaign = repository.get_campaign_dispatch(db, campaign_id)
+    finally:
+        db.close()
+    return campaign is not None and campaign[1] == 'running'
+
+def send_reminder(campaign_id, shop_name, recipient):
+    """Send one reminder, retrying after the API's Retry-After when it is rate limited
+
+    Returns (recipient id, sent, error); sent is None when the campaign was
+    paused or cancelled while waiting, and the recipient goes back to the
+    queue. A 429 is the API asking us to slow down, not a failed delivery,
+    so it only counts as an attempt after REMINDER_MAX_THROTTLE_RETRIES in a row.
+    """
+    for retry in range(REMINDER_MAX_THROTTLE_RETRIES + 1):
+        if retry and not campaign_is_running(campaign_id):
+            return recipient['id'], None, None
+        wait_for_send_slot()
+        try:
+            sent = whatsapp_service.send_payment_reminder_notification(
+                recipient['name'], shop_name, format_rupees(recipient['amount']), recipient['phone'],
+                raise_throttled=True
+            )
+            return recipient['id'], sent, None if sent else 'WhatsApp API rejected the message'
+        except whatsapp_service.WhatsAppThrottled as e:
+            logger.warning("WhatsApp rate limit hit, backing off", extra={'retry_after': e.retry_after})
+            back_off(e.retry_after)
+        except Exception as e:
+            return recipient['id'], False, str(e)
+    return recipient['id'], False, 'WhatsApp API kept rate limiting the message'
+
+def record_results(db, campaign_id, results):
+    """Store a batch of send results and update the campaign counters in one transaction"""
+    repository.mark_recipients_sent(db, [recipient_id for recipient_id, ok, _ in results if ok], datetime.utcnow())
+    repository.mark_recipients_failed(
+        db, [(recipient_id, error) for recipient_id, ok, error in results if ok is False], REMINDER_MAX_ATTEMPTS
+    )
+    repository.return_recipients(db, [recipient_id for recipient_id, ok, _ in results if ok is None])
+    repository.update_campaign_counts(db, campaign_id)
+    db.commit()
+
+def dispatch_campaign(db, pool, campaign_id):
+    """Send a campaign batch by batch until it is finished, paused or cancelled; returns how many were sent to"""
+    processed = 0
+    while True:
+        campaign = repository.get_campaign_dispatch(db, campaign_id)
+        if not campaign or campaign[1] != 'running':
+            return processed
+        shop_name = campaign[0]
+
+        batch = claim_recipients(db, campaign_id, REMINDER_BATCH_SIZE)
+        if not batch:
+            repository.update_campaign_counts(db, campaign_id)
+            repository.complete_campaign(db, campaign_id, datetime.utcnow())
+            db.commit()
+            return processed
+
+        results = list(pool.map(lambda recipient: send_reminder(campaign_id, shop_name, recipient), batch))
+        record_results(db, campaign_id, results)
+        processed += len(batch)
+
+def requeue_interrupted(db):
+    """Return recipients of running campaigns left in 'sending' by a worker that died to the queue
+
+    Only claims older than REMINDER_CLAIM_TIMEOUT_SECONDS are requeued, so
+    batches a live worker is still sending are left alone.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=REMINDER_CLAIM_TIMEOUT_SECONDS)
+    repository.requeue_stale_recipients(db, stale_before)
+    db.commit()
+
+def run_worker(once=False):
+    """Poll for running campaigns and dispatch them with a thread pool"""
+    db = get_db()
+    repository.set_busy_timeout(db, 5000)
+    # campaign_id -> (errors in a row, monotonic time before which it is not retried)
+    retry_at = {}
+
+    with ThreadPoolExecutor(max_workers=REMINDER_WORKER_THREADS) as pool:
+        while True:
+            requeue_interrupted(db)
+            campaign_ids = repository.list_running_campaign_ids(db)
+            processed = 0
+            for campaign_id in campaign_ids:
+                errors, not_before = retry_at.get(campaign_id, (0, 0.0))
+                if time.monotonic() < not_before:
+                    continue
+                try:
+                    processed += dispatch_campaign(db, pool, campaign_id)
+                    retry_at.pop(campaign_id, None)
+                except Exception:
+                    logger.exception("Error dispatching reminder campaign",
+                                     extra={'campaign_id': campaign_id, 'errors': errors + 1})
+                    db.rollback()
+                    # Wait longer after each error in a row so a failing campaign cannot spin the worker
+                    delay = min(REMINDER_POLL_SECONDS * 2 ** errors, REMINDER_MAX_ERROR_BACKOFF_SECONDS)
+                    retry_at[campaign_id] = (errors + 1, time.monotonic() + delay)
+
+            if once:
+                break
+            if not processed:
+                time.sleep(REMINDER_POLL_SECONDS)
+
+    db.close()
+
+if __name__ == '__main__':
+    configure_logging()
+    run_worker()
@@ -0,0 +1,1206 @@
+"""
+Patt Book - Data Access Layer
+Every query used by the web app, the OTP helpers and the background jobs, as named constants with per-query timing (SQLite or PostgreSQL)
+"""
+
+import threading
+import time
+from money import to_rupees
+
+# ============================================================================
+# NAMED QUERIES
+# ============================================================================
+
+_stats_lock = threading.Lock()
+
+class Query:
+    """A named SQL statement that records how often it runs and how long it takes
+
+    sql is the SQLite text; postgresql_sql is the same statement (or its
+    PostgreSQL variant) with psycopg placeholders.
+    """
+
+    __slots__ = ('name', 'sql', 'postgresql_sql', 'calls', 'total_seconds', 'max_seconds')
+
+    def __init__(self, name, sql, postgresql_sql):
+        self.name = name
+        self.sql = sql
+        self.postgresql_sql = postgresql_sql
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds):
+        with _stats_lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            if seconds > self.max_seconds:
+                self.max_seconds = seconds
+
+QUERIES = {}
+
+def named_query(name, sql, postgresql=None):
+    """Register a query under its name; the SQL text never changes so sqlite3 caches it
+
+    postgresql replaces the statement on that backend where the dialects differ.
+    """
+    postgresql_sql = ' '.join((postgresql or sql).split()).replace('%', '%%').replace('?', '%s')
+    query = Query(name, ' '.join(sql.split()), postgresql_sql)
+    QUERIES[name] = query
+    return query
+
+# Retailers
+RETAILER_COLUMNS = ('id', 'phone', 'shop_name', 'shop_address', 'shop_photo_url', 'created_at')
+
+GET_RETAILER = named_query('get_retailer', '''
+    SELECT id, phone, shop_name, shop_address, shop_photo_url, created_at
+    FROM retailers WHERE id = ?
+''')
+GET_RETAILER_BY_PHONE = named_query('get_retailer_by_phone', '''
+    SELECT id, phone, shop_name, shop_address, shop_photo_url, created_at
+    FROM retailers WHERE phone = ?
+''')
+GET_RETAILER_ID_BY_PHONE = named_query('get_retailer_id_by_phone', '''
+    SELECT id FROM retailers WHERE phone = ?
+''')
+INSERT_RETAILER = named_query('insert_retailer', '''
+    INSERT INTO retailers (phone, shop_name, shop_address) VALUES (?, ?, ?) RETURNING id
+''')
+UPDATE_RETAILER_PROFILE = named_query('update_retailer_profile', '''
+    UPDATE retailers SET shop_name = ?, shop_address = ?, shop_photo_url = ? WHERE id = ?
+''')
+
+# Cache version stamps (bumped whenever cached rows change, see profile_cache.py)
+GET_CACHE_VERSION = named_query('get_cache_version', '''
+    SELECT version FROM cache_versions WHERE name = ?
+''')
+BUMP_CACHE_VERSION = named_query('bump_cache_version', '''
+    INSERT INTO cache_versions (name, version) VALUES (?, 1)
+    ON CONFLICT(name) DO UPDATE SET version = cache_versions.version + 1
+    RETURNING version
+''')
+
+# Debtors
+DEBTOR_COLUMNS = ('id', 'retailer_id', 'name', 'phone', 'total_due', 'archived_through', 'created_at')
+
+GET_DEBTOR_SUMMARY = named_query('get_debtor_summary', '''
+    SELECT COUNT(*), SUM(total_due) FROM debtors WHERE retailer_id = ?
+''')
+GET_DEBTOR = named_query('get_debtor', '''
+    SELECT id, retailer_id, name, phone, total_due, archived_through, created_at
+    FROM debtors WHERE id = ? AND retailer_id = ?
+''')
+# SQLite has no row locks; get_debtor_for_update() takes the write lock before running it
+GET_DEBTOR_FOR_UPDATE = named_query('get_debtor_for_update', GET_DEBTOR.sql, postgresql=GET_DEBTOR.sql + ' FOR UPDATE')
+FIND_DEBTOR_BY_PHONE = named_query('find_debtor_by_phone', '''
+    SELECT id, total_due FROM debtors WHERE retailer_id = ? AND phone = ?
+''')
+INSERT_DEBTOR = named_query('insert_debtor', '''
+    INSERT INTO debtors (retailer_id, name, phone, total_due) VALUES (?, ?, ?, ?) RETURNING id
+''')
+UPDATE_DEBTOR_TOTAL_DUE = named_query('update_debtor_total_due', '''
+    UPDATE debtors SET total_due = ? WHERE id = ?
+''')
+ADD_TO_DEBTOR_TOTAL_DUE = named_query('add_to_debtor_total_due', '''
+    UPDATE debtors SET total_due = total_due + ? WHERE id = ? RETURNING total_due
+''')
+
+# One fixed statement per sort order instead of formatting ORDER BY into the SQL
+LIST_DEBTORS = {
+    (field, order): named_query(f'list_debtors_by_{field}_{order}', f'''
+        SELECT id, retailer_id, name, phone, total_due, archived_through, created_at
+        FROM debtors WHERE retailer_id = ? ORDER BY {field} {order}
+    ''')
+    for field in ('name', 'total_due', 'created_at')
+    for order in ('asc', 'desc')
+}
+
+# Transactions
+INSERT_TRANSACTION = named_query('insert_transaction', '''
+    INSERT INTO transactions (debtor_id, type, amount, description) VALUES (?, ?, ?, ?) RETURNING id
+''')
+
+# Daily rollup: folds one ledger row into its retailer's total for the row's own UTC day
+UPSERT_DAILY_ROLLUP = named_query('upsert_daily_rollup', '''
+    INSERT INTO daily_rollup (retailer_id, day, credit_total, payment_total, txn_count)
+    SELECT ?, CAST(date(created_at) AS TEXT),
+        CASE WHEN type = 'credit' THEN amount ELSE 0 END,
+        CASE WHEN type = 'payment' THEN amount ELSE 0 END,
+        1
+    FROM transactions WHERE id = ?
+    ON CONFLICT(retailer_id, day) DO UPDATE SET
+        credit_total = daily_rollup.credit_total + excluded.credit_total,
+        payment_total = daily_rollup.payment_total + excluded.payment_total,
+        txn_count = daily_rollup.txn_count + 1
+''')
+
+# Rollup backfill (rollup.py): archived rows still count, archival moves history, it does not undo it
+LIST_RETAILER_IDS = named_query('list_retailer_ids', '''
+    SELECT id FROM retailers WHERE id > ? ORDER BY id LIMIT ?
+''')
+DELETE_DAILY_ROLLUP = named_query('delete_daily_rollup', '''
+    DELETE FROM daily_rollup WHERE retailer_id BETWEEN ? AND ?
+''')
+REBUILD_DAILY_ROLLUP = named_query('rebuild_daily_rollup', '''
+    INSERT INTO daily_rollup (retailer_id, day, credit_total, payment_total, txn_count)
+    SELECT d.retailer_id, date(t.created_at),
+        SUM(CASE WHEN t.type = 'credit' THEN t.amount ELSE 0 END),
+        SUM(CASE WHEN t.type = 'payment' THEN t.amount ELSE 0 END),
+        COUNT(*)
+    FROM debtors d
+    JOIN (
+        SELECT debtor_id, type, amount, created_at FROM transactions
+        WHERE type IN ('credit', 'payment')
+        UNION ALL
+        SELECT debtor_id, type, amount, created_at FROM transactions_archive
+    ) t ON t.debtor_id = d.id
+    WHERE d.retailer_id BETWEEN ? AND ?
+    GROUP BY d.retailer_id, date(t.created_at)
+''')
+
+# Collections reports, from the rollup primary key alone: (period, credit_total, payment_total, txn_count)
+DAILY_COLLECTIONS = named_query('daily_collections', '''
+    SELECT day, credit_total, payment_total, txn_count
+    FROM daily_rollup
+    WHERE retailer_id = ? AND day BETWEEN ? AND ?
+    ORDER BY day
+''')
+MONTHLY_COLLECTIONS = named_query('monthly_collections', '''
+    SELECT substr(day, 1, 7) AS period, SUM(credit_total), SUM(payment_total), SUM(txn_count)
+    FROM daily_rollup
+    WHERE retailer_id = ? AND day BETWEEN ? AND ?
+    GROUP BY period ORDER BY period
+''')
+
+# OTP requests
+OTP_COLUMNS = ('id', 'phone', 'otp_hash', 'expires_at', 'attempts', 'created_at')
+
+UPSERT_OTP_REQUEST = named_query('upsert_otp_request', '''
+    INSERT INTO otp_requests (phone, otp_hash, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(phone) DO UPDATE SET
+        otp_hash = excluded.otp_hash, expires_at = excluded.expires_at,
+        attempts = 0, created_at = CURRENT_TIMESTAMP
+''')
+GET_LATEST_OTP_REQUEST = named_query('get_latest_otp_request', '''
+    SELECT id, phone, otp_hash, expires_at, attempts, created_at
+    FROM otp_requests ORDER BY created_at DESC LIMIT 1
+''')
+GET_OTP_REQUEST_BY_PHONE = named_query('get_otp_request_by_phone', '''
+    SELECT id, phone, otp_hash, expires_at, attempts, created_at
+    FROM otp_requests WHERE phone = ?
+''')
+INCREMENT_OTP_ATTEMPTS = named_query('increment_otp_attempts', '''
+    UPDATE otp_requests SET attempts = attempts + 1 WHERE id = ?
+''')
+DELETE_OTP_REQUESTS = named_query('delete_otp_requests', '''
+    DELETE FROM otp_requests WHERE phone = ?
+''')
+DELETE_EXPIRED_OTP_REQUESTS = named_query('delete_expired_otp_requests', '''
+    DELETE FROM otp_requests WHERE expires_at < ?
+''')
+
+# Idempotency keys
+GET_IDEMPOTENCY_RECORD = named_query('get_idempotency_record', '''
+    SELECT request_hash, status_code, response_body FROM idempotency_keys
+    WHERE retailer_id = ? AND endpoint = ? AND idempotency_key = ? AND expires_at > ?
+''')
+DELETE_EXPIRED_IDEMPOTENCY_KEY = named_query('delete_expired_idempotency_key', '''
+    DELETE FROM idempotency_keys
+    WHERE retailer_id = ? AND endpoint = ? AND idempotency_key = ? AND expires_at <= ?
+''')
+INSERT_IDEMPOTENCY_RECORD = named_query('insert_idempotency_record', '''
+    INSERT INTO idempotency_keys
+        (retailer_id, endpoint, idempotency_key, request_hash, status_code, response_body, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+''')
+DELETE_EXPIRED_IDEMPOTENCY_KEYS = named_query('delete_expired_idempotency_keys', '''
+    DELETE FROM idempotency_keys WHERE expires_at < ?
+''')
+
+# Ledger archival and read-through
+LEDGER_COLUMNS = ('id', 'debtor_id', 'type', 'amount', 'description', 'created_at')
+LEDGER_PAGE_COLUMNS = LEDGER_COLUMNS + ('archived',)
+
+LIST_DEBTOR_LEDGER = named_query('list_debtor_ledger', f'''
+    SELECT {', '.join(LEDGER_COLUMNS)} FROM transactions WHERE debtor_id = ? ORDER BY created_at, id
+''')
+LIST_ARCHIVABLE_DEBTOR_IDS = named_query('list_archivable_debtor_ids', '''
+    SELECT d.id FROM debtors d
+    WHERE d.id > ? AND EXISTS (
+        SELECT 1 FROM transactions t
+        WHERE t.debtor_id = d.id AND t.created_at < ? AND t.type != 'balance_forward'
+    )
+    ORDER BY d.id LIMIT ?
+''')
+INSERT_ARCHIVED_TRANSACTION = named_query('insert_archived_transaction', f'''
+    INSERT INTO transactions_archive ({', '.join(LEDGER_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)
+''')
+DELETE_TRANSACTION = named_query('delete_transaction', '''
+    DELETE FROM transactions WHERE id = ?
+''')
+INSERT_BALANCE_FORWARD = named_query('insert_balance_forward', '''
+    INSERT INTO transactions (debtor_id, type, amount, description, created_at)
+    VALUES (?, 'balance_forward', ?, 'Balance carried forward', ?)
+''')
+SET_DEBTOR_ARCHIVED_THROUGH = named_query('set_debtor_archived_through', '''
+    UPDATE debtors SET archived_through = ? WHERE id = ?
+''')
+
+_PAGE_CONDITIONS = 'debtor_id = ? AND (created_at, id) < (?, ?) AND created_at >= ? AND created_at < ?'
+_PAGE_ORDER = 'ORDER BY created_at DESC, id DESC LIMIT ?'
+_SIGNED_TOTAL = "COALESCE(SUM(CASE WHEN type = 'payment' THEN -amount ELSE amount END), 0)"
+
+# Keyset page of a debtor's ledger, newest first, keyed by whether it reads
+# through to the archive. Reading through, each table is limited before the
+# two are merged so neither is ever read past the page.
+LEDGER_PAGE = {
+    False: named_query('ledger_page', f'''
+        SELECT {', '.join(LEDGER_COLUMNS)}, 0 AS archived FROM transactions WHERE {_PAGE_CONDITIONS} {_PAGE_ORDER}
+    '''),
+    True: named_query('ledger_page_read_through', f'''
+        SELECT * FROM (SELECT {', '.join(LEDGER_COLUMNS)}, 1 AS archived FROM transactions_archive
+            WHERE {_PAGE_CONDITIONS} {_PAGE_ORDER})
+        UNION ALL
+        SELECT * FROM (SELECT {', '.join(LEDGER_COLUMNS)}, 0 AS archived FROM transactions
+            WHERE {_PAGE_CONDITIONS} AND type != 'balance_forward' {_PAGE_ORDER})
+        {_PAGE_ORDER}
+    '''),
+}
+# Net effect on the balance of a debtor's rows at or after a time (an index-only scan)
+DEBTOR_LEDGER_TOTAL_SINCE = {
+    False: named_query('debtor_ledger_total_since', f'''
+        SELECT {_SIGNED_TOTAL} FROM transactions WHERE debtor_id = ? AND created_at >= ?
+    '''),
+    True: named_query('debtor_ledger_total_since_read_through', f'''
+        SELECT (SELECT {_SIGNED_TOTAL} FROM transactions_archive WHERE debtor_id = ? AND created_at >= ?)
+            + (SELECT {_SIGNED_TOTAL} FROM transactions
+               WHERE debtor_id = ? AND created_at >= ? AND type != 'balance_forward')
+    '''),
+}
+
+# Reminder campaigns
+CAMPAIGN_BELONGS_TO_RETAILER = named_query('campaign_belongs_to_retailer', '''
+    SELECT 1 FROM reminder_campaigns WHERE id = ? AND retailer_id = ?
+''')
+CAMPAIGN_COLUMNS = (
+    'id', 'retailer_id', 'shop_name', 'status', 'min_balance', 'min_days_inactive',
+    'total_recipients', 'sent_count', 'failed_count', 'created_at', 'completed_at'
+)
+
+INSERT_CAMPAIGN = named_query('insert_campaign', '''
+    INSERT INTO reminder_campaigns (retailer_id, shop_name, min_balance, min_days_inactive)
+    VALUES (?, ?, ?, ?) RETURNING id
+''')
+# Debtors are matched on (retailer_id, total_due) and their last activity is
+# an index seek on (debtor_id, created_at), so no transaction rows are scanned
+ENQUEUE_CAMPAIGN_RECIPIENTS = named_query('enqueue_campaign_recipients', '''
+    INSERT INTO reminder_recipients (campaign_id, debtor_id, name, phone, amount)
+    SELECT ?, d.id, d.name, d.phone, d.total_due
+    FROM debtors d
+    WHERE d.retailer_id = ? AND d.total_due > 0 AND d.total_due >= ?
+      AND (SELECT MAX(t.created_at) FROM transactions t WHERE t.debtor_id = d.id) <= ?
+''')
+SET_CAMPAIGN_TOTAL_RECIPIENTS = named_query('set_campaign_total_recipients', '''
+    UPDATE reminder_campaigns SET total_recipients = ? WHERE id = ?
+''')
+# A campaign moves from one of at most two statuses (cancel: running or paused)
+SET_CAMPAIGN_STATUS = named_query('set_campaign_status', '''
+    UPDATE reminder_campaigns SET status = ? WHERE id = ? AND retailer_id = ? AND status IN (?, ?)
+''')
+GET_CAMPAIGN = named_query('get_campaign', f'''
+    SELECT {', '.join(CAMPAIGN_COLUMNS)} FROM reminder_campaigns WHERE id = ? AND retailer_id = ?
+''')
+GET_CAMPAIGN_DISPATCH = named_query('get_campaign_dispatch', '''
+    SELECT shop_name, status FROM reminder_campaigns WHERE id = ?
+''')
+LIST_RUNNING_CAMPAIGN_IDS = named_query('list_running_campaign_ids', '''
+    SELECT id FROM reminder_campaigns WHERE status = 'running' ORDER BY id
+''')
+UPDATE_CAMPAIGN_COUNTS = named_query('update_campaign_counts', '''
+    UPDATE reminder_campaigns SET
+        sent_count = (SELECT COUNT(*) FROM reminder_recipients WHERE campaign_id = ? AND status = 'sent'),
+        failed_count = (SELECT COUNT(*) FROM reminder_recipients WHERE campaign_id = ? AND status = 'failed')
+    WHERE id = ?
+''')
+COMPLETE_EMPTY_CAMPAIGN = named_query('complete_empty_campaign', '''
+    UPDATE reminder_campaigns SET status = 'completed', completed_at = ? WHERE id = ?
+''')
+# Recipients another worker is still sending keep the campaign running
+COMPLETE_CAMPAIGN = named_query('complete_campaign', '''
+    UPDATE reminder_campaigns SET status = 'completed', completed_at = ?
+    WHERE id = ? AND status = 'running' AND NOT EXISTS (
+        SELECT 1 FROM reminder_recipients WHERE campaign_id = ? AND status = 'sending'
+    )
+''')
+
+# Reminder recipients
+RECIPIENT_COLUMNS = ('id', 'debtor_id', 'name', 'phone', 'amount', 'status', 'attempts', 'error', 'sent_at')
+
+COUNT_RECIPIENTS_BY_STATUS = named_query('count_recipients_by_status', '''
+    SELECT status, COUNT(*) FROM reminder_recipients WHERE campaign_id = ? GROUP BY status
+''')
+LIST_RECIPIENTS = named_query('list_recipients', f'''
+    SELECT {', '.join(RECIPIENT_COLUMNS)}
+    FROM reminder_recipients WHERE campaign_id = ? AND id > ? ORDER BY id LIMIT ?
+''')
+LIST_RECIPIENTS_BY_STATUS = named_query('list_recipients_by_status', f'''
+    SELECT {', '.join(RECIPIENT_COLUMNS)}
+    FROM reminder_recipients WHERE campaign_id = ? AND status = ? AND id > ? ORDER BY id LIMIT ?
+''')
+# Pending recipients with the debtor's balance now, not when the campaign was queued
+LIST_PENDING_RECIPIENTS = named_query('list_pending_recipients', '''
+    SELECT r.id, r.name, r.phone, COALESCE(d.total_due, 0)
+    FROM reminder_recipients r LEFT JOIN debtors d ON d.id = r.debtor_id
+    WHERE r.campaign_id = ? AND r.status = 'pending' ORDER BY r.id LIMIT ?
+''')
+SKIP_SETTLED_RECIPIENT = named_query('skip_settled_recipient', '''
+    UPDATE reminder_recipients SET status = 'failed', error = 'Balance already settled' WHERE id = ?
+''')
+CLAIM_RECIPIENT = named_query('claim_recipient', '''
+    UPDATE reminder_recipients SET status = 'sending', amount = ?, attempts = attempts + 1, claimed_at = ?
+    WHERE id = ?
+''')
+MARK_RECIPIENT_SENT = named_query('mark_recipient_sent', '''
+    UPDATE reminder_recipients SET status = 'sent', sent_at = ?, error = NULL WHERE id = ?
+''')
+# Failed sends go back to pending until they run out of attempts
+MARK_RECIPIENT_FAILED = named_query('mark_recipient_failed', '''
+    UPDATE reminder_recipients SET error = ?, status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+    WHERE id = ?
+''')
+# Not sent because the campaign stopped: back to pending, the attempt given back
+RETURN_RECIPIENT = named_query('return_recipient', '''
+    UPDATE reminder_recipients SET status = 'pending', attempts = attempts - 1 WHERE id = ?
+''')
+REQUEUE_STALE_RECIPIENTS = named_query('requeue_stale_recipients', '''
+    UPDATE reminder_recipients SET status = 'pending'
+    WHERE campaign_id IN (SELECT id FROM reminder_campaigns WHERE status = 'running')
+      AND status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)
+''')
+
+# Statement jobs
+STATEMENT_JOB_COLUMNS = (
+    'id', 'retailer_id', 'shop_name', 'shop_address', 'period_start', 'period_end', 'format', 'status',
+    'total_debtors', 'processed_count', 'statement_count', 'last_debtor_id', 'error',
+    'created_at', 'started_at', 'completed_at'
+)
+
+COUNT_RETAILER_DEBTORS = named_query('count_retailer_debtors', '''
+    SELECT COUNT(*) FROM debtors WHERE retailer_id = ?
+''')
+INSERT_STATEMENT_JOB = named_query('insert_statement_job', '''
+    INSERT INTO statement_jobs
+        (retailer_id, shop_name, shop_address, period_start, period_end, format, total_debtors)
+    VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id
+''')
+GET_STATEMENT_JOB = named_query('get_statement_job', f'''
+    SELECT {', '.join(STATEMENT_JOB_COLUMNS)} FROM statement_jobs WHERE id = ?
+''')
+GET_RETAILER_STATEMENT_JOB = named_query('get_retailer_statement_job', f'''
+    SELECT {', '.join(STATEMENT_JOB_COLUMNS)} FROM statement_jobs WHERE id = ? AND retailer_id = ?
+''')
+LIST_QUEUED_STATEMENT_JOB_IDS = named_query('list_queued_statement_job_ids', '''
+    SELECT id FROM statement_jobs WHERE status = 'queued' ORDER BY id
+''')
+START_STATEMENT_JOB = named_query('start_statement_job', '''
+    UPDATE statement_jobs SET status = 'running', started_at = COALESCE(started_at, ?) WHERE id = ?
+''')
+ADVANCE_STATEMENT_JOB = named_query('advance_statement_job', '''
+    UPDATE statement_jobs SET processed_count = processed_count + ?, statement_count = statement_count + ?,
+        last_debtor_id = ?
+    WHERE id = ?
+''')
+COMPLETE_STATEMENT_JOB = named_query('complete_statement_job', '''
+    UPDATE statement_jobs SET status = 'completed', completed_at = ? WHERE id = ?
+''')
+FAIL_STATEMENT_JOB = named_query('fail_statement_job', '''
+    UPDATE statement_jobs SET status = 'failed', error = ?, completed_at = ? WHERE id = ?
+''')
+REQUEUE_RUNNING_STATEMENT_JOBS = named_query('requeue_running_statement_jobs', '''
+    UPDATE statement_jobs SET status = 'queued' WHERE status = 'running'
+''')
+
+# Statements
+STATEMENT_SUMMARY_COLUMNS = ('debtor_id', 'name', 'phone', 'opening_balance', 'closing_balance', 'txn_count')
+
+# The full ledger: archived history plus live rows, without the
+# balance_forward rows that stand in for the archived ones
+_FULL_LEDGER = '''(
+    SELECT id, debtor_id, type, amount, description, created_at FROM transactions
+    WHERE type != 'balance_forward'
+    UNION ALL
+    SELECT id, debtor_id, type, amount, description, created_at FROM transactions_archive
+) AS ledger'''
+_BATCH_DEBTOR_IDS = 'SELECT id FROM debtors WHERE retailer_id = ? AND id BETWEEN ? AND ?'
+
+LIST_STATEMENT_DEBTORS = named_query('list_statement_debtors', '''
+    SELECT id, name, phone, total_due FROM debtors WHERE retailer_id = ? AND id > ? ORDER BY id LIMIT ?
+''')
+# Everything after the period, to walk back from the current balance
+LEDGER_TOTALS_SINCE = named_query('ledger_totals_since', f'''
+    SELECT debtor_id, SUM(CASE WHEN type = 'payment' THEN -amount ELSE amount END)
+    FROM {_FULL_LEDGER} WHERE debtor_id IN ({_BATCH_DEBTOR_IDS}) AND created_at >= ?
+    GROUP BY debtor_id
+''')
+LEDGER_ROWS_BETWEEN = named_query('ledger_rows_between', f'''
+    SELECT debtor_id, created_at, type, amount, description
+    FROM {_FULL_LEDGER} WHERE debtor_id IN ({_BATCH_DEBTOR_IDS}) AND created_at >= ? AND created_at < ?
+    ORDER BY debtor_id, created_at, id
+''')
+UPSERT_STATEMENT = named_query('upsert_statement', '''
+    INSERT INTO statements
+        (job_id, debtor_id, name, phone, opening_balance, closing_balance, txn_count, content)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (job_id, debtor_id) DO UPDATE SET name = excluded.name, phone = excluded.phone,
+        opening_balance = excluded.opening_balance, closing_balance = excluded.closing_balance,
+        txn_count = excluded.txn_count, content = excluded.content
+''')
+LIST_STATEMENTS = named_query('list_statements', f'''
+    SELECT {', '.join(STATEMENT_SUMMARY_COLUMNS)}
+    FROM statements WHERE job_id = ? AND debtor_id > ? ORDER BY debtor_id LIMIT ?
+''')
+LIST_STATEMENT_CONTENT = named_query('list_statement_content', '''
+    SELECT debtor_id, name, content FROM statements WHERE job_id = ? AND debtor_id > ? ORDER BY debtor_id LIMIT ?
+''')
+GET_STATEMENT = named_query('get_statement', '''
+    SELECT debtor_id, name, content FROM statements WHERE job_id = ? AND debtor_id = ?
+''')
+
+# Reconciliation
+RUN_COLUMNS = (
+    'id', 'retailer_id', 'repair', 'status', 'max_debtor_id', 'last_debtor_id', 'debtors_checked',
+    'drift_count', 'repaired_count', 'error', 'started_at', 'completed_at'
+)
+
+def _ledger_balance(debtor_id):
+    return f'''(
+        SELECT COALESCE(SUM(CASE WHEN t.type = 'payment' THEN -t.amount ELSE t.amount END), 0)
+        FROM transactions t WHERE t.debtor_id = {debtor_id}
+    )'''
+
+# One fixed statement per scope, every debtor or one retailer's, instead of formatting the filter into the SQL
+RECONCILE_SCOPES = {'all': ('', 'retailer_id IS NULL'), 'retailer': ('AND d.retailer_id = ?', 'retailer_id = ?')}
+
+COUNT_DEBTORS_IN_RANGE = {
+    scope: named_query(f'count_debtors_in_range_{scope}', f'''
+        SELECT COUNT(*) FROM debtors d WHERE d.id BETWEEN ? AND ? {debtor_filter}
+    ''')
+    for scope, (debtor_filter, _) in RECONCILE_SCOPES.items()
+}
+# balance_forward rows already stand in for archived history, so the live
+# table alone gives the balance. One statement reads both sides from the
+# same snapshot, and each subquery is a scan of the covering
+# (debtor_id, created_at, id, type, amount) index. Amounts are integer
+# paise, so the sums are exact and only drifted debtors leave the database.
+LEDGER_DRIFT = {
+    scope: named_query(f'ledger_drift_{scope}', f'''
+        SELECT id, retailer_id, recorded_total, ledger_total FROM (
+            SELECT d.id, d.retailer_id, COALESCE(d.total_due, 0) AS recorded_total,
+                {_ledger_balance('d.id')} AS ledger_total
+            FROM debtors d
+            WHERE d.id BETWEEN ? AND ? {debtor_filter}
+        ) AS balances
+        WHERE recorded_total != ledger_total
+        ORDER BY id
+    ''')
+    for scope, (debtor_filter, _) in RECONCILE_SCOPES.items()
+}
+REPAIR_DEBTOR = named_query('repair_debtor', f'''
+    UPDATE debtors SET total_due = {_ledger_balance('debtors.id')}
+    WHERE id = ? AND COALESCE(total_due, 0) != {_ledger_balance('debtors.id')}
+''')
+LIST_RETAILER_DEBTOR_IDS = named_query('list_retailer_debtor_ids', '''
+    SELECT id FROM debtors WHERE retailer_id = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?
+''')
+MAX_DEBTOR_ID = named_query('max_debtor_id', '''
+    SELECT COALESCE(MAX(id), 0) FROM debtors
+''')
+
+GET_RUN = named_query('get_run', f'''
+    SELECT {', '.join(RUN_COLUMNS)} FROM reconciliation_runs WHERE id = ?
+''')
+GET_RUNNING_RUN = {
+    scope: named_query(f'get_running_run_{scope}', f'''
+        SELECT {', '.join(RUN_COLUMNS)} FROM reconciliation_runs
+        WHERE {run_filter} AND status = 'running' ORDER BY id DESC LIMIT 1
+    ''')
+    for scope, (_, run_filter) in RECONCILE_SCOPES.items()
+}
+SUPERSEDE_RUNNING_RUNS = {
+    scope: named_query(f'supersede_running_runs_{scope}', f'''
+        UPDATE reconciliation_runs SET status = 'failed', error = 'Superseded', completed_at = ?
+        WHERE {run_filter} AND status = 'running'
+    ''')
+    for scope, (_, run_filter) in RECONCILE_SCOPES.items()
+}
+INSERT_RUN = named_query('insert_run', '''
+    INSERT INTO reconciliation_runs (retailer_id, repair, max_debtor_id, started_at) VALUES (?, ?, ?, ?) RETURNING id
+''')
+SET_RUN_REPAIR = named_query('set_run_repair', '''
+    UPDATE reconciliation_runs SET repair = 1 WHERE id = ?
+''')
+ADVANCE_RUN = named_query('advance_run', '''
+    UPDATE reconciliation_runs SET debtors_checked = debtors_checked + ?, drift_count = drift_count + ?,
+        repaired_count = repaired_count + ?, last_debtor_id = ?
+    WHERE id = ?
+''')
+FINISH_RUN = named_query('finish_run', '''
+    UPDATE reconciliation_runs SET status = ?, error = ?, completed_at = ? WHERE id = ?
+''')
+GET_LATEST_RUN_ID = named_query('get_latest_run_id', '''
+    SELECT id FROM reconciliation_runs WHERE retailer_id IS NULL OR retailer_id = ? ORDER BY id DESC LIMIT 1
+''')
+GET_QUEUED_RUN = named_query('get_queued_run', '''
+    SELECT id, repair FROM reconciliation_runs WHERE retailer_id = ? AND status = 'queued' ORDER BY id DESC LIMIT 1
+''')
+INSERT_QUEUED_RUN = named_query('insert_queued_run', '''
+    INSERT INTO reconciliation_runs (retailer_id, repair, status) VALUES (?, ?, 'queued') RETURNING id
+''')
+LIST_QUEUED_RUN_IDS = named_query('list_queued_run_ids', '''
+    SELECT id FROM reconciliation_runs WHERE status = 'queued' ORDER BY id
+''')
+CLAIM_QUEUED_RUN = named_query('claim_queued_run', '''
+    UPDATE reconciliation_runs SET status = 'running', started_at = ?,
+        max_debtor_id = (SELECT COALESCE(MAX(id), 0) FROM debtors)
+    WHERE id = ? AND status = 'queued'
+''')
+REQUEUE_STALE_RUNS = named_query('requeue_stale_runs', '''
+    UPDATE reconciliation_runs SET status = 'queued'
+    WHERE retailer_id IS NOT NULL AND status = 'running' AND started_at < ?
+''')
+
+UPSERT_DRIFT = named_query('upsert_drift', '''
+    INSERT INTO reconciliation_drift (run_id, debtor_id, retailer_id, recorded_total, ledger_total, repaired)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (run_id, debtor_id) DO UPDATE SET retailer_id = excluded.retailer_id,
+        recorded_total = excluded.recorded_total, ledger_total = excluded.ledger_total, repaired = excluded.repaired
+''')
+LIST_RETAILER_DRIFT = named_query('list_retailer_drift', '''
+    SELECT r.debtor_id, d.name, d.phone, r.recorded_total, r.ledger_total, r.repaired
+    FROM reconciliation_drift r
+    JOIN debtors d ON d.id = r.debtor_id
+    WHERE r.run_id = ? AND r.retailer_id = ?
+    ORDER BY r.debtor_id LIMIT ?
+''')
+
+# Schema
+LIST_TABLES = named_query('list_tables', '''
+    SELECT name FROM sqlite_master WHERE type = 'table'
+''', postgresql='''
+    SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()
+''')
+
+LIST_COLUMNS = named_query('list_columns', '''
+    SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p WHERE m.type = 'table'
+''', postgresql='''
+    SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()
+''')
+
+# ============================================================================
+# EXECUTION AND ROW MAPPING
+# ============================================================================
+
+def record_type(name, fields):
+    """Create a compact __slots__ record class for a query's column list"""
+    def __init__(self, *values):
+        for field, value in zip(fields, values):
+            setattr(self, field, value)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in fields}
+
+    return type(name, (), {'__slots__': fields, 'fields': fields, '__init__': __init__, 'as_dict': as_dict})
+
+Retailer = record_type('Retailer', RETAILER_COLUMNS)
+Debtor = record_type('Debtor', DEBTOR_COLUMNS)
+OtpRequest = record_type('OtpRequest', OTP_COLUMNS)
+
+def _run(db, query, params):
+    if getattr(db, 'dialect', 'sqlite') == 'postgresql':
+        cursor = db.cursor()
+        cursor.execute(query.postgresql_sql, params)
+        return cursor
+    # Plain tuples: no sqlite3.Row objects built for rows we map ourselves
+    cursor = db.cursor()
+    cursor.row_factory = None
+    return cursor.execute(query.sql, params)
+
+def execute(db, query, params=()):
+    """Run a statement and return its cursor"""
+    started = time.perf_counter()
+    cursor = _run(db, query, params)
+    query.record(time.perf_counter() - started)
+    return cursor
+
+def fetch_one(db, query, params=()):
+    """Run a query and return its first row as a tuple, or None"""
+    started = time.perf_counter()
+    row = _run(db, query, params).fetchone()
+    query.record(time.perf_counter() - started)
+    return row
+
+def fetch_all(db, query, params=()):
+    """Run a query and return every row as a tuple"""
+    started = time.perf_counter()
+    rows = _run(db, query, params).fetchall()
+    query.record(time.perf_counter() - started)
+    return rows
+
+def execute_many(db, query, seq_of_params):
+    """Run a statement once for each parameter tuple"""
+    started = time.perf_counter()
+    sql = query.postgresql_sql if getattr(db, 'dialect', 'sqlite') == 'postgresql' else query.sql
+    db.cursor().executemany(sql, seq_of_params)
+    query.record(time.perf_counter() - started)
+
+def iter_all(db, query, params=()):
+    """Yield every row as a tuple without holding the whole result in memory
+
+    PostgreSQL streams through a server-side cursor in batches; sqlite3
+    cursors already step through results one row at a time.
+    """
+    started = time.perf_counter()
+    if getattr(db, 'dialect', 'sqlite') == 'postgresql':
+        cursor = db.server_cursor()
+        cursor.execute(query.postgresql_sql, params)
+    else:
+        cursor = _run(db, query, params)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+        query.record(time.perf_counter() - started)
+
+def query_stats():
+    """Per-query timing, hottest (by total time) first"""
+    with _stats_lock:
+        stats = [
+            {
+                'name': query.name,
+                'calls': query.calls,
+                'total_ms': round(query.total_seconds * 1000, 3),
+                'avg_ms': round(query.total_seconds * 1000 / query.calls, 3) if query.calls else 0.0,
+                'max_ms': round(query.max_seconds * 1000, 3)
+            }
+            for query in QUERIES.values()
+        ]
+    return sorted(stats, key=lambda stat: stat['total_ms'], reverse=True)
+
+def reset_query_stats():
+    """Zero every query's counters"""
+    with _stats_lock:
+        for query in QUERIES.values():
+            query.calls = 0
+            query.total_seconds = 0.0
+            query.max_seconds = 0.0
+
+# ============================================================================
+# RETAILERS
+# ============================================================================
+
+def get_retailer(db, retailer_id):
+    """Retailer record by id, or None"""
+    row = fetch_one(db, GET_RETAILER, (retailer_id,))
+    return Retailer(*row) if row else None
+
+def get_retailer_by_phone(db, phone):
+    """Retailer record by phone, or None"""
+    row = fetch_one(db, GET_RETAILER_BY_PHONE, (phone,))
+    return Retailer(*row) if row else None
+
+def retailer_exists(db, phone):
+    """Whether a retailer is registered with this phone"""
+    return fetch_one(db, GET_RETAILER_ID_BY_PHONE, (phone,)) is not None
+
+def create_retailer(db, phone, shop_name, shop_address):
+    """Insert a retailer and return its id"""
+    return fetch_one(db, INSERT_RETAILER, (phone, shop_name, shop_address))[0]
+
+def update_retailer_profile(db, retailer_id, shop_name, shop_address, shop_photo_url):
+    """Change a retailer's shop details; returns whether the retailer exists"""
+    return execute(db, UPDATE_RETAILER_PROFILE, (shop_name, shop_address, shop_photo_url, retailer_id)).rowcount > 0
+
+# ============================================================================
+# CACHE VERSIONS
+# ============================================================================
+
+def get_cache_version(db, name):
+    """Current version stamp of a cached table, 0 if it was never bumped"""
+    row = fetch_one(db, GET_CACHE_VERSION, (name,))
+    return row[0] if row else 0
+
+def bump_cache_version(db, name):
+    """Advance a cached table's version stamp and return the new version"""
+    return fetch_one(db, BUMP_CACHE_VERSION, (name,))[0]
+
+# ============================================================================
+# DEBTORS AND TRANSACTIONS
+# ============================================================================
+
+def get_debtor_summary(db, retailer_id):
+    """(debtor count, total outstanding) for a retailer"""
+    count, total = fetch_one(db, GET_DEBTOR_SUMMARY, (retailer_id,))
+    return count, total or 0
+
+def get_debtor(db, retailer_id, debtor_id):
+    """Retailer's debtor record by id, or None"""
+    row = fetch_one(db, GET_DEBTOR, (debtor_id, retailer_id))
+    return Debtor(*row) if row else None
+
+def begin_write(db):
+    """Take SQLite's write lock until commit; PostgreSQL locks rows as they are read for update"""
+    if getattr(db, 'dialect', 'sqlite') == 'sqlite' and not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+
+def begin_snapshot(db):
+    """Read every following query from one snapshot until commit or rollback"""
+    if db.in_transaction:
+        return
+    if getattr(db, 'dialect', 'sqlite') == 'postgresql':
+        db.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+    else:
+        db.execute('BEGIN')
+
+def set_busy_timeout(db, milliseconds):
+    """How long this SQLite connection waits for the write lock (PostgreSQL waits on row locks itself)"""
+    if getattr(db, 'dialect', 'sqlite') == 'sqlite':
+        db.execute(f'PRAGMA busy_timeout = {int(milliseconds)}')
+
+def set_read_only(db):
+    """Refuse writes on this connection for the rest of its life"""
+    if getattr(db, 'dialect', 'sqlite') == 'postgresql':
+        db.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+        db.commit()
+    else:
+        db.execute('PRAGMA query_only = ON')
+
+def get_debtor_for_update(db, retailer_id, debtor_id):
+    """Retailer's debtor record, locked against other writers until commit, or None"""
+    begin_write(db)
+    row = fetch_one(db, GET_DEBTOR_FOR_UPDATE, (debtor_id, retailer_id))
+    return Debtor(*row) if row else None
+
+def find_debtor_by_phone(db, retailer_id, phone):
+    """(id, total_due) of the retailer's debtor with this phone, or None"""
+    return fetch_one(db, FIND_DEBTOR_BY_PHONE, (retailer_id, phone))
+
+def create_debtor(db, retailer_id, name, phone, total_due):
+    """Insert a debtor and return its id"""
+    return fetch_one(db, INSERT_DEBTOR, (retailer_id, name, phone, total_due))[0]
+
+def update_debtor_total_due(db, debtor_id, total_due):
+    """Set a debtor's outstanding balance"""
+    execute(db, UPDATE_DEBTOR_TOTAL_DUE, (total_due, debtor_id))
+
+def add_to_debtor_total_due(db, debtor_id, amount):
+    """Add paise to a debtor's balance in one statement and return the new balance"""
+    return fetch_one(db, ADD_TO_DEBTOR_TOTAL_DUE, (amount, debtor_id))[0]
+
+def list_debtors(db, retailer_id, sort_field, sort_order):
+    """Debtors as JSON-ready dicts (total_due in rupees); sort_field/sort_order must already be validated"""
+    rows = iter_all(db, LIST_DEBTORS[(sort_field, sort_order)], (retailer_id,))
+    debtors = [dict(zip(DEBTOR_COLUMNS, row)) for row in rows]
+    for debtor in debtors:
+        debtor['total_due'] = to_rupees(debtor['total_due'])
+    return debtors
+
+def list_debtors_by_id(db, retailer_id, debtor_ids):
+    """The retailer's debtors with these ids as JSON-ready dicts (total_due in rupees), in the given order"""
+    debtors = []
+    for debtor_id in debtor_ids:
+        row = fetch_one(db, GET_DEBTOR, (debtor_id, retailer_id))
+        if row:
+            debtor = dict(zip(DEBTOR_COLUMNS, row))
+            debtor['total_due'] = to_rupees(debtor['total_due'])
+            debtors.append(debtor)
+    return debtors
+
+def add_transaction(db, retailer_id, debtor_id, transaction_type, amount, description):
+    """Insert a ledger row and fold it into the daily rollup; returns the row id"""
+    transaction_id = fetch_one(db, INSERT_TRANSACTION, (debtor_id, transaction_type, amount, description))[0]
+    execute(db, UPSERT_DAILY_ROLLUP, (retailer_id, transaction_id))
+    return transaction_id
+
+# ============================================================================
+# ROLLUP
+# ============================================================================
+
+def list_retailer_ids(db, after_retailer_id, limit):
+    """Up to limit retailer ids above after_retailer_id, in order"""
+    return [row[0] for row in fetch_all(db, LIST_RETAILER_IDS, (after_retailer_id, limit))]
+
+def rebuild_daily_rollup(db, first_retailer_id, last_retailer_id):
+    """Replace a retailer id range's rollup rows with totals recomputed from the ledger; returns days written"""
+    execute(db, DELETE_DAILY_ROLLUP, (first_retailer_id, last_retailer_id))
+    return execute(db, REBUILD_DAILY_ROLLUP, (first_retailer_id, last_retailer_id)).rowcount
+
+def get_collections(db, retailer_id, since, until, group):
+    """(period, credit_total, payment_total, txn_count) rows per day or month, in paise"""
+    query = MONTHLY_COLLECTIONS if group == 'month' else DAILY_COLLECTIONS
+    return fetch_all(db, query, (retailer_id, since, until))
+
+# ============================================================================
+# OTP REQUESTS
+# ============================================================================
+
+def save_otp_request(db, phone, otp_hash, expires_at):
+    """Store the phone's OTP, replacing any earlier one and resetting attempts"""
+    execute(db, UPSERT_OTP_REQUEST, (phone, otp_hash, expires_at))
+
+def get_latest_otp_request(db):
+    """Most recently created OTP request, or None"""
+    row = fetch_one(db, GET_LATEST_OTP_REQUEST)
+    return OtpRequest(*row) if row else None
+
+def get_otp_request(db, phone):
+    """Phone's OTP request, or None"""
+    row = fetch_one(db, GET_OTP_REQUEST_BY_PHONE, (phone,))
+    return OtpRequest(*row) if row else None
+
+def increment_otp_attempts(db, otp_request_id):
+    """Count a failed verification attempt"""
+    execute(db, INCREMENT_OTP_ATTEMPTS, (otp_request_id,))
+
+def delete_otp_requests(db, phone):
+    """Delete a phone's OTP requests"""
+    execute(db, DELETE_OTP_REQUESTS, (phone,))
+
+def delete_expired_otp_requests(db, now):
+    """Delete OTP requests that expired before now"""
+    execute(db, DELETE_EXPIRED_OTP_REQUESTS, (now,))
+
+# ============================================================================
+# IDEMPOTENCY KEYS
+# ============================================================================
+
+def get_idempotency_record(db, retailer_id, endpoint, key, now):
+    """(request_hash, status_code, response_body) of a live key, or None"""
+    return fetch_one(db, GET_IDEMPOTENCY_RECORD, (retailer_id, endpoint, key, now))
+
+def save_idempotency_record(db, retailer_id, endpoint, key, request_hash, status_code, body, now, expires_at):
+    """Insert a key's response, clearing an expired row for the same key first"""
+    execute(db, DELETE_EXPIRED_IDEMPOTENCY_KEY, (retailer_id, endpoint, key, now))
+    execute(db, INSERT_IDEMPOTENCY_RECORD,
+            (retailer_id, endpoint, key, request_hash, status_code, body, expires_at))
+
+def delete_expired_idempotency_keys(db, now):
+    """Delete idempotency keys that expired before now"""
+    execute(db, DELETE_EXPIRED_IDEMPOTENCY_KEYS, (now,))
+
+# ============================================================================
+# LEDGER ARCHIVAL
+# ============================================================================
+
+def list_debtor_ledger(db, debtor_id):
+    """A debtor's live ledger rows as dicts of LEDGER_COLUMNS, oldest first"""
+    return [dict(zip(LEDGER_COLUMNS, row)) for row in fetch_all(db, LIST_DEBTOR_LEDGER, (debtor_id,))]
+
+def list_archivable_debtor_ids(db, after_debtor_id, cutoff, limit):
+    """Ids of the next debtors after after_debtor_id with live entries older than cutoff"""
+    return [row[0] for row in fetch_all(db, LIST_ARCHIVABLE_DEBTOR_IDS, (after_debtor_id, cutoff, limit))]
+
+def archive_transactions(db, rows):
+    """Copy ledger row dicts into transactions_archive"""
+    execute_many(db, INSERT_ARCHIVED_TRANSACTION, [tuple(row[column] for column in LEDGER_COLUMNS) for row in rows])
+
+def delete_transactions(db, transaction_ids):
+    """Delete live ledger rows"""
+    execute_many(db, DELETE_TRANSACTION, [(transaction_id,) for transaction_id in transaction_ids])
+
+def insert_balance_forward(db, debtor_id, amount, created_at):
+    """Insert the balance_forward row standing in for a debtor's archived history"""
+    execute(db, INSERT_BALANCE_FORWARD, (debtor_id, amount, created_at))
+
+def set_debtor_archived_through(db, debtor_id, archived_through):
+    """Record the time of the newest archived entry"""
+    execute(db, SET_DEBTOR_ARCHIVED_THROUGH, (archived_through, debtor_id))
+
+def list_ledger_page(db, debtor_id, before, since, until, limit, read_through):
+    """Up to limit ledger rows before the (created_at, id) key in [since, until), newest first
+
+    Rows are dicts of LEDGER_PAGE_COLUMNS; read_through merges in the archive.
+    """
+    params = (debtor_id,) + tuple(before) + (since, until, limit)
+    rows = fetch_all(db, LEDGER_PAGE[read_through], params * 2 + (limit,) if read_through else params)
+    return [dict(zip(LEDGER_PAGE_COLUMNS, row)) for row in rows]
+
+def debtor_ledger_total_since(db, debtor_id, since, read_through):
+    """Net paise of the debtor's entries at or after since, archived ones too with read_through"""
+    params = (debtor_id, since) * 2 if read_through else (debtor_id, since)
+    return fetch_one(db, DEBTOR_LEDGER_TOTAL_SINCE[read_through], params)[0]
+
+# ============================================================================
+# REMINDER CAMPAIGNS
+# ============================================================================
+
+def campaign_belongs_to_retailer(db, retailer_id, campaign_id):
+    """Whether the campaign exists and belongs to the retailer"""
+    return fetch_one(db, CAMPAIGN_BELONGS_TO_RETAILER, (campaign_id, retailer_id)) is not None
+
+def create_campaign(db, retailer_id, shop_name, min_balance, min_days_inactive):
+    """Insert a campaign and return its id"""
+    return fetch_one(db, INSERT_CAMPAIGN, (retailer_id, shop_name, min_balance, min_days_inactive))[0]
+
+def enqueue_campaign_recipients(db, campaign_id, retailer_id, min_balance, inactive_since):
+    """Queue every debtor owing at least min_balance paise with no entry since inactive_since; returns how many"""
+    return execute(db, ENQUEUE_CAMPAIGN_RECIPIENTS, (campaign_id, retailer_id, min_balance, inactive_since)).rowcount
+
+def set_campaign_total_recipients(db, campaign_id, total_recipients):
+    """Record how many recipients a campaign was queued with"""
+    execute(db, SET_CAMPAIGN_TOTAL_RECIPIENTS, (total_recipients, campaign_id))
+
+def set_campaign_status(db, retailer_id, campaign_id, status, from_statuses):
+    """Move the retailer's campaign to status if it is in one of from_statuses; returns whether it moved"""
+    first, *rest = from_statuses
+    params = (status, campaign_id, retailer_id, first, rest[0] if rest else first)
+    return execute(db, SET_CAMPAIGN_STATUS, params).rowcount == 1
+
+def get_campaign(db, retailer_id, campaign_id):
+    """The retailer's campaign as a dict of CAMPAIGN_COLUMNS, or None"""
+    row = fetch_one(db, GET_CAMPAIGN, (campaign_id, retailer_id))
+    return dict(zip(CAMPAIGN_COLUMNS, row)) if row else None
+
+def get_campaign_dispatch(db, campaign_id):
+    """(shop_name, status) of a campaign, or None"""
+    return fetch_one(db, GET_CAMPAIGN_DISPATCH, (campaign_id,))
+
+def list_running_campaign_ids(db):
+    """Ids of the running campaigns, oldest first"""
+    return [row[0] for row in fetch_all(db, LIST_RUNNING_CAMPAIGN_IDS)]
+
+def update_campaign_counts(db, campaign_id):
+    """Refresh a campaign's sent and failed counters from its recipients"""
+    execute(db, UPDATE_CAMPAIGN_COUNTS, (campaign_id, campaign_id, campaign_id))
+
+def complete_empty_campaign(db, campaign_id, now):
+    """Mark a campaign that matched no debtors completed"""
+    execute(db, COMPLETE_EMPTY_CAMPAIGN, (now, campaign_id))
+
+def complete_campaign(db, campaign_id, now):
+    """Mark a running campaign completed unless recipients are still being sent"""
+    execute(db, COMPLETE_CAMPAIGN, (now, campaign_id, campaign_id))
+
+def count_recipients_by_status(db, campaign_id):
+    """{status: count} of a campaign's recipients (statuses with none are left out)"""
+    return dict(fetch_all(db, COUNT_RECIPIENTS_BY_STATUS, (campaign_id,)))
+
+def list_recipients(db, campaign_id, status, after_id, limit):
+    """A page of a campaign's recipients as dicts of RECIPIENT_COLUMNS (amount in paise), optionally one status"""
+    if status:
+        rows = fetch_all(db, LIST_RECIPIENTS_BY_STATUS, (campaign_id, status, after_id, limit))
+    else:
+        rows = fetch_all(db, LIST_RECIPIENTS, (campaign_id, after_id, limit))
+    return [dict(zip(RECIPIENT_COLUMNS, row)) for row in rows]
+
+def list_pending_recipients(db, campaign_id, limit):
+    """(id, name, phone, current total_due) of the next pending recipients"""
+    return fetch_all(db, LIST_PENDING_RECIPIENTS, (campaign_id, limit))
+
+def skip_settled_recipients(db, recipient_ids):
+    """Mark recipients whose debtor has paid off failed, without using an attempt"""
+    execute_many(db, SKIP_SETTLED_RECIPIENT, [(recipient_id,) for recipient_id in recipient_ids])
+
+def claim_recipients(db, claims, now):
+    """Mark (recipient id, amount) pairs as being sent now, each using an attempt"""
+    execute_many(db, CLAIM_RECIPIENT, [(amount, now, recipient_id) for recipient_id, amount in claims])
+
+def mark_recipients_sent(db, recipient_ids, now):
+    """Record successful sends"""
+    execute_many(db, MARK_RECIPIENT_SENT, [(now, recipient_id) for recipient_id in recipient_ids])
+
+def mark_recipients_failed(db, failures, max_attempts):
+    """Record (recipient id, error) failures; recipients with attempts left go back to pending"""
+    execute_many(db, MARK_RECIPIENT_FAILED,
+                 [(error, max_attempts, recipient_id) for recipient_id, error in failures])
+
+def return_recipients(db, recipient_ids):
+    """Put claimed recipients back to pending and give their attempt back"""
+    execute_many(db, RETURN_RECIPIENT, [(recipient_id,) for recipient_id in recipient_ids])
+
+def requeue_stale_recipients(db, claimed_before):
+    """Return running campaigns' recipients claimed before claimed_before to pending"""
+    execute(db, REQUEUE_STALE_RECIPIENTS, (claimed_before,))
+
+# ============================================================================
+# STATEMENTS
+# ============================================================================
+
+def count_retailer_debtors(db, retailer_id):
+    """How many debtors a retailer has"""
+    return fetch_one(db, COUNT_RETAILER_DEBTORS, (retailer_id,))[0]
+
+def create_statement_job(db, retailer, period_start, period_end, statement_format, total_debtors):
+    """Insert a queued statement job and return its id"""
+    return fetch_one(db, INSERT_STATEMENT_JOB, (
+        retailer.id, retailer.shop_name, retailer.shop_address, period_start, period_end,
+        statement_format, total_debtors
+    ))[0]
+
+def get_statement_job(db, job_id, retailer_id=None):
+    """A statement job as a dict of STATEMENT_JOB_COLUMNS, or None; only the retailer's if retailer_id is given"""
+    if retailer_id is None:
+        row = fetch_one(db, GET_STATEMENT_JOB, (job_id,))
+    else:
+        row = fetch_one(db, GET_RETAILER_STATEMENT_JOB, (job_id, retailer_id))
+    return dict(zip(STATEMENT_JOB_COLUMNS, row)) if row else None
+
+def list_queued_statement_job_ids(db):
+    """Ids of the queued statement jobs, oldest first"""
+    return [row[0] for row in fetch_all(db, LIST_QUEUED_STATEMENT_JOB_IDS)]
+
+def start_statement_job(db, job_id, now):
+    """Mark a job running, keeping the time it first started"""
+    execute(db, START_STATEMENT_JOB, (now, job_id))
+
+def advance_statement_job(db, job_id, debtors_read, statements_written, last_debtor_id):
+    """Add a stored batch to a job's counters and move its checkpoint to last_debtor_id"""
+    execute(db, ADVANCE_STATEMENT_JOB, (debtors_read, statements_written, last_debtor_id, job_id))
+
+def complete_statement_job(db, job_id, now):
+    """Mark a job completed"""
+    execute(db, COMPLETE_STATEMENT_JOB, (now, job_id))
+
+def fail_statement_job(db, job_id, error, now):
+    """Mark a job failed with the error"""
+    execute(db, FAIL_STATEMENT_JOB, (error, now, job_id))
+
+def requeue_running_statement_jobs(db):
+    """Return every running statement job to the queue"""
+    execute(db, REQUEUE_RUNNING_STATEMENT_JOBS)
+
+def list_statement_debtors(db, retailer_id, after_debtor_id, limit):
+    """(id, name, phone, total_due) of the retailer's next debtors in id order"""
+    return fetch_all(db, LIST_STATEMENT_DEBTORS, (retailer_id, after_debtor_id, limit))
+
+def ledger_totals_since(db, retailer_id, first_debtor_id, last_debtor_id, since):
+    """{debtor_id: net paise owed from entries at or after since}, archived entries included"""
+    return dict(fetch_all(db, LEDGER_TOTALS_SINCE, (retailer_id, first_debtor_id, last_debtor_id, since)))
+
+def iter_ledger_rows(db, retailer_id, first_debtor_id, last_debtor_id, start, end):
+    """Yield (debtor_id, created_at, type, amount, description) in [start, end), ordered by debtor then time"""
+    return iter_all(db, LEDGER_ROWS_BETWEEN, (retailer_id, first_debtor_id, last_debtor_id, start, end))
+
+def upsert_statements(db, job_id, statements):
+    """Store rendered (debtor_id, name, phone, opening, closing, txn_count, content) statements, replacing old ones"""
+    execute_many(db, UPSERT_STATEMENT, [(job_id,) + statement for statement in statements])
+
+def list_statements(db, job_id, after_debtor_id, limit):
+    """A page of a job's statements, without content, as dicts of STATEMENT_SUMMARY_COLUMNS"""
+    rows = fetch_all(db, LIST_STATEMENTS, (job_id, after_debtor_id, limit))
+    return [dict(zip(STATEMENT_SUMMARY_COLUMNS, row)) for row in rows]
+
+def list_statement_content(db, job_id, after_debtor_id, limit):
+    """A page of (debtor_id, name, content) of a job's statements"""
+    return fetch_all(db, LIST_STATEMENT_CONTENT, (job_id, after_debtor_id, limit))
+
+def get_statement(db, job_id, debtor_id):
+    """(debtor_id, name, content) of one statement, or None"""
+    return fetch_one(db, GET_STATEMENT, (job_id, debtor_id))
+
+# ============================================================================
+# RECONCILIATION
+# ============================================================================
+
+def _reconcile_scope(retailer_id):
+    return ('all', ()) if retailer_id is None else ('retailer', (retailer_id,))
+
+def count_debtors_in_range(db, first_debtor_id, last_debtor_id, retailer_id=None):
+    """How many debtors (only the retailer's, if given) have ids in the range"""
+    scope, scope_params = _reconcile_scope(retailer_id)
+    return fetch_one(db, COUNT_DEBTORS_IN_RANGE[scope], (first_debtor_id, last_debtor_id) + scope_params)[0]
+
+def iter_ledger_drift(db, first_debtor_id, last_debtor_id, retailer_id=None):
+    """Yield (debtor_id, retailer_id, recorded_total, ledger_total) for debtors in the range whose total_due drifted"""
+    scope, scope_params = _reconcile_scope(retailer_id)
+    return iter_all(db, LEDGER_DRIFT[scope], (first_debtor_id, last_debtor_id) + scope_params)
+
+def repair_debtor(db, debtor_id):
+    """Reset total_due to the ledger balance if it still differs; returns whether it did"""
+    return execute(db, REPAIR_DEBTOR, (debtor_id,)).rowcount == 1
+
+def list_retailer_debtor_ids(db, retailer_id, after_debtor_id, max_debtor_id, limit):
+    """The retailer's next debtor ids after after_debtor_id, up to max_debtor_id"""
+    return [row[0] for row in fetch_all(
+        db, LIST_RETAILER_DEBTOR_IDS, (retailer_id, after_debtor_id, max_debtor_id, limit)
+    )]
+
+def max_debtor_id(db):
+    """The highest debtor id, or 0 with no debtors"""
+    return fetch_one(db, MAX_DEBTOR_ID)[0]
+
+def get_run(db, run_id):
+    """A reconciliation run as a dict of RUN_COLUMNS, or None"""
+    row = fetch_one(db, GET_RUN, (run_id,))
+    return dict(zip(RUN_COLUMNS, row)) if row else None
+
+def get_running_run(db, retailer_id=None):
+    """The newest run still running for the scope (every debtor, or the retailer's) as a dict, or None"""
+    scope, scope_params = _reconcile_scope(retailer_id)
+    row = fetch_one(db, GET_RUNNING_RUN[scope], scope_params)
+    return dict(zip(RUN_COLUMNS, row)) if row else None
+
+def supersede_running_runs(db, now, retailer_id=None):
+    """Fail every run still running for the scope as superseded"""
+    scope, scope_params = _reconcile_scope(retailer_id)
+    execute(db, SUPERSEDE_RUNNING_RUNS[scope], (now,) + scope_params)
+
+def create_run(db, retailer_id, repair, max_debtor_id, now):
+    """Insert a running run covering debtor ids up to max_debtor_id and return its id"""
+    return fetch_one(db, INSERT_RUN, (retailer_id, int(bool(repair)), max_debtor_id, now))[0]
+
+def set_run_repair(db, run_id):
+    """Make a run repair the drift it finds"""
+    execute(db, SET_RUN_REPAIR, (run_id,))
+
+def advance_run(db, run_id, checked, drift_count, repaired_count, last_debtor_id):
+    """Add a recorded chunk to a run's counters and move its checkpoint to last_debtor_id"""
+    execute(db, ADVANCE_RUN, (checked, drift_count, repaired_count, last_debtor_id, run_id))
+
+def finish_run(db, run_id, status, error, now):
+    """Mark a run completed or failed"""
+    execute(db, FINISH_RUN, (status, error, now, run_id))
+
+def get_latest_run_id(db, retailer_id):
+    """Id of the newest run that covered the retailer, or None"""
+    row = fetch_one(db, GET_LATEST_RUN_ID, (retailer_id,))
+    return row[0] if row else None
+
+def get_queued_run(db, retailer_id):
+    """(id, repair) of the retailer's newest queued run, or None"""
+    return fetch_one(db, GET_QUEUED_RUN, (retailer_id,))
+
+def queue_run(db, retailer_id, repair):
+    """Insert a queued run for the retailer and return its id"""
+    return fetch_one(db, INSERT_QUEUED_RUN, (retailer_id, int(bool(repair))))[0]
+
+def list_queued_run_ids(db):
+    """Ids of the queued runs, oldest first"""
+    return [row[0] for row in fetch_all(db, LIST_QUEUED_RUN_IDS)]
+
+def claim_queued_run(db, run_id, now):
+    """Move a queued run to running, covering every debtor id so far; returns False if it was not queued"""
+    return execute(db, CLAIM_QUEUED_RUN, (now, run_id)).rowcount == 1
+
+def requeue_stale_runs(db, started_before):
+    """Return retailer runs still running that started before started_before to the queue"""
+    execute(db, REQUEUE_STALE_RUNS, (started_before,))
+
+def record_drift(db, run_id, drift, repaired):
+    """Store (debtor_id, retailer_id, recorded_total, ledger_total) drift rows, flagging the repaired debtor ids"""
+    execute_many(db, UPSERT_DRIFT, [(run_id,) + row + (int(row[0] in repaired),) for row in drift])
+
+def list_retailer_drift(db, run_id, retailer_id, limit):
+    """(debtor_id, name, phone, recorded_total, ledger_total, repaired) of the retailer's drift in a run"""
+    return fetch_all(db, LIST_RETAILER_DRIFT, (run_id, retailer_id, limit))
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+def list_tables(db):
+    """Names of the tables in the database"""
+    return {row[0] for row in fetch_all(db, LIST_TABLES)}
+
+def list_columns(db):
+    """(table, column) pairs of every table in the database"""
+    return set(fetch_all(db, LIST_COLUMNS))
@@ -0,0 +1,299 @@
+"""
+Patt Book - Account Statements
+Monthly per-debtor statements, rendered in a process pool by a background worker
+"""
+
+import html
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+from database import get_db
+import repository
+from logging_config import configure_logging
+from money import format_rupees, to_rupees
+
+# Worker configuration
+STATEMENT_PROCESSES = int(os.environ.get('STATEMENT_PROCESSES', str(os.cpu_count() or 1)))
+# Debtors read from the database per batch, and per render task sent to a process
+STATEMENT_BATCH_SIZE = int(os.environ.get('STATEMENT_BATCH_SIZE', '1000'))
+STATEMENT_CHUNK_SIZE = int(os.environ.get('STATEMENT_CHUNK_SIZE', '100'))
+STATEMENT_POLL_SECONDS = float(os.environ.get('STATEMENT_POLL_SECONDS', '5'))
+
+STATEMENT_FORMATS = ('text', 'html')
+STATEMENT_MEDIA_TYPES = {'text': 'text/plain; charset=utf-8', 'html': 'text/html; charset=utf-8'}
+STATEMENT_EXTENSIONS = {'text': 'txt', 'html': 'html'}
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# JOB MANAGEMENT
+# ============================================================================
+
+def parse_period(period=None, today=None):
+    """('YYYY-MM-01', first day of the next month) for 'YYYY-MM'; defaults to last month"""
+    if period:
+        start = datetime.strptime(period, '%Y-%m')
+    else:
+        today = today or datetime.utcnow()
+        start = datetime(today.year - (today.month == 1), (today.month - 2) % 12 + 1, 1)
+    end = datetime(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+def create_job(db, retailer, period_start, period_end, statement_format):
+    """Queue a statement job for every debtor of the retailer; returns (job_id, total_debtors)"""
+    total_debtors = repository.count_retailer_debtors(db, retailer.id)
+    job_id = repository.create_statement_job(db, retailer, period_start, period_end, statement_format, total_debtors)
+    return job_id, total_debtors
+
+def get_job(db, retailer_id, job_id):
+    """Statement job row for the retailer as a dict, or None"""
+    return repository.get_statement_job(db, job_id, retailer_id)
+
+def get_job_progress(db, retailer_id, job_id):
+    """Job status and counters as a dict, or None if not found"""
+    job = get_job(db, retailer_id, job_id)
+    if not job:
+        return None
+
+    total = job['total_debtors']
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'format': job['format'],
+        'period_start': job['period_start'],
+        'period_end': job['period_end'],
+        'total_debtors': total,
+        'processed_debtors': job['processed_count'],
+        'statements': job['statement_count'],
+        'percent_complete': round(100.0 * job['processed_count'] / total, 1) if total else 100.0,
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'completed_at': job['completed_at']
+    }
+
+def get_job_statements(db, job_id, after_debtor_id=0, limit=100):
+    """Page through a job's statements (without their content) in debtor id order"""
+    rows = repository.list_statements(db, job_id, after_debtor_id, limit)
+    return [
+        dict(row, opening_balance=to_rupees(row['opening_balance']), closing_balance=to_rupees(row['closing_balance']))
+        for row in rows
+    ]
+
+def get_statement(db, job_id, debtor_id):
+    """A single rendered statement as a dict of debtor_id, name and content, or None"""
+    row = repository.get_statement(db, job_id, debtor_id)
+    return dict(zip(('debtor_id', 'name', 'content'), row)) if row else None
+
+def iter_statements(db, job_id, batch_size=500):
+    """Yield (debtor_id, name, content) for a whole job without loading it all at once"""
+    after_debtor_id = 0
+    while True:
+        rows = repository.list_statement_content(db, job_id, after_debtor_id, batch_size)
+        if not rows:
+            return
+        yield from rows
+        after_debtor_id = rows[-1][0]
+
+# ============================================================================
+# RENDERING (runs in the worker's process pool)
+# ============================================================================
+
+def format_amount(paise):
+    """Rupee amount with thousands separators"""
+    return f"{'-' if paise < 0 else ''}₹{format_rupees(abs(paise))}"
+
+def format_date(timestamp):
+    """'YYYY-MM-DD...' as '05 Sep 2026'"""
+    return datetime.strptime(timestamp[:10], '%Y-%m-%d').strftime('%d %b %Y')
+
+def statement_lines(opening, rows):
+    """(date, type, amount, balance, description) for each row, with the running balance"""
+    balance = opening
+    lines = []
+    for created_at, transaction_type, amount, description in rows:
+        balance += -amount if transaction_type == 'payment' else amount
+        lines.append((format_date(created_at), transaction_type, amount, balance, description or ''))
+    return lines
+
+def render_text(header, name, opening, closing, rows):
+    """Plain-text statement, short enough to send as a WhatsApp message"""
+    parts = [
+        f"*{header['shop_name']}*",
+        f"Statement for {name}",
+        f"{format_date(header['period_start'])} - {format_date(header['period_last_day'])}",
+        '',
+        f"Opening balance: {format_amount(opening)}"
+    ]
+    for date, transaction_type, amount, balance, description in statement_lines(opening, rows):
+        sign = '-' if transaction_type == 'payment' else '+'
+        note = f" ({description})" if description else ''
+        parts.append(f"{date}  {sign}{format_amount(amount)}  = {format_amount(balance)}{note}")
+    parts.append(f"Closing balance: {format_amount(closing)}")
+    return '\n'.join(parts) + '\n'
+
+def render_html(header, name, opening, closing, rows):
+    """Standalone printable HTML statement"""
+    escape = html.escape
+    body_rows = ''.join(
+        f"<tr><td>{date}</td><td>{escape(description)}</td>"
+        f"<td class=\"num\">{format_amount(amount) if transaction_type != 'payment' else ''}</td>"
+        f"<td class=\"num\">{format_amount(amount) if transaction_type == 'payment' else ''}</td>"
+        f"<td class=\"num\">{format_amount(balance)}</td></tr>"
+        for date, transaction_type, amount, balance, description in statement_lines(opening, rows)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f"<title>Statement - {escape(name)}</title>"
+        '<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;width:100%}'
+        'td,th{border-bottom:1px solid #ddd;padding:4px 8px;text-align:left}.num{text-align:right}</style>'
+        '</head><body>'
+        f"<h1>{escape(header['shop_name'])}</h1><p>{escape(header['shop_address'])}</p>"
+        f"<h2>Statement for {escape(name)}</h2>"
+        f"<p>{format_date(header['period_start'])} - {format_date(header['period_last_day'])}</p>"
+        '<table><thead><tr><th>Date</th><th>Description</th><th class="num">Credit</th>'
+        '<th class="num">Payment</th><th class="num">Balance</th></tr></thead><tbody>'
+        f"<tr><td></td><td>Opening balance</td><td></td><td></td><td class=\"num\">{format_amount(opening)}</td></tr>"
+        f"{body_rows}"
+        f"<tr><td></td><td><strong>Closing balance</strong></td><td></td><td></td>"
+        f"<td class=\"num\"><strong>{format_amount(closing)}</strong></td></tr>"
+        '</tbody></table></body></html>'
+    )
+
+RENDERERS = {'text': render_text, 'html': render_html}
+
+def render_statements(header, payloads):
+    """Render a chunk of statements; the unit of work sent to a pool process"""
+    render = RENDERERS[header['format']]
+    return [
+        (debtor_id, name, phone, opening, closing, len(rows),
+         render(header, name, opening, closing, rows))
+        for debtor_id, name, phone, opening, closing, rows in payloads
+    ]
+
+# ============================================================================
+# STATEMENT WORKER
+# ============================================================================
+
+def load_batch(db, job, after_debtor_id, batch_size):
+    """Read the next batch of debtors and their period ledgers; returns (payloads, debtors_read, last_id)
+
+    All three queries read one snapshot, so a credit or payment committed
+    between them cannot make the opening and closing balances disagree.
+    """
+    repository.begin_snapshot(db)
+    try:
+        debtors = repository.list_statement_debtors(db, job['retailer_id'], after_debtor_id, batch_size)
+        if not debtors:
+            return [], 0, after_debtor_id
+
+        batch_range = (job['retailer_id'], debtors[0][0], debtors[-1][0])
+
+        # Everything after the period, to walk back from the current balance
+        after_period = repository.ledger_totals_since(db, *batch_range, job['period_end'])
+
+        period_rows = repository.iter_ledger_rows(db, *batch_range, job['period_start'], job['period_end'])
+        rows_by_debtor = {
+            debtor_id: [row[1:] for row in rows]
+            for debtor_id, rows in groupby(period_rows, key=lambda row: row[0])
+        }
+
+        payloads = []
+        for debtor_id, name, phone, total_due in debtors:
+            rows = rows_by_debtor.get(debtor_id, [])
+            closing = (total_due or 0) - after_period.get(debtor_id, 0)
+            opening = closing - sum(-amount if kind == 'payment' else amount for _, kind, amount, _ in rows)
+            # Nothing happened and nothing is owed: no statement to send
+            if not rows and closing == 0:
+                continue
+            payloads.append((debtor_id, name, phone, opening, closing, rows))
+
+        return payloads, len(debtors), debtors[-1][0]
+    finally:
+        # Only reads happened here; end the snapshot before the batch is stored
+        db.commit()
+
+def store_batch(db, job_id, results, debtors_read, last_debtor_id):
+    """Save rendered statements and move the job's checkpoint forward in one transaction"""
+    repository.upsert_statements(db, job_id, results)
+    repository.advance_statement_job(db, job_id, debtors_read, len(results), last_debtor_id)
+    db.commit()
+
+def run_job(db, pool, job_id):
+    """Generate a job's statements, reading the next batch while the pool renders the last"""
+    job = repository.get_statement_job(db, job_id)
+    repository.start_statement_job(db, job_id, datetime.utcnow())
+    db.commit()
+
+    period_last_day = datetime.strptime(job['period_end'], '%Y-%m-%d') - timedelta(days=1)
+    header = {
+        'shop_name': job['shop_name'],
+        'shop_address': job['shop_address'],
+        'period_start': job['period_start'],
+        'period_last_day': period_last_day.strftime('%Y-%m-%d'),
+        'format': job['format']
+    }
+
+    in_flight = deque()
+    after_debtor_id = job['last_debtor_id']
+    try:
+        while True:
+            payloads, debtors_read, after_debtor_id = load_batch(db, job, after_debtor_id, STATEMENT_BATCH_SIZE)
+            if debtors_read:
+                futures = [
+                    pool.submit(render_statements, header, payloads[i:i + STATEMENT_CHUNK_SIZE])
+                    for i in range(0, len(payloads), STATEMENT_CHUNK_SIZE)
+                ]
+                in_flight.append((futures, debtors_read, after_debtor_id))
+
+            # Keep one batch rendering while the next is read, and no more
+            while in_flight and (len(in_flight) > 1 or not debtors_read):
+                futures, read, last_id = in_flight.popleft()
+                results = [result for future in futures for result in future.result()]
+                store_batch(db, job_id, results, read, last_id)
+
+            if not debtors_read:
+                break
+
+        repository.complete_statement_job(db, job_id, datetime.utcnow())
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("Error generating statements", extra={'job_id': job_id})
+        repository.fail_statement_job(db, job_id, str(e), datetime.utcnow())
+        db.commit()
+
+def requeue_interrupted(db):
+    """Return jobs left running by a crashed worker to the queue; they resume from their checkpoint"""
+    repository.requeue_running_statement_jobs(db)
+    db.commit()
+
+def run_worker(once=False, processes=STATEMENT_PROCESSES):
+    """Poll for queued statement jobs and render them with a process pool"""
+    db = get_db()
+    repository.set_busy_timeout(db, 5000)
+    requeue_interrupted(db)
+
+    # spawn: the worker has threads (logging) that must not be forked mid-flight
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        while True:
+            job_ids = repository.list_queued_statement_job_ids(db)
+            for job_id in job_ids:
+                run_job(db, pool, job_id)
+
+            if once:
+                break
+            if not job_ids:
+                time.sleep(STATEMENT_POLL_SECONDS)
+
+    db.close()
+
+if __name__ == '__main__':
+    configure_logging()
+    run_worker()
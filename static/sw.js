@@ -0,0 +1,111 @@
+// Patt Book - Offline service worker
+// Serves the dashboard shell from cache and keeps the last debtor list and
+// shop settings for when the network is slow or gone. Credits and payments
+// are not handled here: the dashboard queues them and replays them through
+// POST /api/sync, since only the page can read the sign-in token.
+
+const SHELL_CACHE = 'patt-book-shell-v1';
+const DATA_CACHE = 'patt-book-data-v1';
+
+const SHELL_URLS = ['/dashboard'];
+
+// GET API responses kept for offline use (cleared on logout by the page)
+const CACHED_API_PATHS = ['/api/debtors', '/api/settings'];
+
+// How long to wait for the network before answering an API read from cache
+const NETWORK_TIMEOUT_MS = 3000;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    const current = [SHELL_CACHE, DATA_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name.startsWith('patt-book-') && !current.includes(name))
+                    .map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (SHELL_URLS.includes(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(event));
+    } else if (CACHED_API_PATHS.includes(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    }
+});
+
+// The shell renders at once from cache; a newer copy is fetched for next time
+async function staleWhileRevalidate(event) {
+    const request = event.request;
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(request, { ignoreSearch: true });
+    const refresh = fetch(request)
+        .then(response => {
+            if (response.ok && !response.redirected) {
+                cache.put(request, response.clone());
+            }
+            return response;
+        })
+        .catch(() => cached);
+
+    if (cached) {
+        event.waitUntil(refresh);
+        return cached;
+    }
+    return refresh;
+}
+
+// API reads try the network first and fall back to the last good response
+// when it fails or takes longer than NETWORK_TIMEOUT_MS (the cache is still
+// updated when the slow response arrives)
+async function networkFirst(request) {
+    const cache = await caches.open(DATA_CACHE);
+    const network = fetch(request).then(async response => {
+        if (response.ok) {
+            const body = await response.clone().json().catch(() => null);
+            if (body && body.success) {
+                await cache.put(request, response.clone());
+            }
+        }
+        return response;
+    });
+    // A late failure after answering from cache is not an error
+    network.catch(() => {});
+
+    const timeout = new Promise(resolve => setTimeout(resolve, NETWORK_TIMEOUT_MS));
+    try {
+        const response = await Promise.race([network, timeout]);
+        if (response) {
+            return response;
+        }
+    } catch (error) {
+        // Offline: fall through to the cache
+    }
+
+    const cached = await cache.match(request);
+    if (cached) {
+        const headers = new Headers(cached.headers);
+        headers.set('X-Patt-Book-Cached', 'true');
+        return new Response(cached.body, { status: cached.status, headers });
+    }
+    return network;
+}
@@ -0,0 +1,140 @@
+"""
+Patt Book - Background Job Tests
+Reconciliation, reminders, statements, archiving and the rollup backfill,
+run against whichever backend DATABASE_URL selects (see conftest.py)
+"""
+
+from datetime import datetime, timedelta
+
+import archive
+import reconcile
+import reminders
+import rollup
+import statements
+
+def add_credit(client, auth_headers, phone, amount, name='Asha'):
+    response = client.post('/api/debtors', headers=auth_headers, json={
+        'name': name, 'phone': phone, 'credit_amount': amount
+    })
+    assert response.get_json()['success'], response.get_json()
+    return response.get_json()
+
+def debtor_id_for(db, phone):
+    return db.execute('SELECT id FROM debtors WHERE phone = ?', (phone,)).fetchone()[0]
+
+def backdate(db, debtor_id, days):
+    """Move a debtor's whole ledger into the past"""
+    created_at = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    db.execute('UPDATE transactions SET created_at = ? WHERE debtor_id = ?', (created_at, debtor_id))
+    db.commit()
+
+def request_reconciliation(client, auth_headers, repair=False):
+    """Queue a run through the API, let the worker check it, and return GET /api/reconciliation"""
+    response = client.post('/api/reconciliation', headers=auth_headers, json={'repair': repair})
+    assert response.status_code == 202
+    assert response.get_json()['run']['status'] == 'queued'
+    reconcile.run_worker(once=True)
+    return client.get('/api/reconciliation', headers=auth_headers).get_json()
+
+def test_reconciliation_finds_and_repairs_drift(client, auth_headers, db):
+    add_credit(client, auth_headers, '9800000001', 150)
+    debtor_id = debtor_id_for(db, '9800000001')
+    db.execute('UPDATE debtors SET total_due = total_due + 700 WHERE id = ?', (debtor_id,))
+    db.commit()
+
+    body = request_reconciliation(client, auth_headers)
+    assert body['run']['status'] == 'completed'
+    assert [row['debtor_id'] for row in body['drift']] == [debtor_id]
+
+    body = request_reconciliation(client, auth_headers, repair=True)
+    assert body['run']['repaired_count'] == 1
+    assert db.execute('SELECT total_due FROM debtors WHERE id = ?', (debtor_id,)).fetchone()[0] == 15000
+
+    # Once repaired, a fresh check finds nothing
+    body = request_reconciliation(client, auth_headers)
+    assert body['drift'] == []
+
+def test_reconciliation_requests_share_one_queued_run(client, auth_headers, db):
+    first = client.post('/api/reconciliation', headers=auth_headers, json={}).get_json()['run']
+    second = client.post('/api/reconciliation', headers=auth_headers, json={'repair': True}).get_json()['run']
+
+    assert second['id'] == first['id']
+    assert second['repair']
+    reconcile.run_worker(once=True)
+    assert reconcile.get_run(db, first['id'])['status'] == 'completed'
+
+def test_nightly_reconciliation_records_each_chunk(client, auth_headers, db):
+    for i in range(3):
+        add_credit(client, auth_headers, f'980000001{i}', 10 + i)
+
+    run = reconcile.run_reconciliation(processes=1, chunk_size=2, resume=False)
+    assert run['status'] == 'completed'
+    assert run['debtors_checked'] == 3
+    assert run['drift_count'] == 0
+
+def test_reminder_worker_sends_each_recipient_once(client, auth_headers, db):
+    add_credit(client, auth_headers, '9800000021', 500)
+    add_credit(client, auth_headers, '9800000022', 20)
+    for phone in ('9800000021', '9800000022'):
+        backdate(db, debtor_id_for(db, phone), 1)
+
+    body = client.post('/api/reminders/campaigns', headers=auth_headers, json={'min_balance': 100}).get_json()
+    assert body['success'] and body['total_recipients'] == 1
+
+    reminders.run_worker(once=True)
+
+    progress = client.get(f"/api/reminders/campaigns/{body['campaign_id']}", headers=auth_headers).get_json()
+    assert progress['campaign']['status'] == 'completed'
+    assert progress['campaign']['counts']['sent'] == 1
+
+def test_statement_worker_renders_every_debtor(client, auth_headers, db):
+    add_credit(client, auth_headers, '9800000031', 250, name='Ravi')
+    add_credit(client, auth_headers, '9800000032', 75, name='Meena')
+    period = datetime.utcnow().strftime('%Y-%m')
+
+    body = client.post('/api/statements/jobs', headers=auth_headers, json={'period': period}).get_json()
+    assert body['success'], body
+
+    statements.run_worker(once=True, processes=1)
+
+    job = statements.get_job_progress(db, db.execute('SELECT id FROM retailers').fetchone()[0], body['job_id'])
+    assert job['status'] == 'completed'
+    rendered = {row['name']: row for row in statements.get_job_statements(db, body['job_id'])}
+    assert set(rendered) == {'Ravi', 'Meena'}
+    assert rendered['Ravi']['closing_balance'] == 250
+
+def test_archive_folds_settled_history_into_balance_forward(client, auth_headers, db):
+    add_credit(client, auth_headers, '9800000041', 300)
+    debtor_id = debtor_id_for(db, '9800000041')
+    backdate(db, debtor_id, 400)
+    assert client.post('/api/payments', headers=auth_headers, json={
+        'debtor_id': debtor_id, 'amount': 300
+    }).get_json()['success']
+    add_credit(client, auth_headers, '9800000041', 40)
+
+    stats = archive.run_archive(horizon_days=365)
+    assert stats['debtors_archived'] == 1
+    assert stats['transactions_archived'] == 1
+
+    assert db.execute('SELECT total_due FROM debtors WHERE id = ?', (debtor_id,)).fetchone()[0] == 4000
+    run = reconcile.reconcile_retailer(db, db.execute('SELECT id FROM retailers').fetchone()[0])
+    assert run['drift_count'] == 0
+
+    body = client.get(f'/api/debtors/{debtor_id}/transactions', headers=auth_headers).get_json()
+    assert [(row['type'], row['amount'], row['archived'], row['balance']) for row in body['transactions']] == [
+        ('credit', 40, False, 40), ('payment', 300, False, 0), ('credit', 300, True, 300)
+    ]
+
+def test_rollup_backfill_matches_the_ledger(client, auth_headers, db, retailer_id):
+    add_credit(client, auth_headers, '9800000051', 120)
+    add_credit(client, auth_headers, '9800000052', 30)
+    db.execute('DELETE FROM daily_rollup')
+    db.commit()
+
+    stats = rollup.run_backfill()
+    assert stats['retailers'] == 1
+
+    since, until = rollup.parse_report_range(None, None)
+    report = rollup.get_collections_report(db, retailer_id, since, until)
+    assert report['totals']['credit_total'] == 150
+    assert report['totals']['txn_count'] == 2
@@ -0,0 +1,79 @@
+"""
+Patt Book - Backup Tests
+"""
+
+import gzip
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import backup
+import database
+
+pytestmark = pytest.mark.skipif(database.DATABASE_BACKEND != 'sqlite', reason='backup.py copies the SQLite file')
+
+def dump(path):
+    """Every row of every table, for comparing two database files"""
+    db = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return {table: db.execute(f'SELECT * FROM {table} ORDER BY 1').fetchall() for table in tables}
+    finally:
+        db.close()
+
+@pytest.fixture
+def ledger(client, auth_headers):
+    for phone, amount in (('9800000141', 120), ('9800000142', 35.5), ('9800000141', 80)):
+        body = client.post('/api/debtors', headers=auth_headers, json={
+            'name': 'Asha', 'phone': phone, 'credit_amount': amount
+        }).get_json()
+        assert body['success'], body
+
+def test_snapshot_restores_every_row(ledger, tmp_path):
+    # One page per step, so the copy takes several steps
+    result = backup.create_snapshot(database.DATABASE_PATH, str(tmp_path / 'backups'), pages=1, step_sleep=0)
+    assert result['steps'] > 1
+    assert 'debtors' in backup.verify_snapshot(result['path'])
+
+    restored_path = str(tmp_path / 'restored.db')
+    backup.restore_snapshot(result['path'], restored_path)
+
+    restored = dump(restored_path)
+    assert restored == dump(database.DATABASE_PATH)
+    assert len(restored['transactions']) == 3
+    assert os.listdir(tmp_path / 'backups') == [os.path.basename(result['path'])]
+
+def test_restore_rejects_a_corrupt_snapshot(ledger, tmp_path):
+    result = backup.create_snapshot(database.DATABASE_PATH, str(tmp_path / 'backups'), step_sleep=0)
+    with gzip.open(result['path'], 'rb') as snapshot:
+        raw = bytearray(snapshot.read())
+    # Keep the header page, overwrite the rest
+    raw[4096:] = b'\xff' * (len(raw) - 4096)
+    corrupt_path = str(tmp_path / 'corrupt.db.gz')
+    with gzip.open(corrupt_path, 'wb') as snapshot:
+        snapshot.write(raw)
+
+    target_path = str(tmp_path / 'target.db')
+    backup.restore_snapshot(result['path'], target_path)
+    before = dump(target_path)
+
+    with pytest.raises((RuntimeError, sqlite3.DatabaseError)):
+        backup.restore_snapshot(corrupt_path, target_path)
+
+    assert dump(target_path) == before
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.restore-')]
+
+def test_backup_refuses_to_run_on_postgresql(tmp_path):
+    env = dict(os.environ, DATABASE_URL='postgresql://localhost/patt_book')
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(backup.__file__), 'create'],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 2
+    assert 'only snapshots the SQLite database' in result.stderr
+    assert not (tmp_path / 'backups').exists()
@@ -0,0 +1,58 @@
+"""
+Patt Book - Idempotency-Key Tests
+"""
+
+def post(client, auth_headers, path, body, key):
+    return client.post(path, headers={**auth_headers, 'Idempotency-Key': key}, json=body)
+
+def count(db, sql):
+    return db.execute(sql).fetchone()[0]
+
+def test_retried_credit_is_replayed_not_applied_twice(client, auth_headers, db):
+    body = {'name': 'Asha', 'phone': '9800000111', 'credit_amount': 120}
+
+    first = post(client, auth_headers, '/api/debtors', body, 'credit-1')
+    retry = post(client, auth_headers, '/api/debtors', body, 'credit-1')
+
+    assert first.get_json()['success']
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert count(db, 'SELECT COUNT(*) FROM transactions') == 1
+    assert count(db, 'SELECT total_due FROM debtors') == 12000
+
+def test_retried_payment_is_replayed_not_applied_twice(client, auth_headers, db):
+    post(client, auth_headers, '/api/debtors', {'name': 'Asha', 'phone': '9800000112', 'credit_amount': 100}, 'c')
+    debtor_id = count(db, 'SELECT id FROM debtors')
+    db.commit()
+
+    body = {'debtor_id': debtor_id, 'amount': 40}
+    first = post(client, auth_headers, '/api/payments', body, 'payment-1')
+    retry = post(client, auth_headers, '/api/payments', body, 'payment-1')
+
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert count(db, 'SELECT total_due FROM debtors') == 6000
+
+def test_reused_key_with_a_different_body_is_rejected(client, auth_headers, db):
+    post(client, auth_headers, '/api/debtors', {'name': 'Asha', 'phone': '9800000113', 'credit_amount': 10}, 'k')
+    response = post(client, auth_headers, '/api/debtors', {'name': 'Asha', 'phone': '9800000113', 'credit_amount': 99}, 'k')
+
+    assert response.status_code == 422
+    assert not response.get_json()['success']
+    assert count(db, 'SELECT total_due FROM debtors') == 1000
+
+def test_keys_are_scoped_per_endpoint(client, auth_headers, db):
+    post(client, auth_headers, '/api/debtors', {'name': 'Asha', 'phone': '9800000114', 'credit_amount': 50}, 'same')
+    debtor_id = count(db, 'SELECT id FROM debtors')
+    db.commit()
+
+    response = post(client, auth_headers, '/api/payments', {'debtor_id': debtor_id, 'amount': 20}, 'same')
+
+    assert response.get_json()['success']
+    assert 'Idempotent-Replayed' not in response.headers
+
+def test_requests_without_a_key_are_applied_each_time(client, auth_headers, db):
+    for _ in range(2):
+        client.post('/api/debtors', headers=auth_headers, json={'name': 'Asha', 'phone': '9800000115', 'credit_amount': 5})
+    assert count(db, 'SELECT total_due FROM debtors') == 1000
@@ -0,0 +1,96 @@
+"""
+Patt Book - Ledger Pagination Tests
+"""
+
+import pytest
+
+# (created_at, type, paise); two rows share a timestamp so the id breaks the tie
+LEDGER = [
+    ('2026-01-01 09:00:00', 'credit', 10000),
+    ('2026-01-02 09:00:00', 'credit', 5000),
+    ('2026-01-02 09:00:00', 'payment', 3000),
+    ('2026-01-03 09:00:00', 'credit', 2500),
+    ('2026-01-04 09:00:00', 'payment', 4500),
+    ('2026-01-05 09:00:00', 'credit', 1000),
+    ('2026-01-06 09:00:00', 'credit', 700),
+]
+
+@pytest.fixture
+def debtor_id(client, auth_headers, db):
+    client.post('/api/debtors', headers=auth_headers, json={'name': 'Asha', 'phone': '9800000121', 'credit_amount': 1})
+    debtor_id = db.execute('SELECT id FROM debtors').fetchone()[0]
+    db.execute('DELETE FROM transactions')
+    db.executemany(
+        "INSERT INTO transactions (debtor_id, type, amount, description, created_at) VALUES (?, ?, ?, '', ?)",
+        [(debtor_id, kind, amount, created_at) for created_at, kind, amount in LEDGER]
+    )
+    total = sum(-amount if kind == 'payment' else amount for _, kind, amount in LEDGER)
+    db.execute('UPDATE debtors SET total_due = ? WHERE id = ?', (total, debtor_id))
+    db.commit()
+    return debtor_id
+
+def walk(client, auth_headers, debtor_id, **params):
+    """Follow next_cursor to the end; returns every page's transactions"""
+    pages = []
+    cursor = None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        body = client.get(f'/api/debtors/{debtor_id}/transactions', headers=auth_headers, query_string=query).get_json()
+        assert body['success'], body
+        pages.append(body['transactions'])
+        cursor = body['next_cursor']
+        if not cursor:
+            return pages
+
+def expected_rows():
+    """Every ledger row newest first, with the balance after it"""
+    rows = []
+    balance = 0
+    for index, (created_at, kind, amount) in enumerate(LEDGER):
+        balance += -amount if kind == 'payment' else amount
+        rows.append((index, created_at, kind, amount / 100, balance / 100))
+    return list(reversed(rows))
+
+def test_pages_cover_the_ledger_once_newest_first(client, auth_headers, debtor_id):
+    pages = walk(client, auth_headers, debtor_id, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    rows = [row for page in pages for row in page]
+    assert [(row['created_at'], row['type'], row['amount'], row['balance']) for row in rows] == [
+        (created_at, kind, amount, balance) for _, created_at, kind, amount, balance in expected_rows()
+    ]
+    assert len({row['id'] for row in rows}) == len(LEDGER)
+
+def test_type_filter_keeps_whole_ledger_balances(client, auth_headers, debtor_id):
+    rows = [row for page in walk(client, auth_headers, debtor_id, limit=1, type='payment') for row in page]
+
+    assert [(row['created_at'], row['amount'], row['balance']) for row in rows] == [
+        (created_at, amount, balance) for _, created_at, kind, amount, balance in expected_rows() if kind == 'payment'
+    ]
+
+def test_date_range_starts_from_the_balance_at_its_end(client, auth_headers, debtor_id):
+    rows = [row for page in walk(client, auth_headers, debtor_id, limit=2, **{'from': '2026-01-02', 'to': '2026-01-03'})
+            for row in page]
+
+    assert [(row['created_at'], row['balance']) for row in rows] == [
+        (created_at, balance) for _, created_at, _, _, balance in expected_rows()
+        if '2026-01-02' <= created_at < '2026-01-04'
+    ]
+
+def test_new_entries_do_not_shift_later_pages(client, auth_headers, debtor_id):
+    first = client.get(f'/api/debtors/{debtor_id}/transactions', headers=auth_headers,
+                       query_string={'limit': 3}).get_json()
+    client.post('/api/debtors', headers=auth_headers, json={'name': 'Asha', 'phone': '9800000121', 'credit_amount': 9})
+
+    second = client.get(f'/api/debtors/{debtor_id}/transactions', headers=auth_headers,
+                        query_string={'limit': 3, 'cursor': first['next_cursor']}).get_json()
+
+    assert [row['created_at'] for row in second['transactions']] == [
+        created_at for _, created_at, _, _, _ in expected_rows()[3:6]
+    ]
+    assert second['transactions'][0]['balance'] == expected_rows()[3][4]
+
+def test_malformed_cursor_is_rejected(client, auth_headers, debtor_id):
+    body = client.get(f'/api/debtors/{debtor_id}/transactions', headers=auth_headers,
+                      query_string={'cursor': 'not-a-cursor'}).get_json()
+    assert not body['success']
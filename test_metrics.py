@@ -0,0 +1,23 @@
+"""
+Patt Book - Metrics Endpoint Tests
+"""
+
+import pytest
+
+import app
+
+@pytest.mark.parametrize('path', ['/metrics/queries', '/metrics/cache'])
+def test_metrics_are_hidden_without_a_configured_token(client, monkeypatch, path):
+    monkeypatch.setattr(app, 'METRICS_TOKEN', '')
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={'Authorization': 'Bearer '}).status_code == 404
+
+@pytest.mark.parametrize('path', ['/metrics/queries', '/metrics/cache'])
+def test_metrics_need_the_token(client, monkeypatch, path):
+    monkeypatch.setattr(app, 'METRICS_TOKEN', 's3cret')
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 404
+
+    response = client.get(path, headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.get_json()['pid']
@@ -0,0 +1,69 @@
+"""
+Patt Book - Money Tests
+"""
+
+import pytest
+
+import app
+import database
+import money
+
+@pytest.mark.parametrize('value, paise', [
+    ('0.1', 10),
+    (0.1, 10),
+    ('0.005', 1),
+    ('0.004', 0),
+    ('2.675', 268),
+    (' 19.99 ', 1999),
+    (150, 15000),
+    ('-0.005', -1),
+])
+def test_to_paise_rounds_half_up_to_the_paisa(value, paise):
+    assert money.to_paise(value) == paise
+
+@pytest.mark.parametrize('value', ['abc', '', None, True, 'NaN', 'Infinity', '1e30', -1e30])
+def test_to_paise_rejects_non_numbers_and_huge_amounts(value):
+    with pytest.raises(ValueError):
+        money.to_paise(value)
+
+def test_to_paise_accepts_the_maximum():
+    assert money.to_paise(money.MAX_AMOUNT_RUPEES) == int(money.MAX_AMOUNT_RUPEES) * 100
+
+def test_small_amounts_sum_exactly(client, auth_headers):
+    for _ in range(10):
+        body = client.post('/api/debtors', headers=auth_headers, json={
+            'name': 'Asha', 'phone': '9800000101', 'credit_amount': 0.1
+        }).get_json()
+    assert body['total_due'] == 1.0
+
+def test_huge_amount_is_rejected_without_failing_the_sync(client, auth_headers):
+    body = client.post('/api/sync', headers=auth_headers, json={'operations': [
+        {'key': 'a', 'type': 'credit', 'data': {'name': 'Asha', 'phone': '9800000102', 'credit_amount': '1e30'}},
+        {'key': 'b', 'type': 'credit', 'data': {'name': 'Asha', 'phone': '9800000102', 'credit_amount': '25.50'}},
+    ]}).get_json()
+
+    assert body['success']
+    assert [result['success'] for result in body['results']] == [False, True]
+    assert body['debtors'][0]['total_due'] == 25.5
+
+def test_format_rupees():
+    assert money.format_rupees(123456789) == '1,234,567.89'
+    assert money.format_rupees(-5) == '-0.05'
+
+def test_migrating_a_first_release_database_leaves_it_usable(baseline_database):
+    assert set(money.migrate()) == {'debtors', 'transactions'}
+    database.init_db()
+    assert money.migrate() == []
+
+    client = app.app.test_client()
+    headers = {'Authorization': f'Bearer {app.generate_jwt_token(1)}'}
+    body = client.get('/api/debtors', headers=headers).get_json()
+    assert body['success'], body
+    assert body['debtors'][0]['total_due'] == 150.5
+
+    body = client.get('/api/debtors/1/transactions', headers=headers).get_json()
+    assert [row['amount'] for row in body['transactions']] == [49.75, 200.25]
+
+    body = client.post('/api/payments', headers=headers, json={'debtor_id': 1, 'amount': 50.5}).get_json()
+    assert body['success'], body
+    assert client.get('/api/debtors', headers=headers).get_json()['debtors'][0]['total_due'] == 100.0
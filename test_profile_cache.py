@@ -0,0 +1,67 @@
+"""
+Patt Book - Retailer Profile Cache Tests
+"""
+
+import pytest
+
+import profile_cache
+import repository
+from profile_cache import RetailerProfileCache, retailer_cache
+
+class FakeClock:
+    """Stands in for the time module inside profile_cache"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(profile_cache, 'time', clock)
+    return clock
+
+def shop_name(client, auth_headers):
+    body = client.get('/api/settings', headers=auth_headers).get_json()
+    assert body['success'], body
+    return body['retailer']['shop_name']
+
+def update_settings(client, auth_headers, name):
+    body = client.put('/api/settings', headers=auth_headers, json={
+        'shop_name': name, 'shop_address': 'Market Road'
+    }).get_json()
+    assert body['success'], body
+
+def test_settings_update_is_read_back_at_once(client, auth_headers):
+    assert shop_name(client, auth_headers) == 'Test Stores'
+    assert shop_name(client, auth_headers) == 'Test Stores'
+    assert retailer_cache.stats()['hits'] >= 1
+
+    update_settings(client, auth_headers, 'New Stores')
+
+    assert shop_name(client, auth_headers) == 'New Stores'
+
+def test_other_workers_drop_their_copy_after_an_update(client, auth_headers, db, retailer_id):
+    other_worker = RetailerProfileCache(version_check_seconds=0)
+    assert other_worker.get_shop_name(db, retailer_id) == 'Test Stores'
+    db.commit()
+
+    update_settings(client, auth_headers, 'New Stores')
+
+    assert other_worker.get_shop_name(db, retailer_id) == 'New Stores'
+    assert other_worker.stats()['invalidations'] == 1
+
+def test_entries_expire_after_the_ttl(db, retailer_id, clock):
+    cache = RetailerProfileCache(ttl_seconds=300, version_check_seconds=3600)
+    assert cache.get_shop_name(db, retailer_id) == 'Test Stores'
+    # Changed without bumping the version, so only the TTL can notice
+    repository.update_retailer_profile(db, retailer_id, 'New Stores', 'Market Road', None)
+    db.commit()
+
+    clock.now += 299
+    assert cache.get_shop_name(db, retailer_id) == 'Test Stores'
+    clock.now += 2
+    assert cache.get_shop_name(db, retailer_id) == 'New Stores'
+    assert cache.stats()['expired'] == 1
@@ -0,0 +1,130 @@
+"""
+Patt Book - Rate Limiter Tests
+"""
+
+import sqlite3
+
+import pytest
+
+import app
+import rate_limiter
+from rate_limiter import LoadShedder, SQLiteTokenBucketLimiter, TokenBucketLimiter
+
+class FakeClock:
+    """Stands in for the time module inside rate_limiter"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+@pytest.fixture
+def otp_limits(monkeypatch):
+    """Fresh OTP limiters and shedder, so no test sees another's buckets"""
+    limits = {
+        'phone': TokenBucketLimiter('otp_phone', 3, 60),
+        'ip': TokenBucketLimiter('otp_ip', 5, 30),
+        'shedder': LoadShedder(1),
+    }
+    monkeypatch.setattr(app, 'otp_phone_limiter', limits['phone'])
+    monkeypatch.setattr(app, 'otp_ip_limiter', limits['ip'])
+    monkeypatch.setattr(app, 'otp_load_shedder', limits['shedder'])
+    return limits
+
+def bucket_names(path):
+    with sqlite3.connect(path) as db:
+        return sorted(row[0] for row in db.execute('SELECT bucket FROM rate_limit_buckets'))
+
+def test_consume_deletes_idle_buckets_periodically(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    limiter = SQLiteTokenBucketLimiter('otp_phone', 3, 60, database_path=path, cleanup_seconds=0)
+    other = SQLiteTokenBucketLimiter('otp_ip', 20, 30, database_path=path)
+
+    limiter.consume('9800000001')
+    other.consume('10.0.0.1')
+    # Idle for longer than a full refill (3 tokens at one a minute)
+    with sqlite3.connect(path) as db:
+        db.execute('UPDATE rate_limit_buckets SET updated_at = updated_at - 181')
+
+    limiter.consume('9800000002')
+
+    # Only this limiter's idle bucket goes; the other limiter's refill is longer
+    assert bucket_names(path) == ['otp_ip:10.0.0.1', 'otp_phone:9800000002']
+
+def test_cleanup_waits_for_the_interval(tmp_path):
+    path = str(tmp_path / 'limits.db')
+    limiter = SQLiteTokenBucketLimiter('otp_phone', 3, 60, database_path=path, cleanup_seconds=3600)
+
+    limiter.consume('9800000001')
+    with sqlite3.connect(path) as db:
+        db.execute('UPDATE rate_limit_buckets SET updated_at = updated_at - 181')
+    limiter.consume('9800000002')
+
+    assert bucket_names(path) == ['otp_phone:9800000001', 'otp_phone:9800000002']
+
+def test_token_bucket_allows_a_burst_then_refills(clock):
+    limiter = TokenBucketLimiter('otp_phone', 2, 60)
+
+    assert limiter.consume('9800000001') == (True, 0)
+    assert limiter.consume('9800000001') == (True, 0)
+    assert limiter.consume('9800000001') == (False, 60)
+    assert limiter.consume('9800000002') == (True, 0)
+
+    clock.now += 45
+    assert limiter.consume('9800000001') == (False, 15)
+    clock.now += 15
+    assert limiter.consume('9800000001') == (True, 0)
+
+def test_token_bucket_evicts_the_least_recently_used_key(clock):
+    limiter = TokenBucketLimiter('otp_phone', 1, 60, max_keys=2)
+    limiter.consume('a')
+    limiter.consume('b')
+    limiter.consume('a')
+    limiter.consume('c')
+
+    # a was used more recently than b, so it kept its empty bucket and b starts over
+    assert limiter.consume('a') == (False, 60)
+    assert limiter.consume('b') == (True, 0)
+
+def test_login_is_limited_per_phone_with_retry_after(client, otp_limits):
+    for _ in range(3):
+        assert client.post('/api/auth/login', json={'phone': '9800000011'}).status_code == 200
+
+    response = client.post('/api/auth/login', json={'phone': '9800000011'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '60'
+    assert not response.get_json()['success']
+    assert client.post('/api/auth/login', json={'phone': '9800000012'}).status_code == 200
+
+def test_signup_is_limited_per_ip_with_retry_after(client, otp_limits):
+    for index in range(5):
+        response = client.post('/api/auth/signup', json={'phone': f'980000002{index}'})
+        assert response.status_code == 200
+
+    response = client.post('/api/auth/signup', json={'phone': '9800000029'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+    assert response.get_json()['message'] == 'Too many OTP requests. Please try again later.'
+
+def test_requests_beyond_the_in_flight_cap_are_shed(client, otp_limits):
+    shedder = otp_limits['shedder']
+    assert shedder.acquire()
+
+    response = client.post('/api/auth/login', json={'phone': '9800000031'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    # Shed before the limiters, so the attempt cost the phone nothing
+    assert otp_limits['phone'].consume('9800000031', 3) == (True, 0)
+
+    shedder.release()
+    assert client.post('/api/auth/login', json={'phone': '9800000032'}).status_code == 200
@@ -0,0 +1,194 @@
+"""
+Patt Book - Reminder Dispatch Tests
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+
+import reminders
+import whatsapp_service
+
+def add_credit(client, auth_headers, phone, amount):
+    body = client.post('/api/debtors', headers=auth_headers, json={
+        'name': 'Asha', 'phone': phone, 'credit_amount': amount
+    }).get_json()
+    assert body['success'], body
+    return body
+
+def backdate_ledgers(db):
+    """Move every ledger into the past, so campaigns see the debtors as inactive"""
+    db.execute("UPDATE transactions SET created_at = '2000-01-01 00:00:00'")
+    db.commit()
+
+def recipients(db, campaign_id):
+    return {row['phone']: row for row in reminders.get_campaign_recipients(db, campaign_id)}
+
+def test_claim_skips_settled_debtors_and_sends_current_balance(client, auth_headers, db, retailer_id, monkeypatch):
+    add_credit(client, auth_headers, '9800000061', 500)
+    add_credit(client, auth_headers, '9800000062', 200)
+    backdate_ledgers(db)
+    campaign_id, total = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+    assert total == 2
+
+    # Balances change after the campaign was queued
+    db.execute("UPDATE debtors SET total_due = 0 WHERE phone = '9800000061'")
+    db.execute("UPDATE debtors SET total_due = 35050 WHERE phone = '9800000062'")
+    db.commit()
+
+    sent = []
+    monkeypatch.setattr(whatsapp_service, 'send_payment_reminder_notification',
+                        lambda name, shop, balance, phone, raise_throttled=False: sent.append((phone, balance)) or True)
+    reminders.run_worker(once=True)
+
+    assert sent == [('9800000062', '350.50')]
+    rows = recipients(db, campaign_id)
+    assert rows['9800000061']['status'] == 'failed'
+    assert rows['9800000061']['attempts'] == 0
+    assert rows['9800000062']['status'] == 'sent'
+    assert rows['9800000062']['amount'] == 350.5
+
+    progress = reminders.get_campaign_progress(db, retailer_id, campaign_id)
+    assert progress['status'] == 'completed'
+    assert progress['percent_complete'] == 100.0
+
+def test_rate_limited_sends_back_off_without_using_attempts(client, auth_headers, db, retailer_id, monkeypatch):
+    add_credit(client, auth_headers, '9800000071', 100)
+    backdate_ledgers(db)
+    campaign_id, _ = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+
+    responses = [whatsapp_service.WhatsAppThrottled(0.01)] * (reminders.REMINDER_MAX_ATTEMPTS + 1) + [True]
+    def send(name, shop, balance, phone, raise_throttled=False):
+        assert raise_throttled
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+    monkeypatch.setattr(whatsapp_service, 'send_payment_reminder_notification', send)
+
+    reminders.run_worker(once=True)
+
+    row = recipients(db, campaign_id)['9800000071']
+    assert row['status'] == 'sent'
+    assert row['attempts'] == 1
+    assert responses == []
+
+def throttled_always(name, shop, balance, phone, raise_throttled=False):
+    raise whatsapp_service.WhatsAppThrottled(0.01)
+
+def test_persistent_rate_limiting_uses_up_the_attempts(client, auth_headers, db, retailer_id, monkeypatch):
+    add_credit(client, auth_headers, '9800000072', 100)
+    backdate_ledgers(db)
+    campaign_id, _ = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+    monkeypatch.setattr(reminders, 'REMINDER_MAX_THROTTLE_RETRIES', 2)
+    monkeypatch.setattr(whatsapp_service, 'send_payment_reminder_notification', throttled_always)
+
+    reminders.run_worker(once=True)
+
+    row = recipients(db, campaign_id)['9800000072']
+    assert row['status'] == 'failed'
+    assert row['attempts'] == reminders.REMINDER_MAX_ATTEMPTS
+    assert row['error'] == 'WhatsApp API kept rate limiting the message'
+    assert reminders.get_campaign_progress(db, retailer_id, campaign_id)['status'] == 'completed'
+
+def test_pausing_stops_rate_limited_retries(client, auth_headers, db, retailer_id, monkeypatch):
+    add_credit(client, auth_headers, '9800000073', 100)
+    backdate_ledgers(db)
+    campaign_id, _ = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+
+    calls = []
+    def pause_then_throttle(name, shop, balance, phone, raise_throttled=False):
+        calls.append(phone)
+        other = reminders.get_db()
+        reminders.set_campaign_status(other, retailer_id, campaign_id, 'paused', ('running',))
+        other.commit()
+        other.close()
+        raise whatsapp_service.WhatsAppThrottled(0.01)
+    monkeypatch.setattr(whatsapp_service, 'send_payment_reminder_notification', pause_then_throttle)
+
+    reminders.run_worker(once=True)
+
+    assert calls == ['9800000073']
+    row = recipients(db, campaign_id)['9800000073']
+    assert row['status'] == 'pending'
+    assert row['attempts'] == 0
+    assert reminders.get_campaign_progress(db, retailer_id, campaign_id)['status'] == 'paused'
+
+def test_only_stale_claims_are_requeued(client, auth_headers, db, retailer_id):
+    add_credit(client, auth_headers, '9800000091', 100)
+    add_credit(client, auth_headers, '9800000092', 100)
+    backdate_ledgers(db)
+    campaign_id, _ = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+    reminders.claim_recipients(db, campaign_id, 2)
+    # The first claim's worker died long ago; the second is still sending
+    stale = datetime.utcnow() - timedelta(seconds=reminders.REMINDER_CLAIM_TIMEOUT_SECONDS + 60)
+    db.execute("UPDATE reminder_recipients SET claimed_at = ? WHERE phone = '9800000091'", (stale,))
+    db.commit()
+
+    reminders.requeue_interrupted(db)
+
+    rows = recipients(db, campaign_id)
+    assert rows['9800000091']['status'] == 'pending'
+    assert rows['9800000092']['status'] == 'sending'
+
+    # A campaign is not completed while another worker still has recipients in flight
+    db.execute("UPDATE reminder_recipients SET status = 'sent' WHERE phone = '9800000091'")
+    db.commit()
+    assert reminders.dispatch_campaign(db, None, campaign_id) == 0
+    assert reminders.get_campaign_progress(db, retailer_id, campaign_id)['status'] == 'running'
+
+def broken_claim(db, campaign_id, limit):
+    raise RuntimeError('boom')
+
+def test_worker_survives_unexpected_errors(client, auth_headers, db, retailer_id, monkeypatch, caplog):
+    add_credit(client, auth_headers, '9800000081', 100)
+    backdate_ledgers(db)
+    campaign_id, _ = reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+    monkeypatch.setattr(reminders, 'claim_recipients', broken_claim)
+
+    with caplog.at_level(logging.ERROR, logger='reminders'):
+        reminders.run_worker(once=True)
+
+    [record] = [record for record in caplog.records if record.name == 'reminders']
+    assert record.getMessage() == 'Error dispatching reminder campaign'
+    assert record.campaign_id == campaign_id
+    assert 'RuntimeError: boom' in caplog.text
+    assert reminders.get_campaign_progress(db, retailer_id, campaign_id)['status'] == 'running'
+    row = recipients(db, campaign_id)['9800000081']
+    assert (row['status'], row['attempts']) == ('pending', 0)
+
+class StopWorker(Exception):
+    pass
+
+def test_failing_campaign_is_retried_after_a_back_off(client, auth_headers, db, retailer_id, monkeypatch):
+    add_credit(client, auth_headers, '9800000082', 100)
+    backdate_ledgers(db)
+    reminders.create_campaign(db, retailer_id, 'Test Stores', 0, 0)
+    db.commit()
+
+    claims = []
+    def failing_claim(db, campaign_id, limit):
+        claims.append(campaign_id)
+        raise RuntimeError('boom')
+    monkeypatch.setattr(reminders, 'claim_recipients', failing_claim)
+
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 3:
+            raise StopWorker
+    monkeypatch.setattr(reminders.time, 'sleep', sleep)
+
+    with pytest.raises(StopWorker):
+        reminders.run_worker()
+
+    # The poll loop idles instead of calling the failing campaign again straight away
+    assert len(claims) == 1
+    assert sleeps == [reminders.REMINDER_POLL_SECONDS] * 3
@@ -0,0 +1,79 @@
+"""
+Patt Book - Schema Tests
+"""
+
+import pytest
+
+import app
+import database
+import repository
+
+sqlite_only = pytest.mark.skipif(database.DATABASE_BACKEND != 'sqlite', reason='upgrade_schema() is for SQLite')
+
+def test_init_db_creates_every_table(db):
+    tables = repository.list_tables(db)
+    for table in database.TABLES:
+        assert table in tables
+    for table in app.REQUIRED_TABLES:
+        assert table in tables
+
+def test_init_db_keeps_existing_data(db, retailer_id):
+    database.init_db()
+    database.init_db()
+    assert db.execute('SELECT shop_name FROM retailers WHERE id = ?', (retailer_id,)).fetchone()[0] == 'Test Stores'
+
+def test_reset_db_empties_every_table(db, retailer_id):
+    db.close()
+    database.reset_db()
+
+    fresh = database.get_db()
+    try:
+        assert fresh.execute('SELECT COUNT(*) FROM retailers').fetchone()[0] == 0
+        assert set(database.TABLES) <= set(repository.list_tables(fresh))
+    finally:
+        fresh.close()
+
+def test_init_db_upgrades_a_first_release_database(baseline_database, client):
+    database.init_db()
+
+    auth_headers = {'Authorization': f'Bearer {app.generate_jwt_token(1)}'}
+
+    body = client.get('/api/debtors', headers=auth_headers).get_json()
+    assert body['success'], body
+    assert body['debtors'][0]['total_due'] == 150.5
+    body = client.post('/api/payments', headers=auth_headers, json={'debtor_id': 1, 'amount': 150.5}).get_json()
+    assert body['success'], body
+    body = client.get('/api/debtors/1/transactions', headers=auth_headers).get_json()
+    assert [row['amount'] for row in body['transactions']] == [150.5, 49.75, 200.25]
+
+def test_upgrade_schema_is_idempotent(baseline_database):
+    db = database.get_db()
+    try:
+        changes = database.upgrade_schema(db)
+        db.commit()
+        assert 'rebuilt transactions' in changes
+        assert 'rebuilt debtors' in changes
+        assert 'archived_through' in {row[1] for row in db.execute('PRAGMA table_info(debtors)')}
+        assert database.upgrade_schema(db) == []
+    finally:
+        db.close()
+
+@sqlite_only
+def test_upgrade_schema_adds_missing_nullable_columns(db):
+    db.execute('ALTER TABLE debtors DROP COLUMN archived_through')
+
+    assert database.upgrade_schema(db) == ['added debtors.archived_through']
+
+@pytest.mark.skipif(database.DATABASE_BACKEND != 'postgresql', reason='PostgreSQL upgrades')
+def test_init_db_upgrades_older_postgresql_tables(db):
+    import postgres_backend
+    db.execute('ALTER TABLE debtors DROP COLUMN archived_through')
+    db.execute("""ALTER TABLE transactions DROP CONSTRAINT transactions_type_check,
+                  ADD CONSTRAINT transactions_type_check CHECK(type IN ('credit', 'payment'))""")
+    db.commit()
+    assert database.missing_columns(db) == ['debtors.archived_through']
+    db.commit()
+
+    assert len(postgres_backend.init_db()) == 2
+    assert postgres_backend.init_db() == []
+    assert database.missing_columns(db) == []
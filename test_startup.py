@@ -0,0 +1,83 @@
+"""
+Patt Book - Startup Tests
+Importing app.py and creating the app must not touch the database or network
+"""
+
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter, so nothing earlier in the test session has connected yet
+IMPORT_SCRIPT = '''
+import socket, sqlite3
+
+def refuse(*args, **kwargs):
+    raise AssertionError('connected while importing the app')
+
+sqlite3.connect = refuse
+socket.socket.connect = refuse
+socket.create_connection = refuse
+
+import app
+app.create_app({'TESTING': True})
+
+import database
+if database.DATABASE_BACKEND == 'postgresql':
+    import postgres_backend
+    assert postgres_backend._pool is None, 'PostgreSQL pool opened while importing the app'
+print('ok')
+'''
+
+READYZ_SCRIPT = '''
+import logging
+import app
+# The log writer thread shares stdout and could split the line below
+logging.disable(logging.CRITICAL)
+response = app.app.test_client().get('/readyz')
+print('readyz', response.status_code, response.get_json()['error'])
+'''
+
+def run_fresh(script, tmp_path):
+    """Run script in a new interpreter from an empty directory (the test's own database lives in tmp_path)"""
+    cwd = tmp_path / 'fresh'
+    cwd.mkdir()
+    env = dict(os.environ, PYTHONPATH=REPO_DIR, LOG_FORMAT='text')
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=cwd, env=env, capture_output=True, text=True, timeout=60
+    )
+    return result, cwd
+
+def test_import_and_create_app_do_not_connect(tmp_path):
+    result, cwd = run_fresh(IMPORT_SCRIPT, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith('ok')
+    assert not (cwd / 'retail_app.db').exists()
+
+def test_readyz_reports_a_missing_schema(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    result, _ = run_fresh(READYZ_SCRIPT, tmp_path)
+    assert result.returncode == 0, result.stderr
+    [line] = [line for line in result.stdout.splitlines() if line.startswith('readyz ')]
+    assert line.startswith('readyz 503 Database schema missing tables')
+
+def test_readyz_is_ready_once_the_schema_exists(client):
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert response.get_json()['ready']
+
+def test_readyz_reports_an_outdated_schema(baseline_database, client, monkeypatch):
+    import app
+    import database
+    db = database.get_db()
+    for create_sql in database.SCHEMA.values():
+        db.execute(create_sql)
+    db.commit()
+    db.close()
+    monkeypatch.setitem(app._warm_up_state, 'status', 'cold')
+
+    response = client.get('/readyz')
+
+    assert response.status_code == 503
+    assert response.get_json()['error'] == 'Database schema out of date, missing columns: debtors.archived_through'
@@ -0,0 +1,48 @@
+"""
+Patt Book - Statement Batch Tests
+"""
+
+from datetime import datetime
+
+import database
+import repository
+import statements
+
+def pay_from_another_connection(debtor_id):
+    """Commit a payment of 50 on a separate connection"""
+    other = database.get_db()
+    other.execute(
+        "INSERT INTO transactions (debtor_id, type, amount, description) VALUES (?, 'payment', 5000, '')",
+        (debtor_id,)
+    )
+    other.execute('UPDATE debtors SET total_due = total_due - 5000 WHERE id = ?', (debtor_id,))
+    other.commit()
+    other.close()
+
+def test_load_batch_reads_one_snapshot(client, auth_headers, db, retailer_id, monkeypatch):
+    assert client.post('/api/debtors', headers=auth_headers, json={
+        'name': 'Ravi', 'phone': '9800000091', 'credit_amount': 200
+    }).get_json()['success']
+    debtor_id = db.execute('SELECT id FROM debtors').fetchone()[0]
+    db.commit()
+
+    today = datetime.utcnow().date()
+    period_start, period_end = statements.parse_period(today.strftime('%Y-%m'))
+    job = {'retailer_id': retailer_id, 'period_start': period_start, 'period_end': period_end}
+
+    # The payment lands after the debtors are read but before their ledgers
+    list_statement_debtors = repository.list_statement_debtors
+    def list_then_pay(*args):
+        debtors = list_statement_debtors(*args)
+        pay_from_another_connection(debtor_id)
+        return debtors
+    monkeypatch.setattr(repository, 'list_statement_debtors', list_then_pay)
+
+    payloads, debtors_read, _ = statements.load_batch(db, job, 0, 10)
+
+    assert debtors_read == 1
+    [(_, _, _, opening, closing, rows)] = payloads
+    assert (opening, closing) == (0, 20000)
+    assert [kind for _, kind, _, _ in rows] == ['credit']
+    assert not db.in_transaction
+    assert db.execute('SELECT total_due FROM debtors WHERE id = ?', (debtor_id,)).fetchone()[0] == 15000
@@ -0,0 +1,64 @@
+"""
+Patt Book - Offline Sync Tests
+"""
+
+def sync(client, auth_headers, *operations):
+    return client.post('/api/sync', headers=auth_headers, json={'operations': list(operations)})
+
+def credit(key, amount, phone='9800000131'):
+    return {'key': key, 'type': 'credit', 'data': {'name': 'Asha', 'phone': phone, 'credit_amount': amount}}
+
+def total_due(db, phone='9800000131'):
+    return db.execute('SELECT total_due FROM debtors WHERE phone = ?', (phone,)).fetchone()[0]
+
+def test_queue_is_applied_in_order(client, auth_headers, db):
+    body = sync(client, auth_headers, credit('c1', 100), credit('c2', 50)).get_json()
+    debtor_id = body['debtors'][0]['id']
+
+    body = sync(client, auth_headers, {'key': 'p1', 'type': 'payment', 'data': {'debtor_id': debtor_id, 'amount': 120}}).get_json()
+
+    assert body['success']
+    assert body['results'][0]['success']
+    assert body['debtors'] == [dict(body['debtors'][0], total_due=30.0)]
+    assert total_due(db) == 3000
+
+def test_replayed_queue_is_not_applied_twice(client, auth_headers, db):
+    first = sync(client, auth_headers, credit('c1', 100), credit('c2', 50)).get_json()
+    # The response was lost, so the client sends the same queue again
+    again = sync(client, auth_headers, credit('c1', 100), credit('c2', 50)).get_json()
+
+    assert [result.pop('replayed') for result in again['results']] == [True, True]
+    assert again['results'] == first['results']
+    assert total_due(db) == 15000
+    assert db.execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 2
+
+def test_entry_sent_online_first_is_replayed(client, auth_headers, db):
+    client.post('/api/debtors', headers={**auth_headers, 'Idempotency-Key': 'c1'},
+                json=credit('c1', 100)['data'])
+
+    body = sync(client, auth_headers, credit('c1', 100), credit('c2', 25)).get_json()
+
+    assert body['results'][0]['replayed']
+    assert 'replayed' not in body['results'][1]
+    assert total_due(db) == 12500
+
+def test_invalid_entry_is_reported_and_the_rest_commit(client, auth_headers, db):
+    body = sync(client, auth_headers, credit('c1', 100), credit('bad', -5), credit('c2', 10)).get_json()
+
+    assert body['success']
+    assert [result['success'] for result in body['results']] == [True, False, True]
+    assert [result['key'] for result in body['results']] == ['c1', 'bad', 'c2']
+    assert total_due(db) == 11000
+
+def test_reused_key_with_a_different_entry_is_rejected(client, auth_headers, db):
+    sync(client, auth_headers, credit('c1', 100))
+    body = sync(client, auth_headers, credit('c1', 999)).get_json()
+
+    assert not body['results'][0]['success']
+    assert total_due(db) == 10000
+
+def test_malformed_batch_is_refused_whole(client, auth_headers, db):
+    response = sync(client, auth_headers, credit('c1', 100), {'type': 'credit', 'data': {}})
+
+    assert response.status_code == 400
+    assert db.execute('SELECT COUNT(*) FROM debtors').fetchone()[0] == 0
@@ -3,22 +3,55 @@ Patt Book - WhatsApp OTP Service
 WhatsApp Cloud API Integration for Retailer Authentication & Notifications
 """
 
-import requests
 import random
-import json
 from datetime import datetime, timedelta
-from database_retailer import get_db, hash_otp, cleanup_expired_otps
+from database import get_db, hash_otp, cleanup_expired_otps
+import repository
+import logging
 import os
 
 # WhatsApp Cloud API Configuration
 WHATSAPP_API_VERSION = 'v18.0'
 WHATSAPP_PHONE_NUMBER_ID = os.environ.get('WHATSAPP_PHONE_NUMBER_ID', '')
 WHATSAPP_ACCESS_TOKEN = os.environ.get('WHATSAPP_ACCESS_TOKEN', '')
-WHATSAPP_API_URL = f'https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages'
+# Point at fake_whatsapp_server.py (with TEST_MODE=false) for end-to-end tests
+WHATSAPP_API_BASE_URL = os.environ.get('WHATSAPP_API_BASE_URL', 'https://graph.facebook.com').rstrip('/')
+WHATSAPP_API_URL = f'{WHATSAPP_API_BASE_URL}/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages'
+
+logger = logging.getLogger(__name__)
+# One record per message; sample it with LOG_SAMPLE_RATES under load
+send_logger = logging.getLogger(__name__ + '.sends')
 
 # Test mode for development
 TEST_MODE = os.environ.get('TEST_MODE', 'true').lower() == 'true'
 
+# Keep-alive connections shared by notification senders (one per worker thread)
+WHATSAPP_HTTP_POOL_SIZE = int(os.environ.get('WHATSAPP_HTTP_POOL_SIZE', '32'))
+_http_session = None
+_http_session_pid = None
+
+def get_http_session():
+    """Get this process's pooled HTTP session for WhatsApp API calls"""
+    global _http_session, _http_session_pid
+    if _http_session is None or _http_session_pid != os.getpid():
+        # requests is imported on first send to keep app startup fast
+        import requests
+        from requests.adapters import HTTPAdapter
+        
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WHATSAPP_HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http_session = session
+        _http_session_pid = os.getpid()
+    return _http_session
+
+def reset_http_session():
+    """Drop the pooled HTTP session (e.g. after fork)"""
+    global _http_session, _http_session_pid
+    _http_session = None
+    _http_session_pid = None
+
 def generate_otp():
     """Generate 6-digit OTP"""
     return str(random.randint(100000, 999999))
@@ -30,7 +63,7 @@ def send_whatsapp_otp(phone_number, otp):
         clean_phone = phone_number.replace('+', '').replace(' ', '').replace('-', '')
         
         if TEST_MODE or not WHATSAPP_ACCESS_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-            print(f"TEST MODE - WhatsApp OTP would be sent to {clean_phone}: {otp}")
+            send_logger.info("TEST MODE - WhatsApp OTP would be sent", extra={'phone': clean_phone, 'otp': otp})
             return True
         
         # WhatsApp Cloud API request
@@ -66,17 +99,17 @@ def send_whatsapp_otp(phone_number, otp):
             }
         }
         
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=data)
+        response = get_http_session().post(WHATSAPP_API_URL, headers=headers, json=data, timeout=10)
         
         if response.status_code == 200:
-            print(f"WhatsApp OTP sent successfully to {clean_phone}")
+            send_logger.info("WhatsApp OTP sent", extra={'phone': clean_phone})
             return True
         else:
-            print(f"WhatsApp OTP failed: {response.status_code} - {response.text}")
+            logger.warning("WhatsApp OTP failed", extra={'phone': clean_phone, 'status_code': response.status_code, 'response': response.text[:500]})
             return False
             
-    except Exception as e:
-        print(f"Error sending WhatsApp OTP: {e}")
+    except Exception:
+        logger.exception("Error sending WhatsApp OTP")
         return False
 
 def store_otp(phone, otp):
@@ -86,22 +119,16 @@ def store_otp(phone, otp):
         # Clean up expired OTPs first
         cleanup_expired_otps()
         
-        # Delete any existing OTP for this phone
-        db.execute('DELETE FROM otp_requests WHERE phone = ?', (phone,))
-        
-        # Store new OTP
+        # Store new OTP, replacing any existing OTP for this phone
         expires_at = datetime.now() + timedelta(minutes=5)
         otp_hash = hash_otp(otp)
         
-        db.execute(
-            'INSERT INTO otp_requests (phone, otp_hash, expires_at) VALUES (?, ?, ?)',
-            (phone, otp_hash, expires_at)
-        )
+        repository.save_otp_request(db, phone, otp_hash, expires_at)
         
         db.commit()
         return True
-    except Exception as e:
-        print(f"Error storing OTP: {e}")
+    except Exception:
+        logger.exception("Error storing OTP")
         db.rollback()
         return False
     finally:
@@ -112,62 +139,70 @@ def verify_otp(phone, otp):
     db = get_db()
     try:
         # Get OTP record
-        result = db.execute(
-            'SELECT otp_hash, expires_at, attempts FROM otp_requests WHERE phone = ?',
-            (phone,)
-        ).fetchone()
+        result = repository.get_otp_request(db, phone)
         
         if not result:
             return {'success': False, 'message': 'No OTP found for this phone number'}
         
         # Check if expired
-        if datetime.now() > datetime.fromisoformat(result['expires_at']):
-            db.execute('DELETE FROM otp_requests WHERE phone = ?', (phone,))
+        if datetime.now() > datetime.fromisoformat(result.expires_at):
+            repository.delete_otp_requests(db, phone)
             db.commit()
             return {'success': False, 'message': 'OTP expired. Please request a new one.'}
         
         # Check attempts
-        if result['attempts'] >= 3:
-            db.execute('DELETE FROM otp_requests WHERE phone = ?', (phone,))
+        if result.attempts >= 3:
+            repository.delete_otp_requests(db, phone)
             db.commit()
             return {'success': False, 'message': 'Too many attempts. Please request a new OTP.'}
         
         # Verify OTP
         otp_hash = hash_otp(otp)
-        if otp_hash == result['otp_hash']:
+        if otp_hash == result.otp_hash:
             # OTP verified - delete it
-            db.execute('DELETE FROM otp_requests WHERE phone = ?', (phone,))
+            repository.delete_otp_requests(db, phone)
             db.commit()
             return {'success': True, 'message': 'OTP verified successfully'}
         else:
             # Increment attempts
-            db.execute(
-                'UPDATE otp_requests SET attempts = attempts + 1 WHERE phone = ?',
-                (phone,)
-            )
+            repository.increment_otp_attempts(db, result.id)
             db.commit()
-            remaining_attempts = 3 - (result['attempts'] + 1)
+            remaining_attempts = 3 - (result.attempts + 1)
             return {
                 'success': False, 
                 'message': f'Invalid OTP. {remaining_attempts} attempts remaining.'
             }
             
-    except Exception as e:
-        print(f"Error verifying OTP: {e}")
+    except Exception:
+        logger.exception("Error verifying OTP")
         return {'success': False, 'message': 'Verification failed'}
     finally:
         db.close()
 
-def send_whatsapp_notification(phone_number, template_name, parameters):
-    """Send WhatsApp notification (async)"""
+class WhatsAppThrottled(Exception):
+    """The Cloud API answered 429; retry_after is how many seconds it asked us to wait"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'WhatsApp API rate limit hit, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+def parse_retry_after(value, default=1.0):
+    """Seconds to wait from a Retry-After header (HTTP dates fall back to the default)"""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+def send_whatsapp_notification(phone_number, template_name, parameters, raise_throttled=False):
+    """Send WhatsApp notification (async); with raise_throttled a 429 raises WhatsAppThrottled"""
     try:
         # Clean phone number
         clean_phone = phone_number.replace('+', '').replace(' ', '').replace('-', '')
         
         if TEST_MODE or not WHATSAPP_ACCESS_TOKEN or not WHATSAPP_PHONE_NUMBER_ID:
-            print(f"TEST MODE - WhatsApp notification would be sent to {clean_phone}")
-            print(f"Template: {template_name}")
-            print(f"Parameters: {parameters}")
+            send_logger.info("TEST MODE - WhatsApp notification would be sent", extra={
+                'phone': clean_phone, 'template': template_name, 'parameters': parameters
+            })
             return True
         
         # WhatsApp Cloud API request
@@ -194,18 +229,25 @@ def send_whatsapp_notification(phone_number, template_name, parameters):
             }
         }
         
-        # Send asynchronously (non-blocking)
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=data, timeout=10)
+        # Send over the pooled keep-alive session
+        response = get_http_session().post(WHATSAPP_API_URL, headers=headers, json=data, timeout=10)
         
         if response.status_code == 200:
-            print(f"WhatsApp notification sent successfully to {clean_phone}")
+            send_logger.info("WhatsApp notification sent", extra={'phone': clean_phone, 'template': template_name})
             return True
+        elif response.status_code == 429 and raise_throttled:
+            raise WhatsAppThrottled(parse_retry_after(response.headers.get('Retry-After')))
         else:
-            print(f"WhatsApp notification failed: {response.status_code} - {response.text}")
+            logger.warning("WhatsApp notification failed", extra={
+                'phone': clean_phone, 'template': template_name,
+                'status_code': response.status_code, 'response': response.text[:500]
+            })
             return False
             
-    except Exception as e:
-        print(f"Error sending WhatsApp notification: {e}")
+    except WhatsAppThrottled:
+        raise
+    except Exception:
+        logger.exception("Error sending WhatsApp notification")
         return False
 
 def send_credit_added_notification(customer_name, shop_name, amount, total_due, phone_number):
@@ -229,3 +271,13 @@ def send_payment_recorded_notification(customer_name, shop_name, amount, balance
     ]
     
     return send_whatsapp_notification(phone_number, "PAYMENT_RECORDED", parameters)
+
+def send_payment_reminder_notification(customer_name, shop_name, balance, phone_number, raise_throttled=False):
+    """Send payment reminder notification"""
+    parameters = [
+        {"type": "text", "text": customer_name},
+        {"type": "text", "text": shop_name},
+        {"type": "text", "text": str(balance)}
+    ]
+    
+    return send_whatsapp_notification(phone_number, "PAYMENT_REMINDER", parameters, raise_throttled)